@@ -4,6 +4,12 @@ from flask_ckeditor import CKEditor
 from flask_wtf.csrf import CSRFProtect
 from .config import Config
 from .extensions import db, migrate, mail, login_manager, cache, limiter
+from . import assets, feeds, identity, instrumentation, metrics, page_cache
+from .images import image_ingester
+from .mail_queue import mail_outbox
+from .passwords import password_hasher
+from .login_throttle import login_throttle
+from .replicas import replica_router
 
 
 def create_app():
@@ -12,6 +18,7 @@ def create_app():
 
     # Initialize Extensions
     db.init_app(app)
+    replica_router.init_app(app)
     migrate.init_app(app, db)
     mail.init_app(app)
     Bootstrap5(app)
@@ -20,15 +27,59 @@ def create_app():
     login_manager.init_app(app)
     cache.init_app(app)
     limiter.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    page_cache.init_app(app)
+    assets.init_app(app)
+    feeds.init_app(app)
+    mail_outbox.init_app(app)
+    image_ingester.init_app(app)
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
 
     # Import Models to ensure they are registered with SQLAlchemy
-    from .models import User, BlogPost, Comment, ContactSubmission
+    from .models import (
+        User,
+        BlogPost,
+        PostImage,
+        Comment,
+        ContactSubmission,
+        OutboxMessage,
+        ReplicationHeartbeat,
+    )
 
     # Register Blueprints/Routes
     from .routes import main_bp
 
     app.register_blueprint(main_bp)
 
+    # CLI Commands
+    from .commands import (
+        assets_cli,
+        bench_cli,
+        blog_cli,
+        cache_cli,
+        comments_cli,
+        contacts_cli,
+        images_cli,
+        limits_cli,
+        mail_cli,
+        sanitize_command,
+        search_cli,
+    )
+
+    app.cli.add_command(cache_cli)
+    app.cli.add_command(mail_cli)
+    app.cli.add_command(limits_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(sanitize_command)
+    app.cli.add_command(comments_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(blog_cli)
+    app.cli.add_command(contacts_cli)
+
     # Global Context Processors
     from datetime import datetime
     from flask_login import current_user
@@ -38,6 +89,10 @@ def create_app():
         gravatar = None
         if current_user.is_authenticated:
             gravatar = current_user.avatar(30)
-        return dict(gravatar=gravatar, now=datetime.now())
+        return dict(
+            gravatar=gravatar,
+            now=datetime.now(),
+            deferred_user_content=page_cache.deferring_user_content(),
+        )
 
     return app
@@ -0,0 +1,261 @@
+"""Fingerprinted, precompressed static files (`flask assets build`).
+
+The build copies every file under static/ to static/build/ with a content
+hash in its name (css/styles.css -> build/css/styles.3f9c2a1b7d4e.css).
+For text files it also writes .gz and .br copies, and for images under
+assets/img/ it writes WebP and AVIF copies at a few widths. Everything
+lands in build/manifest.json.
+
+When the manifest exists, `url_for("static", ...)` returns the hashed
+names. Those are served with a one-year `immutable` Cache-Control. The
+.br or .gz file is picked from Accept-Encoding, so nothing is compressed
+per request. Files missing from the manifest are served as before. Old
+builds are kept (unless `--clean`), so pages cached before a deploy still
+find their assets.
+
+Brotli and Pillow are optional: without them the build skips .br files
+or image variants and says so.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from io import BytesIO
+
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+BUILD_DIR = "build"
+MANIFEST = "manifest.json"
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".txt", ".xml", ".map"}
+IMAGE_DIR = "assets/img/"
+RESIZABLE = {".jpg", ".jpeg", ".png"}
+IMAGE_FORMATS = (
+    # (format, mimetype, Pillow save options)
+    ("avif", "image/avif", {"quality": 50}),
+    ("webp", "image/webp", {"quality": 80, "method": 6}),
+)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class Manifest:
+    def __init__(self, data=None):
+        data = data or {}
+        # source name -> hashed name, both relative to static/
+        self.files = data.get("files", {})
+        # hashed name -> encodings with a precompressed copy
+        self.encodings = data.get("encodings", {})
+        # source image -> {format: [[width, hashed name], ...]}, narrowest first
+        self.images = data.get("images", {})
+        self.built = set(self.files.values())
+        for variants in self.images.values():
+            self.built.update(name for sizes in variants.values() for _, name in sizes)
+
+    @classmethod
+    def load(cls, static_folder):
+        try:
+            with open(os.path.join(static_folder, BUILD_DIR, MANIFEST)) as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def to_json(self):
+        return {"files": self.files, "encodings": self.encodings, "images": self.images}
+
+
+def _fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    return f"{BUILD_DIR}/{stem}.{digest}{ext}"
+
+
+def _write(static_folder, name, data):
+    path = os.path.join(static_folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return path
+
+
+def _precompress(static_folder, name, data):
+    """Write the .br/.gz copies that are smaller than `data`; return their encodings."""
+    encodings = []
+    compressors = [("gzip", ".gz", lambda d: gzip.compress(d, 9, mtime=0))]
+    if brotli is not None:
+        compressors.insert(0, ("br", ".br", lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, compress in compressors:
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            _write(static_folder, name + suffix, compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def _image_formats():
+    if Image is None:
+        return []
+    return [fmt for fmt in IMAGE_FORMATS if features.check(fmt[0])]
+
+
+def _resize(static_folder, source, path, widths, formats):
+    variants = {}
+    with Image.open(path) as original:
+        original = original.convert("RGB")
+        targets = {w for w in widths if w < original.width}
+        targets.add(min(original.width, max(widths)))
+        for width in sorted(targets):
+            height = round(original.height * width / original.width)
+            image = original.resize((width, height), Image.LANCZOS)
+            for fmt, _, options in formats:
+                buffer = BytesIO()
+                image.save(buffer, fmt.upper(), **options)
+                data = buffer.getvalue()
+                stem = os.path.splitext(source)[0]
+                name = _fingerprint(f"{stem}.{width}.{fmt}", data)
+                _write(static_folder, name, data)
+                variants.setdefault(fmt, []).append([width, name])
+    return variants
+
+
+def build(static_folder, widths, clean=False, echo=print):
+    """Fingerprint, precompress and resize everything under `static_folder`."""
+    formats = _image_formats()
+    if brotli is None:
+        echo("brotli is not installed: writing .gz copies only.")
+    if Image is None:
+        echo("Pillow is not installed: skipping WebP/AVIF image variants.")
+    elif len(formats) < len(IMAGE_FORMATS):
+        missing = {f[0] for f in IMAGE_FORMATS} - {f[0] for f in formats}
+        echo(f"Pillow cannot write {', '.join(sorted(missing))}; skipping it.")
+
+    manifest = Manifest()
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            source = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            name = _fingerprint(source, data)
+            _write(static_folder, name, data)
+            manifest.files[source] = name
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in COMPRESSIBLE:
+                encodings = _precompress(static_folder, name, data)
+                if encodings:
+                    manifest.encodings[name] = encodings
+            if formats and ext in RESIZABLE and source.startswith(IMAGE_DIR):
+                manifest.images[source] = _resize(static_folder, source, path, widths, formats)
+            echo(f"{source} -> {name}")
+
+    manifest = Manifest(manifest.to_json())
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    with open(os.path.join(build_root, MANIFEST + ".tmp"), "w") as f:
+        json.dump(manifest.to_json(), f, indent=2, sort_keys=True)
+    os.replace(os.path.join(build_root, MANIFEST + ".tmp"), os.path.join(build_root, MANIFEST))
+
+    removed = 0
+    if clean:
+        keep = {os.path.join(static_folder, name) for name in manifest.built}
+        keep |= {
+            os.path.join(static_folder, name + suffix)
+            for name, encodings in manifest.encodings.items()
+            for encoding, suffix in ENCODINGS
+            if encoding in encodings
+        }
+        for root, _, files in os.walk(build_root):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if filename != MANIFEST and path not in keep:
+                    os.remove(path)
+                    removed += 1
+    return manifest, removed
+
+
+def _manifest():
+    return current_app.extensions["assets"]
+
+
+def _hashed_url(endpoint, values):
+    if endpoint == "static":
+        name = _manifest().files.get(values.get("filename"))
+        if name is not None:
+            values["filename"] = name
+
+
+def serve_static(filename):
+    """The static view: built files are immutable and sent precompressed."""
+    manifest = _manifest()
+    if filename not in manifest.built:
+        return current_app.send_static_file(filename)
+    available = manifest.encodings.get(filename, ())
+    path, encoding = filename, None
+    for candidate, suffix in ENCODINGS:
+        if candidate in available and request.accept_encodings[candidate]:
+            path, encoding = filename + suffix, candidate
+            break
+    response = send_from_directory(
+        current_app.static_folder,
+        path,
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        max_age=current_app.config["STATIC_IMMUTABLE_MAX_AGE"],
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if available:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _image_set(urls, fallback, fallback_type):
+    entries = [f"url('{url}') type('{mimetype}')" for url, mimetype in urls]
+    entries.append(f"url('{fallback}') type('{fallback_type}')")
+    return f"image-set({', '.join(entries)})"
+
+
+def masthead_background(filename, selector="header.masthead"):
+    """A <style> block setting a static image as the masthead background.
+
+    With a build, browsers get AVIF or WebP at the width that fits the
+    viewport; the original is the fallback.
+    """
+    fallback = url_for("static", filename=filename)
+    rules = [f"{selector} {{ background-image: url('{fallback}'); }}"]
+    variants = _manifest().images.get(filename, {})
+    formats = [(fmt, mimetype) for fmt, mimetype, _ in IMAGE_FORMATS if fmt in variants]
+    if formats:
+        fallback_type = mimetypes.guess_type(filename)[0]
+        widths = [width for width, _ in variants[formats[0][0]]]
+        for i, width in enumerate(reversed(widths)):
+            urls = [
+                (url_for("static", filename=dict(variants[fmt])[width]), mimetype)
+                for fmt, mimetype in formats
+            ]
+            rule = (
+                f"{selector} {{ background-image: "
+                f"{_image_set(urls, fallback, fallback_type)}; }}"
+            )
+            rules.append(rule if i == 0 else f"@media (max-width: {width}px) {{ {rule} }}")
+    return Markup("<style>\n" + "\n".join(rules) + "\n</style>")
+
+
+def init_app(app):
+    app.extensions["assets"] = Manifest.load(app.static_folder)
+    app.url_defaults(_hashed_url)
+    app.view_functions["static"] = serve_static
+    app.add_template_global(masthead_background)
@@ -0,0 +1,691 @@
+"""Seeded benchmark dataset and load harness (`flask bench ...`).
+
+`seed` fills the database with users, posts and comments generated from a
+fixed random seed, so two runs of `flask bench seed` produce the same
+content. One post gets a large number of comments.
+
+`run_benchmark` sends requests to the hot paths and reports throughput,
+latency percentiles and SQL queries per request. The requests go either to
+the app's test client in this process or over HTTP to a gunicorn server.
+Queries are read from /metrics before and after each scenario, so both
+targets are measured the same way. Results are saved as JSON and
+`compare_results` diffs two of them.
+"""
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from flask import current_app
+from sqlalchemy import func, insert, select
+
+from .extensions import cache, db, limiter
+from .fragments import bump_feed_version, bump_listing_version
+from .models import BlogPost, Comment, User
+from .pagination import encode_cursor
+from .passwords import password_hasher
+from .sanitize import POLICY_VERSION
+from .search import index_posts
+
+BENCH_PASSWORD = "bench-password"
+RESULTS_FORMAT = 1
+
+WORDS = (
+    "the of and to in is that it for on with as was by at be this are from or "
+    "an have not but they which one you all were we when there can more been "
+    "has their if will would what so about out up into time only new some "
+    "could these two may first then do any like my now over such our man "
+    "even most made after also did many before must through back years where "
+    "much your way well down should because each just those people how too "
+    "little state good very make world still own see men work long get here "
+    "between both life being under never day same another know while last "
+    "might us great old year off come since against go came right used take "
+    "three python flask database query cache latency server request page "
+    "index template worker session cursor render"
+).split()
+
+# Requests made only to set up or measure a scenario.
+HELPER_ENDPOINTS = {"main.csrf_token", "main.metrics_endpoint"}
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, n)))
+
+
+def _sentences(rng, n_words):
+    sentences = []
+    while n_words > 0:
+        length = min(n_words, rng.randint(6, 22))
+        sentence = _words(rng, length)
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        n_words -= length
+    return " ".join(sentences)
+
+
+def _length(rng, mean):
+    # Log-normal: most texts are near the mean, a few are much longer.
+    return max(5, int(rng.lognormvariate(math.log(mean), 0.6)))
+
+
+def _post_body(rng, n_words):
+    """HTML with paragraphs, headings, lists and emphasis, as CKEditor makes."""
+    parts = []
+    while n_words > 0:
+        kind = rng.random()
+        if kind < 0.1:
+            parts.append(f"<h2>{_words(rng, rng.randint(2, 6)).capitalize()}</h2>")
+        elif kind < 0.2:
+            items = "".join(
+                f"<li>{_words(rng, rng.randint(3, 10))}</li>"
+                for _ in range(rng.randint(2, 5))
+            )
+            parts.append(f"<ul>{items}</ul>")
+            n_words -= 20
+        else:
+            length = min(n_words, rng.randint(40, 120))
+            text = _sentences(rng, length)
+            if rng.random() < 0.3:
+                words = text.split(" ")
+                i = rng.randrange(len(words))
+                words[i] = f"<strong>{words[i]}</strong>"
+                text = " ".join(words)
+            parts.append(f"<p>{text}</p>")
+            n_words -= length
+    return "".join(parts)
+
+
+def _insert(model, rows, batch_size):
+    """Bulk insert `rows`, returning the new primary keys in order."""
+    ids = []
+    for i in range(0, len(rows), batch_size):
+        ids += db.session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows[i:i + batch_size],
+        ).all()
+    return ids
+
+
+def seed(
+    users=200,
+    posts=2000,
+    comments=40000,
+    hot_comments=5000,
+    body_words=600,
+    comment_words=40,
+    random_seed=1,
+    batch_size=1000,
+    echo=print,
+):
+    """Insert a generated dataset and return the id of the hot post."""
+    rng = random.Random(random_seed)
+    started = datetime(2020, 1, 1)
+    # One real hash, shared by every bench user: hashing thousands would
+    # take longer than the rest of the seeding.
+    password = password_hasher.hash(BENCH_PASSWORD)
+
+    user_ids = _insert(
+        User,
+        [
+            {
+                "name": f"{_words(rng, 2).title()} {i}",
+                "email": f"bench-{i}@example.com",
+                "password": password,
+            }
+            for i in range(users)
+        ],
+        batch_size,
+    )
+    echo(f"Inserted {len(user_ids)} users.")
+
+    # Comments are generated first so the posts' denormalized counts can be
+    # inserted with them. Older posts get fewer comments (weight 1/age).
+    step = timedelta(hours=6)
+    post_times = [started + i * step for i in range(posts)]
+    hot = posts - 1
+    per_post = [0] * posts
+    weights = [1 / (posts - i) for i in range(posts)]
+    targets = [hot] * min(hot_comments, comments)
+    targets += rng.choices(range(posts), weights=weights, k=comments - len(targets))
+    comment_rows = []
+    for target in targets:
+        per_post[target] += 1
+        created = post_times[target] + timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+        text = f"<p>{_sentences(rng, _length(rng, comment_words))}</p>"
+        comment_rows.append(
+            {
+                "text": text,
+                "text_raw": text,
+                "sanitize_policy": POLICY_VERSION,
+                "date": created.strftime("%B %d, %Y"),
+                "created_at": created,
+                "author_id": rng.choice(user_ids),
+                "post": target,
+            }
+        )
+    last_comment = {}
+    for row in comment_rows:
+        latest = last_comment.get(row["post"])
+        if latest is None or row["created_at"] > latest:
+            last_comment[row["post"]] = row["created_at"]
+
+    post_rows = []
+    body_bytes = 0
+    for i in range(posts):
+        body = _post_body(rng, _length(rng, body_words))
+        body_bytes += len(body)
+        post_rows.append(
+            {
+                "title": f"{_words(rng, rng.randint(3, 8)).title()} #{i + 1}",
+                "subtitle": _sentences(rng, rng.randint(6, 16))[:250],
+                "img_url": f"https://picsum.photos/seed/bench-{i + 1}/1200/600",
+                "date": post_times[i].strftime("%B %d, %Y"),
+                "created_at": post_times[i],
+                "body": body,
+                "body_raw": body,
+                "sanitize_policy": POLICY_VERSION,
+                "comment_count": per_post[i],
+                "last_comment_at": last_comment.get(i),
+                "author_id": user_ids[0],
+            }
+        )
+    post_ids = _insert(BlogPost, post_rows, batch_size)
+    echo(f"Inserted {len(post_ids)} posts, {body_bytes // posts} bytes of HTML on average.")
+
+    for row in comment_rows:
+        row["post_id"] = post_ids[row.pop("post")]
+    for i in range(0, len(comment_rows), batch_size):
+        db.session.execute(insert(Comment), comment_rows[i:i + batch_size])
+    echo(f"Inserted {len(comment_rows)} comments, {per_post[hot]} on the hot post.")
+
+    for i in range(0, len(post_ids), batch_size):
+        index_posts(
+            db.session.scalars(
+                select(BlogPost).where(BlogPost.id.in_(post_ids[i:i + batch_size]))
+            )
+        )
+    db.session.commit()
+    db.session.expunge_all()
+    bump_listing_version()
+    bump_feed_version()
+    echo("Search index updated.")
+    return post_ids[hot]
+
+
+def reset_database():
+    db.drop_all()
+    db.create_all()
+    cache.clear()
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class Scenario:
+    def __init__(
+        self, name, path, method="GET", form=None, expect=(200,), fresh_session=False
+    ):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.form = form
+        self.expect = expect
+        # Start every request from an empty cookie jar (e.g. logged out).
+        self.fresh_session = fresh_session
+
+
+def build_scenarios():
+    """The requests worth timing, pointed at the current dataset."""
+    posts = db.session.scalar(select(func.count()).select_from(BlogPost))
+    if not posts:
+        raise LookupError("There are no posts; run `flask bench seed` first.")
+    from .routes import COMMENTS_PER_PAGE, POSTS_PER_PAGE
+
+    hot = db.session.execute(
+        select(BlogPost.id, BlogPost.comment_count)
+        .order_by(BlogPost.comment_count.desc(), BlogPost.id)
+        .limit(1)
+    ).one()
+    deep = db.session.execute(
+        select(BlogPost.created_at, BlogPost.id)
+        .order_by(BlogPost.created_at.desc(), BlogPost.id.desc())
+        .offset(max(0, posts - POSTS_PER_PAGE - 1))
+        .limit(1)
+    ).one()
+    last_page = max(1, math.ceil(posts / POSTS_PER_PAGE))
+    scenarios = [
+        Scenario("home", "/"),
+        Scenario("home_deep_offset", f"/?page={last_page}"),
+        Scenario("home_deep_cursor", f"/?after={encode_cursor(deep)}"),
+        Scenario("post_hot", f"/post/{hot.id}"),
+    ]
+    if hot.comment_count > COMMENTS_PER_PAGE:
+        comment = db.session.execute(
+            select(Comment.created_at, Comment.id)
+            .where(Comment.post_id == hot.id)
+            .order_by(Comment.created_at, Comment.id)
+            .offset(hot.comment_count - COMMENTS_PER_PAGE - 1)
+            .limit(1)
+        ).one()
+        scenarios.append(
+            Scenario(
+                "comments_deep",
+                f"/post/{hot.id}/comments?after={encode_cursor(comment)}",
+            )
+        )
+    if db.session.scalar(select(User.id).where(User.email == "bench-0@example.com")):
+        scenarios.append(
+            Scenario(
+                "login",
+                "/login",
+                method="POST",
+                form={"email": "bench-0@example.com", "password": BENCH_PASSWORD},
+                expect=(302,),
+                fresh_session=True,
+            )
+        )
+    scenarios.append(
+        Scenario(
+            "contact",
+            "/contact",
+            method="POST",
+            form={
+                "name": "Bench Client",
+                "number": "555-0100",
+                "email": "bench-client@example.com",
+                "message": "A benchmark message, long enough to validate.",
+            },
+            expect=(302,),
+        )
+    )
+    db.session.rollback()
+    return scenarios
+
+
+class ClientSession:
+    """Requests through the Flask test client, in this process."""
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self.csrf_token = None
+
+    def request(self, method, path, form=None, headers=None):
+        response = self.client.open(path, method=method, data=form, headers=headers)
+        return response.status_code, response.get_data()
+
+    def clear_cookies(self):
+        self.client = self.app.test_client()
+        self.csrf_token = None
+
+
+class HTTPSession:
+    """Requests over one keep-alive HTTP connection, with a cookie jar."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the keep-alive connection; retry once.
+            self.conn.close()
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        payload = response.read()
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, payload
+
+    def clear_cookies(self):
+        self.cookies = {}
+        self.csrf_token = None
+
+
+def _csrf_token(session):
+    if session.csrf_token is None:
+        status, body = session.request("GET", "/csrf-token")
+        if status != 200:
+            raise RuntimeError(f"GET /csrf-token returned {status}")
+        session.csrf_token = json.loads(body)["csrf_token"]
+    return session.csrf_token
+
+
+def _sql_queries(session):
+    """{endpoint: (queries, requests)} from the target's /metrics."""
+    token = os.getenv("METRICS_TOKEN")
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    status, body = session.request("GET", "/metrics", headers=headers)
+    if status != 200:
+        return None
+    totals = {}
+    pattern = re.compile(r'^blog_sql_queries_(sum|count)\{endpoint="([^"]*)"\} (\S+)$')
+    for line in body.decode("utf-8").splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, endpoint, value = match.groups()
+            queries, requests = totals.get(endpoint, (0.0, 0.0))
+            if kind == "sum":
+                queries = float(value)
+            else:
+                requests = float(value)
+            totals[endpoint] = (queries, requests)
+    return totals
+
+
+def _queries_per_request(before, after, requests):
+    if before is None or after is None or not requests:
+        return None
+    queries = sum(
+        total - before.get(endpoint, (0.0, 0.0))[0]
+        for endpoint, (total, _) in after.items()
+        if endpoint not in HELPER_ENDPOINTS
+    )
+    return round(queries / requests, 2)
+
+
+def run_scenario(scenario, new_session, requests, concurrency, warmup):
+    """Send `requests` timed requests from `concurrency` threads."""
+    probe = new_session()
+    for _ in range(warmup):
+        _send(probe, scenario)
+    before = _sql_queries(probe)
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        session = new_session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            seconds, status = _send(session, scenario)
+            with lock:
+                latencies.append(seconds)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    after = _sql_queries(probe)
+    latencies.sort()
+    ms = [1000 * s for s in latencies]
+    return {
+        "method": scenario.method,
+        "path": scenario.path,
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status not in scenario.expect),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 3) if ms else None,
+            "p50": _round(_percentile(ms, 50)),
+            "p95": _round(_percentile(ms, 95)),
+            "p99": _round(_percentile(ms, 99)),
+            "max": _round(ms[-1] if ms else None),
+        },
+        "queries_per_request": _queries_per_request(before, after, len(latencies)),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def _send(session, scenario):
+    """Make one scenario request; only the request itself is timed."""
+    form = None
+    if scenario.fresh_session:
+        session.clear_cookies()
+    if scenario.form is not None:
+        form = dict(scenario.form, csrf_token=_csrf_token(session))
+    started = time.perf_counter()
+    status, _ = session.request(scenario.method, scenario.path, form)
+    return time.perf_counter() - started, status
+
+
+def _overrides(page_cache):
+    """Config for the target app: no rate limits, no mail delivery, and
+    /metrics readable from this host."""
+    return {
+        "RATELIMIT_ENABLED": False,
+        "METRICS_ALLOWED_IPS": "127.0.0.1,::1",
+        "MAIL_OUTBOX_BACKGROUND": False,
+        # Contact notifications need a recipient to be queued.
+        "MAIL_USERNAME": current_app.config["MAIL_USERNAME"] or "bench@example.com",
+        "ANONYMOUS_PAGE_CACHE": page_cache,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class GunicornServer:
+    """A gunicorn process serving this app from the same database."""
+
+    def __init__(self, workers, page_cache):
+        self.workers = workers
+        self.page_cache = page_cache
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+        self.metrics_dir = None
+
+    def __enter__(self):
+        self.metrics_dir = tempfile.mkdtemp(prefix="flask-blog-bench-")
+        env = dict(
+            os.environ,
+            DATABASE_URL=db.engine.url.render_as_string(hide_password=False),
+            METRICS_DIR=self.metrics_dir,
+            # Every request writes its worker's metrics file, so the counts
+            # read after a scenario include all of its requests.
+            METRICS_FLUSH_INTERVAL="0",
+        )
+        for name, value in _overrides(self.page_cache).items():
+            env[name] = str(value).lower() if isinstance(value, bool) else value
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn",
+                "--workers", str(self.workers),
+                "--bind", f"127.0.0.1:{self.port}",
+                "--log-level", "warning",
+                "run:app",
+            ],
+            cwd=os.path.dirname(current_app.root_path),
+            env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {self.process.returncode}")
+            try:
+                status, _ = HTTPSession(self.url).request("GET", "/health")
+                if status == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError("gunicorn did not start within 30 seconds")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(current_app.root_path),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    scenarios,
+    target="client",
+    url=None,
+    workers=2,
+    requests=200,
+    login_requests=20,
+    concurrency=1,
+    warmup=5,
+    page_cache=True,
+    echo=print,
+):
+    """Run every scenario against `target` and return the results document."""
+    app = current_app._get_current_object()
+    results = {
+        "format": RESULTS_FORMAT,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "target": url or target,
+        "options": {
+            "workers": workers if target == "gunicorn" else None,
+            "requests": requests,
+            "login_requests": login_requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "page_cache": page_cache,
+        },
+        "dataset": {
+            "users": db.session.scalar(select(func.count()).select_from(User)),
+            "posts": db.session.scalar(select(func.count()).select_from(BlogPost)),
+            "comments": db.session.scalar(select(func.count()).select_from(Comment)),
+        },
+        "scenarios": {},
+    }
+    db.session.rollback()
+
+    def run_all(new_session):
+        for scenario in scenarios:
+            n = login_requests if scenario.name == "login" else requests
+            result = run_scenario(scenario, new_session, n, concurrency, warmup)
+            results["scenarios"][scenario.name] = result
+            echo(format_result(scenario.name, result))
+
+    if url:
+        run_all(lambda: HTTPSession(url))
+    elif target == "gunicorn":
+        with GunicornServer(workers, page_cache) as server:
+            run_all(lambda: HTTPSession(server.url))
+    else:
+        overrides = _overrides(page_cache)
+        saved = {name: app.config[name] for name in overrides}
+        enabled = limiter.enabled
+        app.config.update(overrides)
+        limiter.enabled = False
+        try:
+            run_all(lambda: ClientSession(app))
+        finally:
+            app.config.update(saved)
+            limiter.enabled = enabled
+    return results
+
+
+HEADER = (
+    f"{'scenario':<20}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    f"{'queries':>9}{'errors':>8}"
+)
+
+
+def _cell(value, width, spec=".1f"):
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}{spec}}"
+
+
+def format_result(name, result):
+    latency = result["latency_ms"]
+    return (
+        f"{name:<20}{_cell(result['throughput'], 9)}{_cell(latency['p50'], 10, '.2f')}"
+        f"{_cell(latency['p95'], 10, '.2f')}{_cell(latency['p99'], 10, '.2f')}"
+        f"{_cell(result['queries_per_request'], 9)}{result['errors']:>8}"
+    )
+
+
+def _change(old, new):
+    if old is None or new is None or not old:
+        return None
+    return 100 * (new - old) / old
+
+
+def compare_results(baseline, current, threshold):
+    """Yield (scenario, metric, old, new, change %, regressed) rows.
+
+    Latency regresses when p95 rises by more than `threshold` percent,
+    throughput when it drops by more than that, and queries per request on
+    any increase.
+    """
+    for name, new in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        rows = [
+            ("p50 ms", old["latency_ms"]["p50"], new["latency_ms"]["p50"], None),
+            ("p95 ms", old["latency_ms"]["p95"], new["latency_ms"]["p95"], threshold),
+            ("p99 ms", old["latency_ms"]["p99"], new["latency_ms"]["p99"], None),
+            ("req/s", old["throughput"], new["throughput"], -threshold),
+            ("queries", old["queries_per_request"], new["queries_per_request"], 0),
+            ("errors", old["errors"], new["errors"], None),
+        ]
+        for metric, before, after, limit in rows:
+            change = _change(before, after)
+            if metric == "queries":
+                regressed = before is not None and after is not None and after > before
+            elif limit is None or change is None:
+                regressed = metric == "errors" and after > before
+            elif limit < 0:
+                regressed = change < limit
+            else:
+                regressed = change > limit
+            yield name, metric, before, after, change, regressed
@@ -0,0 +1,370 @@
+"""Cache backends shared by every gunicorn worker on a host.
+
+Flask-Caching's SimpleCache lives inside one process, so each worker
+renders and invalidates its own copy. The backends here keep entries in
+one place and count hits, misses and evictions per key prefix (the part
+of the key before the first ":" or "/", e.g. "view" or "post").
+"""
+import atexit
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from blinker import Namespace
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = 1.0
+
+# Sent with hit=True/False on every lookup, for per-request metrics.
+cache_lookup = Namespace().signal("cache-lookup")
+
+
+def key_prefix(key):
+    return re.split(r"[:/]", key, maxsplit=1)[0]
+
+
+class KeyStatsMixin:
+    """Buffers per-prefix counters in memory and flushes them periodically,
+    so counting never adds a shared write to the read path. Whatever is
+    still buffered is flushed at exit, so short CLI runs are counted too."""
+
+    def _init_stats(self):
+        self._stats_lock = threading.Lock()
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush_stats()
+        except Exception as e:
+            logger.warning(f"Could not flush cache stats: {e}")
+
+    def _count(self, key, field, n=1):
+        if field != "evictions":
+            cache_lookup.send(self, hit=field == "hits")
+        with self._stats_lock:
+            self._pending[(key_prefix(key), field)] += n
+            due = time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._stats_lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        if pending:
+            self._write_stats(pending)
+
+    def get_stats(self):
+        """Return {prefix: {"hits": n, "misses": n, "evictions": n}}."""
+        self.flush_stats()
+        return self._read_stats()
+
+
+class SQLiteLRUCache(KeyStatsMixin, BaseCache):
+    """LRU cache in a single SQLite file, shared by all local processes.
+
+    Put the file on tmpfs (the default is /dev/shm when it exists) to keep
+    it in shared memory. The cache is bounded both by entry count
+    (`threshold`) and total payload size (`max_bytes`); the least recently
+    read entries are evicted first. Triggers keep the entry count and total
+    size in the one-row `totals` table, so checking the bounds after a write
+    is a primary key lookup rather than a scan.
+    """
+
+    # Reads only refresh an entry's LRU position when it is older than this,
+    # so hot keys do not turn every read into a write.
+    touch_interval = 1.0
+
+    def __init__(
+        self,
+        path,
+        threshold=500,
+        max_bytes=0,
+        default_timeout=300,
+        key_prefix=None,
+        ignore_delete_many_errors=False,
+    ):
+        BaseCache.__init__(
+            self,
+            default_timeout=default_timeout,
+            ignore_delete_many_errors=ignore_delete_many_errors,
+        )
+        self._init_stats()
+        self.path = path
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.key_prefix = key_prefix or ""
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            # In one transaction, so no write slips in between counting the
+            # existing rows and creating the triggers.
+            conn.executescript(
+                """
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires REAL NOT NULL,
+                    accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed);
+                CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires);
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    count INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO totals (id, count, size)
+                    SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM cache;
+                CREATE TRIGGER IF NOT EXISTS cache_inserted AFTER INSERT ON cache BEGIN
+                    UPDATE totals SET count = count + 1, size = size + NEW.size WHERE id = 1;
+                END;
+                CREATE TRIGGER IF NOT EXISTS cache_deleted AFTER DELETE ON cache BEGIN
+                    UPDATE totals SET count = count - 1, size = size - OLD.size WHERE id = 1;
+                END;
+                CREATE TRIGGER IF NOT EXISTS cache_resized AFTER UPDATE OF size ON cache BEGIN
+                    UPDATE totals SET size = size - OLD.size + NEW.size WHERE id = 1;
+                END;
+                CREATE TABLE IF NOT EXISTS stats (
+                    prefix TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (prefix, field)
+                );
+                COMMIT;
+                """
+            )
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        cache_dir = config["CACHE_DIR"]
+        if not cache_dir:
+            base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            cache_dir = os.path.join(base, "flask-blog-cache")
+        kwargs.update(
+            threshold=config["CACHE_THRESHOLD"],
+            max_bytes=config.get("CACHE_MAX_BYTES", 0),
+            key_prefix=config.get("CACHE_KEY_PREFIX"),
+        )
+        return cls(os.path.join(cache_dir, "cache.sqlite"), *args, **kwargs)
+
+    def _connect(self):
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout else float("inf")
+
+    def get(self, key):
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT value, expires, accessed FROM cache WHERE key = ?",
+            (self.key_prefix + key,),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            self._count(key, "misses")
+            return None
+        if now - row[2] >= self.touch_interval:
+            self._connect().execute(
+                "UPDATE cache SET accessed = ? WHERE key = ?", (now, self.key_prefix + key)
+            )
+        self._count(key, "hits")
+        return pickle.loads(row[0])
+
+    def has(self, key):
+        row = self._connect().execute(
+            "SELECT 1 FROM cache WHERE key = ? AND expires > ?",
+            (self.key_prefix + key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=None):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        # An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row
+        # without firing the delete trigger, which would skew the totals.
+        self._connect().execute(
+            "INSERT INTO cache (key, value, size, expires, accessed) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+            "expires = excluded.expires, accessed = excluded.accessed",
+            (self.key_prefix + key, data, len(data), self._expiry(timeout), time.time()),
+        )
+        self._evict()
+        return True
+
+    def add(self, key, value, timeout=None):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM cache WHERE key = ? AND expires <= ?",
+                (self.key_prefix + key, time.time()),
+            )
+            added = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, size, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.key_prefix + key, data, len(data), self._expiry(timeout), time.time()),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if added:
+            self._evict()
+        return bool(added)
+
+    def inc(self, key, delta=1):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = (self.get(key) or 0) + delta
+            self.set(key, value)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def delete(self, key):
+        return bool(
+            self._connect()
+            .execute("DELETE FROM cache WHERE key = ?", (self.key_prefix + key,))
+            .rowcount
+        )
+
+    def clear(self):
+        # Like RedisCache, only this cache's keys when a prefix is set.
+        self._connect().execute(
+            "DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+            (len(self.key_prefix), self.key_prefix),
+        )
+        return True
+
+    def _evict(self):
+        conn = self._connect()
+        count, total = conn.execute("SELECT count, size FROM totals WHERE id = 1").fetchone()
+        if not (
+            (self.threshold and count > self.threshold)
+            or (self.max_bytes and total > self.max_bytes)
+        ):
+            return
+
+        # Over a bound: drop expired entries first, then the least recently read.
+        now = time.time()
+        if conn.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount:
+            count, total = conn.execute(
+                "SELECT count, size FROM totals WHERE id = 1"
+            ).fetchone()
+        evicted = []
+        cursor = conn.execute("SELECT key, size FROM cache ORDER BY accessed")
+        for key, size in cursor:
+            if not (
+                (self.threshold and count > self.threshold)
+                or (self.max_bytes and total > self.max_bytes)
+            ):
+                break
+            evicted.append(key)
+            count -= 1
+            total -= size
+        cursor.close()
+        conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k in evicted])
+        for key in evicted:
+            if key.startswith(self.key_prefix):
+                key = key[len(self.key_prefix):]
+            self._count(key, "evictions")
+
+    def _write_stats(self, pending):
+        self._connect().executemany(
+            "INSERT INTO stats (prefix, field, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (prefix, field) DO UPDATE SET count = count + excluded.count",
+            [(prefix, field, n) for (prefix, field), n in pending.items()],
+        )
+
+    def _read_stats(self):
+        stats = {}
+        for prefix, field, n in self._connect().execute(
+            "SELECT prefix, field, count FROM stats"
+        ):
+            stats.setdefault(prefix, {"hits": 0, "misses": 0, "evictions": 0})
+            stats[prefix][field] = n
+        return stats
+
+
+class StatsRedisCache(KeyStatsMixin, RedisCache):
+    """Flask-Caching's RedisCache plus per-prefix hit/miss counters.
+
+    Works against any Redis-protocol server. Eviction is Redis's own: set
+    CACHE_REDIS_MAXMEMORY to apply `maxmemory` with the allkeys-lru policy
+    (ignored where CONFIG SET is not allowed). Evictions are reported
+    server-wide under the "*" prefix.
+    """
+
+    stats_key = "cache-stats"
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        cache = super().factory(app, config, args, kwargs)
+        cache._init_stats()
+        maxmemory = config.get("CACHE_REDIS_MAXMEMORY")
+        if maxmemory:
+            try:
+                cache._write_client.config_set("maxmemory", maxmemory)
+                cache._write_client.config_set("maxmemory-policy", "allkeys-lru")
+            except Exception as e:
+                app.logger.warning(f"Could not configure Redis eviction: {e}")
+        return cache
+
+    def get(self, key):
+        value = super().get(key)
+        self._count(key, "misses" if value is None else "hits")
+        return value
+
+    def _write_stats(self, pending):
+        pipe = self._write_client.pipeline()
+        for (prefix, field), n in pending.items():
+            pipe.hincrby(self._get_prefix() + self.stats_key, f"{prefix}|{field}", n)
+        pipe.execute()
+
+    def _read_stats(self):
+        raw = self._read_client.hgetall(self._get_prefix() + self.stats_key)
+        stats = {}
+        for name, n in raw.items():
+            prefix, field = name.decode().rsplit("|", 1)
+            stats.setdefault(prefix, {"hits": 0, "misses": 0, "evictions": 0})
+            stats[prefix][field] = int(n)
+        evicted = self._read_client.info("stats").get("evicted_keys", 0)
+        stats["*"] = {"hits": 0, "misses": 0, "evictions": int(evicted)}
+        return stats
+
+
+def cache_stats(cache):
+    """Per-prefix stats, or None if the backend does not record them."""
+    backend = cache.cache
+    if isinstance(backend, KeyStatsMixin):
+        return backend.get_stats()
+    return None
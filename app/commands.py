@@ -0,0 +1,496 @@
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from uuid import uuid4
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import cache, db
+from .models import BlogPost, Comment, User
+from .fragments import bump_listing_version, bump_post_versions, publish_post_version
+from .sanitize import POLICY_VERSION, chunks, sanitize_rows
+from .search import index_posts, prune_index
+from .cache_backends import cache_stats
+from . import assets, bench, contacts, transfer
+from .mail_queue import mail_outbox
+from .images import ImageFetchError, image_ingester
+
+cache_cli = AppGroup("cache", help="Inspect and manage the shared cache.")
+mail_cli = AppGroup("mail", help="Deliver queued outbound mail.")
+limits_cli = AppGroup("limits", help="Inspect rate limiter storage.")
+search_cli = AppGroup("search", help="Maintain the post search index.")
+comments_cli = AppGroup("comments", help="Maintain denormalized comment data.")
+bench_cli = AppGroup("bench", help="Seed benchmark data and measure the hot paths.")
+assets_cli = AppGroup("assets", help="Build fingerprinted static files.")
+images_cli = AppGroup("images", help="Maintain local copies of post images.")
+blog_cli = AppGroup("blog", help="Export and import users, posts and comments.")
+contacts_cli = AppGroup("contacts", help="Manage contact form submissions.")
+
+
+@cache_cli.command("stats")
+def cache_stats_command():
+    """Show hit, miss and eviction counts per key prefix."""
+    stats = cache_stats(cache)
+    if stats is None:
+        click.echo("The configured cache backend does not record statistics.")
+        return
+    total = {"hits": 0, "misses": 0, "evictions": 0}
+    for s in stats.values():
+        for field in total:
+            total[field] += s[field]
+    click.echo(f"{'prefix':<20}{'hits':>10}{'misses':>10}{'evictions':>12}{'hit %':>8}")
+    for prefix, s in [*sorted(stats.items()), ("total", total)]:
+        lookups = s["hits"] + s["misses"]
+        ratio = f"{100 * s['hits'] / lookups:.1f}" if lookups else "-"
+        click.echo(
+            f"{prefix:<20}{s['hits']:>10}{s['misses']:>10}{s['evictions']:>12}{ratio:>8}"
+        )
+
+
+@cache_cli.command("clear")
+def cache_clear_command():
+    """Drop every cached entry."""
+    cache.clear()
+    click.echo("Cache cleared.")
+
+
+@mail_cli.command("deliver")
+def mail_deliver_command():
+    """Send every message that is currently due, then exit."""
+    sent = 0
+    while batch := mail_outbox.deliver_due():
+        sent += batch
+    click.echo(f"Attempted {sent} message(s).")
+
+
+@mail_cli.command("worker")
+def mail_worker_command():
+    """Run the outbox sender in the foreground."""
+    click.echo("Delivering queued mail; press Ctrl+C to stop.")
+    mail_outbox.run_forever()
+
+
+@limits_cli.command("bench")
+@click.option("--uri", "uris", multiple=True, help="Storage URI (repeatable).")
+@click.option("--strategy", default=None, help="Defaults to RATELIMIT_STRATEGY.")
+@click.option("--iterations", default=5000, show_default=True)
+@click.option("--keys", default=100, show_default=True, help="Distinct clients.")
+def limits_bench_command(uris, strategy, iterations, keys):
+    """Time rate limit checks against memory:// and the configured storage."""
+    uris = uris or ("memory://", current_app.config["RATELIMIT_STORAGE_URI"])
+    strategy = strategy or current_app.config["RATELIMIT_STRATEGY"]
+    item = parse("1000000 per minute")
+    click.echo(f"{strategy}, {iterations} hits over {keys} keys")
+    click.echo(f"{'storage':<40}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}")
+    for uri in uris:
+        storage = storage_from_string(uri)
+        limiter = STRATEGIES[strategy](storage)
+        # A fresh namespace, so a shared production store is left untouched.
+        namespace = f"bench-{uuid4().hex}"
+        timings = []
+        for i in range(iterations):
+            started = time.perf_counter()
+            limiter.hit(item, namespace, str(i % keys))
+            timings.append((time.perf_counter() - started) * 1e6)
+        for k in range(keys):
+            limiter.clear(item, namespace, str(k))
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[int(len(timings) * 0.99)]
+        click.echo(f"{uri:<40}{mean:>10.1f}{p50:>10.1f}{p99:>10.1f}")
+
+
+@assets_cli.command("build")
+@click.option("--clean", is_flag=True, help="Delete files left over from older builds.")
+def assets_build_command(clean):
+    """Hash, precompress and resize static files; restart the app afterwards.
+
+    Keep older builds (no --clean) while cached pages may still link to them.
+    """
+    manifest, removed = assets.build(
+        current_app.static_folder,
+        current_app.config["ASSET_IMAGE_WIDTHS"],
+        clean=clean,
+        echo=click.echo,
+    )
+    variants = sum(
+        len(sizes) for images in manifest.images.values() for sizes in images.values()
+    )
+    click.echo(
+        f"Built {len(manifest.files)} files, {len(manifest.encodings)} precompressed, "
+        f"{variants} image variants; removed {removed} old files."
+    )
+
+
+@search_cli.command("rebuild")
+@click.option("--batch-size", default=500, show_default=True)
+def search_rebuild_command(batch_size):
+    """Re-index every post, committing one batch at a time.
+
+    Search keeps working throughout; entries for posts that no longer exist
+    are removed at the end.
+    """
+    last_id = 0
+    done = 0
+    while True:
+        posts = db.session.scalars(
+            select(BlogPost)
+            .where(BlogPost.id > last_id)
+            .order_by(BlogPost.id)
+            .limit(batch_size)
+        ).all()
+        if not posts:
+            break
+        index_posts(posts)
+        db.session.commit()
+        last_id = posts[-1].id
+        done += len(posts)
+        click.echo(f"Indexed {done} posts (up to id {last_id}).")
+        db.session.expunge_all()
+    pruned = prune_index()
+    db.session.commit()
+    click.echo(f"Done: {done} posts indexed, {pruned} stale entries removed.")
+
+
+def _resanitize(pool, workers, model, raw_column, html_column, post_column, batch_size):
+    """Re-clean every row of `model` sanitized under an older policy.
+
+    Rows are streamed by id. While the pool cleans one batch, the previous
+    batch's results are written back, and each batch commits on its own.
+    A row edited since it was fetched is left alone: if it is still on an
+    older policy the next run picks it up. Returns (rows processed, rows
+    whose HTML changed).
+    """
+
+    def fetch(last_id):
+        return db.session.execute(
+            select(
+                model.id,
+                func.coalesce(raw_column, html_column).label("source"),
+                raw_column.label("raw"),
+                html_column.label("current"),
+                post_column.label("post_id"),
+            )
+            .where(model.sanitize_policy != POLICY_VERSION, model.id > last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+        ).all()
+
+    def write(rows, futures):
+        cleaned = dict(pair for future in futures for pair in future.result())
+        changed = []
+        for row in rows:
+            # Only if nobody edited the row since it was fetched; otherwise
+            # this would overwrite the edit with HTML cleaned from stale text.
+            written = db.session.execute(
+                update(model)
+                .where(
+                    model.id == row.id,
+                    model.sanitize_policy != POLICY_VERSION,
+                    raw_column.is_not_distinct_from(row.raw),
+                    html_column == row.current,
+                )
+                .values({html_column: cleaned[row.id], model.sanitize_policy: POLICY_VERSION})
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if written and cleaned[row.id] != row.current:
+                changed.append(row)
+        metas = bump_post_versions({row.post_id for row in changed}) if changed else {}
+        if model is BlogPost and changed:
+            index_posts(
+                db.session.scalars(
+                    select(BlogPost).where(BlogPost.id.in_([row.id for row in changed]))
+                )
+            )
+        db.session.commit()
+        for post_id, meta in metas.items():
+            publish_post_version(post_id, meta)
+        db.session.expunge_all()
+        return len(changed)
+
+    done = changed = 0
+    last_id = 0
+    pending = None
+    while True:
+        rows = fetch(last_id)
+        futures = [
+            pool.submit(sanitize_rows, [(row.id, row.source) for row in chunk])
+            for chunk in chunks(rows, workers)
+        ]
+        if pending:
+            changed += write(*pending)
+            done += len(pending[0])
+            click.echo(f"{model.__tablename__}: {done} re-sanitized, {changed} changed")
+        if not rows:
+            return done, changed
+        last_id = rows[-1].id
+        pending = (rows, futures)
+
+
+def _sanitize_pool(workers):
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+@click.command("sanitize")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True)
+@with_appcontext
+def sanitize_command(batch_size, workers):
+    """Re-sanitize posts and comments cleaned under an older policy."""
+    with _sanitize_pool(workers) as pool:
+        for model, raw_column, html_column, post_column in (
+            (BlogPost, BlogPost.body_raw, BlogPost.body, BlogPost.id),
+            (Comment, Comment.text_raw, Comment.text, Comment.post_id),
+        ):
+            done, changed = _resanitize(
+                pool, workers, model, raw_column, html_column, post_column, batch_size
+            )
+            click.echo(
+                f"{model.__tablename__}: {done} rows at policy {POLICY_VERSION}, "
+                f"{changed} changed."
+            )
+
+
+@comments_cli.command("recount")
+@click.option("--batch-size", default=1000, show_default=True)
+def comments_recount_command(batch_size):
+    """Recompute comment_count and last_comment_at for every post."""
+    comments = select(Comment).where(Comment.post_id == BlogPost.id)
+    count = comments.with_only_columns(func.count()).scalar_subquery()
+    latest = comments.with_only_columns(func.max(Comment.created_at)).scalar_subquery()
+    last_id = 0
+    fixed = 0
+    while True:
+        ids = db.session.scalars(
+            select(BlogPost.id)
+            .where(BlogPost.id > last_id)
+            .order_by(BlogPost.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        # Only rows that are actually wrong are written.
+        fixed += db.session.execute(
+            update(BlogPost)
+            .where(
+                BlogPost.id.in_(ids),
+                (BlogPost.comment_count != count)
+                | BlogPost.last_comment_at.is_distinct_from(latest),
+            )
+            .values(comment_count=count, last_comment_at=latest),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        db.session.commit()
+        last_id = ids[-1]
+    if fixed:
+        bump_listing_version()
+    click.echo(f"Fixed counts on {fixed} post(s).")
+
+
+@images_cli.command("ingest")
+@click.option("--all", "everything", is_flag=True, help="Re-fetch every post's image.")
+def images_ingest_command(everything):
+    """Download and resize post images that have no local copy yet."""
+    stored = linked = failed = 0
+    for post_id, url in image_ingester.pending(everything):
+        try:
+            stored += image_ingester.ingest(post_id, url)
+        except ImageFetchError as e:
+            failed += 1
+            click.echo(f"Post {post_id}: {e}", err=True)
+            continue
+        linked += 1
+    click.echo(f"Linked {linked} post(s), stored {stored} new image(s), {failed} failed.")
+
+
+def _open_jsonl(path, mode):
+    """Open PATH for JSON Lines; "-" is stdin/stdout and .gz files are compressed."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return click.open_file(path, mode, encoding="utf-8")
+
+
+@blog_cli.command("export")
+@click.argument("path", default="-")
+@click.option("--batch-size", default=1000, show_default=True)
+def blog_export_command(path, batch_size):
+    """Write every user, post and comment to PATH (default: stdout)."""
+    started = time.perf_counter()
+    with _open_jsonl(path, "w") as out:
+        counts = transfer.export_jsonl(
+            out, batch_size, echo=lambda message: click.echo(message, err=True)
+        )
+    rows = sum(counts.values())
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"Exported {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):,.0f} rows/s).",
+        err=True,
+    )
+
+
+@blog_cli.command("import")
+@click.argument("path")
+@click.option("--batch-size", default=2000, show_default=True)
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True)
+def blog_import_command(path, batch_size, workers):
+    """Import a file written by `flask blog export` ("-" for stdin)."""
+    started = time.perf_counter()
+    with _sanitize_pool(workers) as pool, _open_jsonl(path, "r") as lines:
+        importer = transfer.Importer(pool, workers, batch_size, echo=click.echo)
+        try:
+            counts, skipped = importer.run(lines)
+        except (transfer.TransferError, IntegrityError) as e:
+            db.session.rollback()
+            raise click.ClickException(f"Nothing was imported: {e}")
+    rows = sum(counts.values()) + sum(skipped.values())
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"Imported {counts['user']} users, {counts['post']} posts and "
+        f"{counts['comment']} comments in {elapsed:.1f}s "
+        f"({rows / max(elapsed, 1e-6):,.0f} rows/s); skipped {skipped['user']} "
+        f"existing users, {skipped['post']} existing posts and their "
+        f"{skipped['comment']} comments."
+    )
+
+
+@contacts_cli.command("prune")
+@click.option("--days", type=int, help="Keep this many days (default: CONTACT_RETENTION_DAYS).")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--pause", default=0.1, show_default=True, help="Seconds to sleep between batches.")
+def contacts_prune_command(days, batch_size, pause):
+    """Delete contact submissions past the retention period."""
+    if days is None:
+        days = current_app.config["CONTACT_RETENTION_DAYS"]
+    before = contacts.utcnow() - timedelta(days=days)
+    deleted = contacts.prune(before, batch_size, pause, echo=click.echo)
+    click.echo(f"Deleted {deleted} submissions older than {before:%Y-%m-%d %H:%M} UTC.")
+
+
+@bench_cli.command("seed")
+@click.option("--users", default=200, show_default=True)
+@click.option("--posts", default=2000, show_default=True, type=click.IntRange(min=1))
+@click.option("--comments", default=40000, show_default=True)
+@click.option("--hot-comments", default=5000, show_default=True, help="Comments on the newest post.")
+@click.option("--body-words", default=600, show_default=True, help="Mean post length.")
+@click.option("--comment-words", default=40, show_default=True, help="Mean comment length.")
+@click.option("--seed", "random_seed", default=1, show_default=True)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--reset", is_flag=True, help="Drop and recreate all tables first.")
+@click.option("--yes", is_flag=True, help="Do not ask before --reset.")
+def bench_seed_command(
+    users, posts, comments, hot_comments, body_words, comment_words, random_seed,
+    batch_size, reset, yes,
+):
+    """Fill the database with a reproducible generated dataset.
+
+    Every bench user can log in as bench-<n>@example.com with the password
+    "bench-password".
+    """
+    if reset:
+        if not yes:
+            click.confirm(f"Delete ALL data in {db.engine.url!r}?", abort=True)
+        bench.reset_database()
+    elif db.session.scalar(select(User.id).where(User.email == "bench-0@example.com")):
+        raise click.ClickException("Bench data already exists; use --reset to start over.")
+    started = time.perf_counter()
+    hot = bench.seed(
+        users=users,
+        posts=posts,
+        comments=comments,
+        hot_comments=hot_comments,
+        body_words=body_words,
+        comment_words=comment_words,
+        random_seed=random_seed,
+        batch_size=batch_size,
+        echo=click.echo,
+    )
+    click.echo(f"Seeded in {time.perf_counter() - started:.1f}s; hot post is /post/{hot}.")
+
+
+@bench_cli.command("run")
+@click.option("--gunicorn", "use_gunicorn", is_flag=True, help="Start gunicorn and test over HTTP.")
+@click.option("--workers", default=2, show_default=True, help="gunicorn workers.")
+@click.option("--url", default=None, help="Test an already running server instead.")
+@click.option("--scenario", "names", multiple=True, help="Only these scenarios (repeatable).")
+@click.option("--requests", default=200, show_default=True, help="Timed requests per scenario.")
+@click.option("--login-requests", default=20, show_default=True)
+@click.option("--concurrency", default=1, show_default=True)
+@click.option("--warmup", default=5, show_default=True)
+@click.option("--page-cache/--no-page-cache", default=True, show_default=True)
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="Write results as JSON.")
+def bench_run_command(
+    use_gunicorn, workers, url, names, requests, login_requests, concurrency, warmup,
+    page_cache, output,
+):
+    """Time /, deep pages, the busiest post, /login and /contact.
+
+    Without --gunicorn or --url, requests go through the test client in
+    this process. Rate limits and background mail delivery are switched
+    off for the run; --url targets must be started that way too.
+    """
+    try:
+        scenarios = bench.build_scenarios()
+    except LookupError as e:
+        raise click.ClickException(str(e))
+    if names:
+        unknown = set(names) - {s.name for s in scenarios}
+        if unknown:
+            raise click.BadParameter(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+        scenarios = [s for s in scenarios if s.name in names]
+    click.echo(bench.HEADER)
+    results = bench.run_benchmark(
+        scenarios,
+        target="gunicorn" if use_gunicorn else "client",
+        url=url,
+        workers=workers,
+        requests=requests,
+        login_requests=login_requests,
+        concurrency=concurrency,
+        warmup=warmup,
+        page_cache=page_cache,
+        echo=click.echo,
+    )
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}.")
+
+
+@bench_cli.command("compare")
+@click.argument("baseline", type=click.File())
+@click.argument("current", type=click.File())
+@click.option("--threshold", default=10.0, show_default=True, help="Allowed change in percent.")
+def bench_compare_command(baseline, current, threshold):
+    """Compare two `bench run` results; exits with 1 on a regression.
+
+    p95 latency and throughput may move by --threshold percent; queries per
+    request may not increase at all.
+    """
+    regressions = 0
+    click.echo(f"{'scenario':<20}{'metric':<10}{'before':>12}{'after':>12}{'change':>10}")
+    for name, metric, before, after, change, regressed in bench.compare_results(
+        json.load(baseline), json.load(current), threshold
+    ):
+        cells = [f"{'-' if v is None else format(v, 'g'):>12}" for v in (before, after)]
+        delta = "-" if change is None else f"{change:+.1f}%"
+        flag = "  REGRESSED" if regressed else ""
+        click.echo(f"{name:<20}{metric:<10}{''.join(cells)}{delta:>10}{flag}")
+        regressions += regressed
+    if regressions:
+        click.echo(f"{regressions} regression(s).")
+        raise SystemExit(1)
+    click.echo("No regressions.")
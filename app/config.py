@@ -4,18 +4,30 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _database_url(uri):
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    return uri
+
+
 class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-key-please-change")
     SECURITY_PASSWORD_SALT = os.getenv("SECURITY_PASSWORD_SALT", "dev-salt")
 
     # Database Configuration
-    uri = os.getenv("DATABASE_URL", "sqlite:///blog.db")
-    if uri.startswith("postgres://"):
-        uri = uri.replace("postgres://", "postgresql://", 1)
-
-    SQLALCHEMY_DATABASE_URI = uri
+    SQLALCHEMY_DATABASE_URI = _database_url(os.getenv("DATABASE_URL", "sqlite:///blog.db"))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Read replicas (see app/replicas.py): comma-separated URLs that become
+    # the binds replica1, replica2, ... How often each replica's position
+    # is re-checked while it is caught up:
+    SQLALCHEMY_BINDS = {
+        f"replica{i}": _database_url(url.strip())
+        for i, url in enumerate(os.getenv("DATABASE_REPLICA_URLS", "").split(","), 1)
+        if url.strip()
+    }
+    REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 1.0))
+
     # Mail Configuration
     MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
     MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
@@ -32,6 +44,94 @@ class Config:
     MAIL_TIMEOUT = 10
     MAIL_MAX_EMAILS = None
 
+    # Outbox delivery (see app/mail_queue.py). Set MAIL_OUTBOX_BACKGROUND=false
+    # to leave delivery to a separate `flask mail worker` process.
+    MAIL_OUTBOX_BACKGROUND = os.getenv("MAIL_OUTBOX_BACKGROUND", "true").lower() == "true"
+    MAIL_SENDER_THREADS = int(os.getenv("MAIL_SENDER_THREADS", 2))
+    MAIL_BATCH_SIZE = 50
+    MAIL_MAX_ATTEMPTS = 6
+    MAIL_RETRY_BASE = 30
+    MAIL_POLL_INTERVAL = 30
+
+    # Password hashing runs in a bounded process pool (0 workers = inline)
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 8))
+    PASSWORD_HASH_TIMEOUT = 10
+
+    # Failed logins per email / per IP before exponential lockouts start
+    LOGIN_THROTTLE_ACCOUNT_ATTEMPTS = 5
+    LOGIN_THROTTLE_IP_ATTEMPTS = 20
+    LOGIN_THROTTLE_BASE_DELAY = 1
+    LOGIN_THROTTLE_MAX_DELAY = 15 * 60
+    LOGIN_THROTTLE_WINDOW = 60 * 60
+
+    # Cache shared by all workers on the host (SQLite on tmpfs by default).
+    # Set CACHE_TYPE=app.cache_backends.StatsRedisCache and CACHE_REDIS_URL
+    # to use a Redis-protocol server instead.
+    CACHE_TYPE = os.getenv("CACHE_TYPE", "app.cache_backends.SQLiteLRUCache")
+    CACHE_DIR = os.getenv("CACHE_DIR")
+    CACHE_DEFAULT_TIMEOUT = int(os.getenv("CACHE_DEFAULT_TIMEOUT", 300))
+    CACHE_THRESHOLD = int(os.getenv("CACHE_THRESHOLD", 2000))
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+    CACHE_REDIS_MAXMEMORY = os.getenv("CACHE_REDIS_MAXMEMORY")
+    CACHE_KEY_PREFIX = "blog:"
+
+    # Rate limit counters shared by all workers (SQLite on tmpfs by default).
+    # Use redis://host:port to share them across hosts, or memory:// for
+    # per-process counters.
+    RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "sqlite://")
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "fixed-window")
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+
+    # Serve one cached copy of /, /post/<id> and /about to anonymous visitors
+    ANONYMOUS_PAGE_CACHE = os.getenv("ANONYMOUS_PAGE_CACHE", "true").lower() == "true"
+    PAGE_CACHE_TIMEOUT = 300
+    PAGE_CACHE_MAX_AGE = 60
+
+    # Logged-in users' navbar fields are cached instead of loaded per request
+    IDENTITY_CACHE_TIMEOUT = 300
+
+    # Per-worker metrics files that /metrics aggregates. /metrics answers
+    # 404 until METRICS_TOKEN ("Authorization: Bearer <token>") and/or
+    # METRICS_ALLOWED_IPS (comma-separated addresses or networks, e.g.
+    # "127.0.0.1,10.0.0.0/8") is set.
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1.0))
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "")
+
+    # Query budgets: raise in tests, optionally log overruns in production
+    QUERY_BUDGET_RAISE = False
+    QUERY_BUDGET_LOG = os.getenv("QUERY_BUDGET_LOG", "false").lower() == "true"
+    QUERY_BUDGET_DEFAULT = None
+
+    # Static files: widths of the WebP/AVIF copies `flask assets build` makes
+    # of images under static/assets/img, and how long browsers may keep
+    # fingerprinted files
+    ASSET_IMAGE_WIDTHS = (640, 1280, 1920)
+    STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+    # Post header images (see app/images.py): downloaded into IMAGE_STORE_DIR
+    # (default: instance/images) and resized in a background thread pool.
+    # Set IMAGE_INGEST_BACKGROUND=false to leave it to `flask images ingest`.
+    IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR")
+    IMAGE_INGEST_BACKGROUND = os.getenv("IMAGE_INGEST_BACKGROUND", "true").lower() == "true"
+    IMAGE_INGEST_THREADS = int(os.getenv("IMAGE_INGEST_THREADS", 2))
+    IMAGE_WIDTHS = (480, 960, 1440, 1920)
+    IMAGE_MAX_BYTES = 10 * 1024 * 1024
+    IMAGE_FETCH_TIMEOUT = 15
+    # Only for tests: allow image URLs on loopback/private hosts
+    IMAGE_FETCH_ALLOW_PRIVATE = False
+
+    # Sitemaps are split into a sitemap index past this many URLs (the
+    # protocol's limit is 50,000)
+    SITEMAP_URLS_PER_FILE = int(os.getenv("SITEMAP_URLS_PER_FILE", 50000))
+
+    # `flask contacts prune` deletes contact submissions older than this
+    CONTACT_RETENTION_DAYS = int(os.getenv("CONTACT_RETENTION_DAYS", 180))
+
     # CKEditor
     CKEDITOR_SERVE_LOCAL = True
     CKEDITOR_PKG_TYPE = "standard"
@@ -0,0 +1,101 @@
+"""Contact form submissions: admin listing, streaming export and retention.
+
+The admin page pages through submissions newest first on (created_at, id),
+which the ix_contact_submissions_created_at_id index serves for any page.
+Exports stream CSV or JSON Lines straight from a server-side cursor, so
+neither the result set nor the file is held in memory. `flask contacts
+prune` deletes old submissions in small, separately committed batches so
+no lock is held for long.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select
+
+from .extensions import db
+from .models import ContactSubmission
+
+# Sort key for the admin listing; cursors encode these values.
+CONTACT_KEY = (ContactSubmission.created_at, ContactSubmission.id)
+EXPORT_COLUMNS = (
+    "id",
+    "created_at",
+    "name",
+    "email",
+    "number",
+    "message",
+    "ip_address",
+    "user_agent",
+)
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+# Spreadsheets treat cells starting with these as formulas.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    value = str(value)
+    return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def export_chunks(fmt, yield_per=500):
+    """Yield an export of every submission, oldest first, `yield_per` rows at a time."""
+    columns = [getattr(ContactSubmission, name) for name in EXPORT_COLUMNS]
+    result = db.session.execute(
+        select(*columns).order_by(*CONTACT_KEY).execution_options(yield_per=yield_per)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+    for rows in result.partitions():
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            if fmt == "csv":
+                writer.writerow([_csv_cell(value) for value in row])
+            else:
+                buffer.write(json.dumps(row._asdict(), default=_json_default) + "\n")
+        yield buffer.getvalue()
+
+
+def prune(before, batch_size=1000, pause=0.1, echo=print):
+    """Delete submissions created before `before`; returns how many.
+
+    Each batch is its own short transaction, with a pause in between so
+    contact form inserts are never held up for long.
+    """
+    deleted = 0
+    while True:
+        ids = db.session.scalars(
+            select(ContactSubmission.id)
+            .where(ContactSubmission.created_at < before)
+            .order_by(*CONTACT_KEY)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return deleted
+        db.session.execute(
+            delete(ContactSubmission).where(ContactSubmission.id.in_(ids))
+        )
+        db.session.commit()
+        deleted += len(ids)
+        echo(f"Deleted {deleted} submissions")
+        time.sleep(pause)
@@ -6,17 +6,21 @@ from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from sqlalchemy.orm import DeclarativeBase
+from . import limiter_storage  # noqa: F401  registers the sqlite:// limiter storage
+from .replicas import RoutingSession
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+# Reads of @read_replica views may go to a replica (see app/replicas.py)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 migrate = Migrate()
 mail = Mail()
-cache = Cache(config={"CACHE_TYPE": "simple"})
-limiter = Limiter(key_func=get_remote_address, storage_uri="memory://")
+cache = Cache()
+# Storage and strategy come from RATELIMIT_STORAGE_URI / RATELIMIT_STRATEGY
+limiter = Limiter(key_func=get_remote_address)
 
 login_manager = LoginManager()
 login_manager.login_view = "main.login" # type: ignore
@@ -25,6 +29,6 @@ login_manager.session_protection = "strong"
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models import User
+    from .identity import load_identity
 
-    return db.session.get(User, int(user_id))
+    return load_identity(int(user_id))
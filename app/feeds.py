@@ -0,0 +1,121 @@
+"""RSS and Atom feeds and sitemap.xml.
+
+The feeds carry the newest FEED_SIZE posts, read with one query on the
+(created_at, id) index. Sitemaps list every post. Past
+SITEMAP_URLS_PER_FILE URLs, /sitemap.xml becomes a sitemap index of
+/sitemap-<n>.xml files that each cover a fixed range of post ids, so every
+file is one primary key range scan. Sitemap files are streamed from a
+server-side cursor instead of being built in memory.
+
+Their ETag is the feed version (see fragments.bump_feed_version), which
+changes whenever a post is created or deleted or its updated_at moves
+(edits, comments, new images), so a 304 never hides a newer <lastmod>.
+"""
+from datetime import timezone
+from email.utils import format_datetime
+
+from flask import current_app, url_for
+from markupsafe import escape
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, load_only
+
+from .extensions import db
+from .models import BlogPost, User
+
+FEED_SIZE = 20
+# Pages besides the posts; they go in the first sitemap file.
+STATIC_ENDPOINTS = ("main.home", "main.about", "main.contact")
+SITEMAP_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+)
+
+
+def init_app(app):
+    app.add_template_filter(rfc822)
+    app.add_template_filter(rfc3339)
+
+
+def _utc(value):
+    # Timestamps are stored as naive UTC.
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def rfc822(value):
+    return format_datetime(_utc(value).replace(microsecond=0))
+
+
+def rfc3339(value):
+    return _utc(value).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def latest_posts(limit=FEED_SIZE):
+    return db.session.scalars(
+        select(BlogPost)
+        .options(
+            load_only(
+                BlogPost.title,
+                BlogPost.subtitle,
+                BlogPost.created_at,
+                BlogPost.updated_at,
+            ),
+            joinedload(BlogPost.author).load_only(User.name),
+        )
+        .order_by(BlogPost.created_at.desc(), BlogPost.id.desc())
+        .limit(limit)
+    ).all()
+
+
+def last_updated(posts, default):
+    """When the newest of `posts` was last written, or `default` without posts."""
+    return max((post.updated_at or post.created_at for post in posts), default=default)
+
+
+def _posts_per_file():
+    return current_app.config["SITEMAP_URLS_PER_FILE"] - len(STATIC_ENDPOINTS)
+
+
+def sitemap_files():
+    """How many sitemap files the posts need; 1 means no sitemap index."""
+    last_id = db.session.scalar(select(func.max(BlogPost.id))) or 0
+    return max(1, -(-last_id // _posts_per_file()))
+
+
+def _url(loc, lastmod=None):
+    if lastmod is None:
+        return f"<url><loc>{escape(loc)}</loc></url>\n"
+    return f"<url><loc>{escape(loc)}</loc><lastmod>{rfc3339(lastmod)}</lastmod></url>\n"
+
+
+def sitemap_chunks(number, yield_per=1000):
+    """Yield sitemap file `number` (from 1), `yield_per` posts at a time."""
+    per_file = _posts_per_file()
+    yield SITEMAP_HEADER
+    if number == 1:
+        yield "".join(_url(url_for(endpoint, _external=True)) for endpoint in STATIC_ENDPOINTS)
+    result = db.session.execute(
+        select(BlogPost.id, func.coalesce(BlogPost.updated_at, BlogPost.created_at))
+        .where(BlogPost.id > (number - 1) * per_file, BlogPost.id <= number * per_file)
+        .order_by(BlogPost.id)
+        .execution_options(yield_per=yield_per)
+    )
+    for rows in result.partitions():
+        yield "".join(
+            _url(url_for("main.show_post", post_id=post_id, _external=True), lastmod)
+            for post_id, lastmod in rows
+        )
+    yield "</urlset>\n"
+
+
+def sitemap_index(files):
+    sitemaps = "".join(
+        f"<sitemap><loc>{escape(url_for('main.sitemap_file', number=n, _external=True))}</loc></sitemap>\n"
+        for n in range(1, files + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        f"{sitemaps}</sitemapindex>\n"
+    )
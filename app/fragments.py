@@ -0,0 +1,172 @@
+"""Versioned fragment caching for post pages.
+
+Every post carries a `version` that is incremented in the same transaction
+as any change that affects its page (edit, delete, new comment). Rendered
+fragments are cached under the post id *and* that version, so a bump makes
+all old fragments unreachable at once and readers never see stale content.
+
+The current version is itself cached, which lets a hot post be served
+without touching the database at all.
+"""
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import func, select, update
+
+from .extensions import cache, db
+from .models import BlogPost
+
+VERSION_TIMEOUT = 24 * 3600
+FRAGMENT_TIMEOUT = 24 * 3600
+
+# Cached in place of a version once a post is deleted, so a reader that
+# raced the delete cannot re-cache the old version.
+DELETED = 0
+
+
+LISTING_VERSION_KEY = "listing-meta"
+# Feeds and sitemaps show each post's updated_at, so they change whenever a
+# post is created, deleted or gets a new version (edits, comments, images).
+FEED_VERSION_KEY = "feed-meta"
+
+
+def _meta_key(post_id):
+    return f"post-meta:{post_id}"
+
+
+def fragment_key(post_id, version, name):
+    return f"post:{post_id}:{version}:{name}"
+
+
+def post_meta(post_id):
+    """Return (version, updated_at) for the post, or None if it does not exist.
+
+    A cache hit costs nothing; a miss is a single primary-key lookup.
+    """
+    meta = cache.get(_meta_key(post_id))
+    if meta is None:
+        row = db.session.execute(
+            select(BlogPost.version, BlogPost.updated_at, BlogPost.created_at).where(
+                BlogPost.id == post_id
+            )
+        ).first()
+        if row is None:
+            return None
+        meta = (row.version, row.updated_at or row.created_at)
+        # add, not set: a writer that already published a newer version wins.
+        cache.add(_meta_key(post_id), meta, timeout=VERSION_TIMEOUT)
+    return meta or None
+
+
+def post_version(post_id):
+    """Return the post's current version, or None if it does not exist."""
+    meta = post_meta(post_id)
+    return meta[0] if meta else None
+
+
+def bump_post_version(post_id, **changes):
+    """Increment the version and touch updated_at inside the current transaction.
+
+    Any `changes` (column values or expressions) go into the same UPDATE.
+    Returns the new (version, updated_at); pass it to `publish_post_version`
+    once the transaction has committed.
+    """
+    row = db.session.execute(
+        update(BlogPost)
+        .where(BlogPost.id == post_id)
+        .values(version=BlogPost.version + 1, updated_at=func.now(), **changes)
+        .returning(BlogPost.version, BlogPost.updated_at)
+    ).one()
+    return (row.version, row.updated_at)
+
+
+def bump_post_versions(post_ids):
+    """`bump_post_version` for many posts at once; returns {post_id: meta}."""
+    rows = db.session.execute(
+        update(BlogPost)
+        .where(BlogPost.id.in_(post_ids))
+        .values(version=BlogPost.version + 1, updated_at=func.now())
+        .returning(BlogPost.id, BlogPost.version, BlogPost.updated_at)
+    ).all()
+    return {row.id: (row.version, row.updated_at) for row in rows}
+
+
+def publish_post_version(post_id, meta):
+    cache.set(_meta_key(post_id), meta, timeout=VERSION_TIMEOUT)
+    # updated_at moved, and the feeds and sitemaps show it.
+    bump_feed_version()
+
+
+def retire_post(post_id):
+    cache.set(_meta_key(post_id), DELETED, timeout=VERSION_TIMEOUT)
+
+
+def get_fragments(post_id, version, names):
+    """Return {name: html} for the cached fragments, or None on any miss."""
+    keys = [fragment_key(post_id, version, name) for name in names]
+    values = cache.get_many(*keys)
+    if any(v is None for v in values):
+        return None
+    return dict(zip(names, values))
+
+
+def set_fragments(post_id, version, fragments):
+    cache.set_many(
+        {fragment_key(post_id, version, name): html for name, html in fragments.items()},
+        timeout=FRAGMENT_TIMEOUT,
+    )
+
+
+def _new_listing_meta(changed_at=None):
+    # Bumps happen as the content changes, so "now" is when it changed.
+    return (uuid4().hex, changed_at or datetime.now(timezone.utc).replace(tzinfo=None))
+
+
+def _cached_meta(key, changed_at=None):
+    meta = cache.get(key)
+    if meta is None:
+        # Evicted, not changed: `changed_at` dates the content instead of now.
+        cache.add(key, _new_listing_meta(changed_at and changed_at()), timeout=VERSION_TIMEOUT)
+        meta = cache.get(key) or _new_listing_meta()
+    return meta
+
+
+def _newest_post_change():
+    """When a post was last created, edited or commented on (None without posts)."""
+    return db.session.scalar(
+        select(func.max(func.coalesce(BlogPost.updated_at, BlogPost.created_at)))
+    )
+
+
+def listing_meta():
+    """Return (token, changed_at) for the post listing.
+
+    Only kept in the cache: if it is evicted a fresh token is minted, which
+    at worst costs one re-render and one full response to revalidating
+    clients. changed_at is then read from the posts, so If-Modified-Since
+    still matches.
+    """
+    return _cached_meta(LISTING_VERSION_KEY, _newest_post_change)
+
+
+def listing_version():
+    """Token that changes whenever the post listing changes."""
+    return listing_meta()[0]
+
+
+def bump_listing_version():
+    cache.set(LISTING_VERSION_KEY, _new_listing_meta(), timeout=VERSION_TIMEOUT)
+
+
+def feed_meta():
+    """Return (token, changed_at) for the feeds and sitemaps, like `listing_meta`."""
+    return _cached_meta(FEED_VERSION_KEY)
+
+
+def feed_version():
+    return feed_meta()[0]
+
+
+def bump_feed_version():
+    """Call after a post is created or deleted; `publish_post_version` calls it for changes."""
+    cache.set(FEED_VERSION_KEY, _new_listing_meta(), timeout=VERSION_TIMEOUT)
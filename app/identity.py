@@ -0,0 +1,93 @@
+"""Cached identity for logged-in users.
+
+Flask-Login calls `load_user` on every request from a logged-in user, even
+for pages that only need a name and an avatar for the navbar. The fields
+those pages use are kept in the shared cache as a signed payload, so most
+authenticated requests never query the users table. The entry is dropped
+whenever a transaction that changed or deleted the user commits.
+
+Views that need the full row (relationships, password) load it themselves.
+"""
+from flask import current_app
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import cache, db
+from .models import User, gravatar_url
+
+STALE_KEY = "stale_identities"
+
+
+def _key(user_id):
+    return f"user:{user_id}"
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="identity-cache")
+
+
+class CachedIdentity(UserMixin):
+    def __init__(self, id, name, email, avatar_digest):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.avatar_digest = avatar_digest
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.name, user.email, user.avatar_digest)
+
+    def avatar(self, size):
+        return gravatar_url(self.avatar_digest, size)
+
+    def dump(self):
+        return _serializer().dumps([self.id, self.name, self.email, self.avatar_digest])
+
+    @classmethod
+    def load(cls, payload):
+        try:
+            return cls(*_serializer().loads(payload))
+        except (BadSignature, TypeError, ValueError):
+            return None
+
+
+def load_identity(user_id):
+    """Return a CachedIdentity for the user, or None if they do not exist."""
+    payload = cache.get(_key(user_id))
+    identity = CachedIdentity.load(payload) if payload else None
+    if identity is not None and identity.id == user_id:
+        return identity
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    identity = CachedIdentity.from_user(user)
+    cache.set(
+        _key(user_id),
+        identity.dump(),
+        timeout=current_app.config["IDENTITY_CACHE_TIMEOUT"],
+    )
+    return identity
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_stale(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(STALE_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale(session):
+    # After commit, so a concurrent request cannot re-cache the old row.
+    stale = session.info.pop(STALE_KEY, None)
+    if stale:
+        cache.delete_many(*[_key(user_id) for user_id in stale])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_stale(session):
+    session.info.pop(STALE_KEY, None)
@@ -0,0 +1,335 @@
+"""Local copies of post header images.
+
+`img_url` points at whatever a third-party host serves. When a post is
+created or edited, a background thread pool downloads the image into a
+content-addressed store (IMAGE_STORE_DIR/ab/abcdef…jpg), writes WebP and
+JPEG copies at IMAGE_WIDTHS, and links the post to it. Images are keyed by
+their SHA-256, so a picture several posts use (or one submitted again) is
+stored and resized only once.
+
+Until that has finished the masthead keeps using `img_url`. Stored files
+never change, so /images/... is served with an immutable Cache-Control.
+`flask images ingest` catches up on posts whose image was never processed,
+e.g. after a restart or with IMAGE_INGEST_BACKGROUND=false.
+
+Downloads only go to http(s) URLs whose host resolves to public addresses;
+the address is checked on every connection, redirects included. Set
+IMAGE_FETCH_ALLOW_PRIVATE in tests to fetch from a local server.
+
+Pillow is optional: without it originals are stored but not resized.
+"""
+import hashlib
+import http.client
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from flask import current_app, send_from_directory, url_for
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .fragments import bump_post_version, publish_post_version
+from .models import BlogPost, PostImage
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+VARIANT_FORMATS = (
+    # (Pillow format, extension, mimetype, save options), preferred first
+    ("webp", ".webp", "image/webp", {"quality": 80, "method": 6}),
+    ("jpeg", ".jpg", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+)
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+def _name(digest, suffix):
+    return f"{digest[:2]}/{digest}{suffix}"
+
+
+def _save(store, name, data):
+    """Write a store file atomically; an existing file already has this content."""
+    path = os.path.join(store, name)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _connector(allow_private):
+    def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        """socket.create_connection, refusing hosts with a non-public address.
+
+        The addresses that are checked are the ones connected to, so a DNS
+        answer that changes between check and connect cannot get around it.
+        """
+        host, port = address
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if not allow_private:
+            for *_, sockaddr in infos:
+                if not _is_public(sockaddr[0]):
+                    raise ImageFetchError(f"{host} is not a public address ({sockaddr[0]})")
+        error = OSError(f"Could not resolve {host}")
+        for family, socktype, proto, _, sockaddr in infos:
+            sock = socket.socket(family, socktype, proto)
+            try:
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error
+
+    return create_connection
+
+
+def _opener(allow_private):
+    """An opener for http(s) only, with no proxies, that checks every connection."""
+    connect = _connector(allow_private)
+
+    class HTTPConnection(http.client.HTTPConnection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._create_connection = connect
+
+    class HTTPSConnection(http.client.HTTPSConnection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._create_connection = connect
+
+    class HTTPHandler(urllib.request.HTTPHandler):
+        def http_open(self, req):
+            return self.do_open(HTTPConnection, req)
+
+    class HTTPSHandler(urllib.request.HTTPSHandler):
+        def https_open(self, req):
+            return self.do_open(HTTPSConnection, req, context=self._context)
+
+    opener = urllib.request.OpenerDirector()
+    # Redirects to other schemes (file:, ftp:) find no handler and fail.
+    for handler in (
+        HTTPHandler(),
+        HTTPSHandler(),
+        urllib.request.HTTPRedirectHandler(),
+        urllib.request.HTTPDefaultErrorHandler(),
+        urllib.request.HTTPErrorProcessor(),
+        urllib.request.UnknownHandler(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+
+def fetch(url, max_bytes, timeout, allow_private=False):
+    """Download an image; returns (content type, bytes)."""
+    if urlsplit(url).scheme not in ("http", "https"):
+        raise ImageFetchError(f"{url} is not an http(s) URL")
+    request = urllib.request.Request(url, headers={"User-Agent": "flask-blog-images"})
+    try:
+        with _opener(allow_private).open(request, timeout=timeout) as response:
+            content_type = response.headers.get_content_type()
+            if content_type not in CONTENT_TYPES:
+                raise ImageFetchError(f"{url} is not an image ({content_type})")
+            data = response.read(max_bytes + 1)
+    except (OSError, ValueError) as e:
+        raise ImageFetchError(f"Could not fetch {url}: {e}") from e
+    if len(data) > max_bytes:
+        raise ImageFetchError(f"{url} is larger than {max_bytes} bytes")
+    return content_type, data
+
+
+def _variant_formats():
+    return [fmt for fmt in VARIANT_FORMATS if features.check(fmt[0])]
+
+
+def _resize(store, digest, data, widths):
+    """Write the resized copies; returns (width, height, variants)."""
+    try:
+        with Image.open(BytesIO(data)) as original:
+            original = ImageOps.exif_transpose(original).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageFetchError(f"Unreadable image: {e}") from e
+    targets = {w for w in widths if w < original.width}
+    targets.add(min(original.width, max(widths)))
+    variants = []
+    for width in sorted(targets):
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for fmt, ext, _, options in _variant_formats():
+            buffer = BytesIO()
+            resized.save(buffer, fmt.upper(), **options)
+            name = _name(digest, f".{width}{ext}")
+            _save(store, name, buffer.getvalue())
+            variants.append([fmt, width, name])
+    return original.width, original.height, variants
+
+
+class ImageIngester:
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.store = app.config["IMAGE_STORE_DIR"] or os.path.join(
+            app.instance_path, "images"
+        )
+        app.extensions["image_ingester"] = self
+        app.add_url_rule("/images/<path:filename>", "post_image", self.serve)
+        app.add_template_global(image_sources)
+
+    def _executor(self):
+        with self._lock:
+            # Pools do not survive fork, so each gunicorn worker creates its own.
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.app.config["IMAGE_INGEST_THREADS"],
+                    thread_name_prefix="image-ingest",
+                )
+        return self._pool
+
+    def submit(self, post_id, url):
+        """Ingest the post's image in the background. Call after committing."""
+        if self.app.config["IMAGE_INGEST_BACKGROUND"]:
+            self._executor().submit(self._run, post_id, url)
+
+    def _run(self, post_id, url):
+        with self.app.app_context():
+            try:
+                self.ingest(post_id, url)
+            except ImageFetchError as e:
+                logger.warning(f"Post {post_id} keeps its remote image: {e}")
+            except Exception as e:
+                logger.error(f"Image ingest for post {post_id} failed: {e}")
+
+    def ingest(self, post_id, url):
+        """Store `url` (unless its content is already stored) and link it to the post.
+
+        Returns True if the image was new to the store.
+        """
+        config = self.app.config
+        content_type, data = fetch(
+            url,
+            config["IMAGE_MAX_BYTES"],
+            config["IMAGE_FETCH_TIMEOUT"],
+            allow_private=config["IMAGE_FETCH_ALLOW_PRIVATE"],
+        )
+        digest = hashlib.sha256(data).hexdigest()
+        stored = db.session.get(PostImage, digest) is None
+        if stored:
+            self._store(digest, content_type, data)
+        self._link(post_id, url, digest)
+        return stored
+
+    def _store(self, digest, content_type, data):
+        width = height = None
+        variants = []
+        if Image is not None:
+            width, height, variants = _resize(
+                self.store, digest, data, self.app.config["IMAGE_WIDTHS"]
+            )
+        original = _name(digest, CONTENT_TYPES[content_type])
+        _save(self.store, original, data)
+        image = PostImage(
+            digest=digest,  # type: ignore
+            original=original,  # type: ignore
+            content_type=content_type,  # type: ignore
+            size=len(data),  # type: ignore
+            width=width,  # type: ignore
+            height=height,  # type: ignore
+            variants=variants,  # type: ignore
+        )
+        db.session.add(image)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another thread stored the same image first.
+            db.session.rollback()
+
+    def _link(self, post_id, url, digest):
+        # Skip it if the post was deleted or given another image meanwhile.
+        row = db.session.execute(
+            select(BlogPost.img_url, BlogPost.image_digest)
+            .where(BlogPost.id == post_id)
+            .with_for_update()
+        ).first()
+        if row is None or row.img_url != url or row.image_digest == digest:
+            db.session.rollback()
+            return
+        meta = bump_post_version(post_id, image_digest=digest)
+        db.session.commit()
+        publish_post_version(post_id, meta)
+
+    def pending(self, everything=False):
+        """(id, img_url) of posts without a local image, or of all posts."""
+        stmt = select(BlogPost.id, BlogPost.img_url).order_by(BlogPost.id)
+        if not everything:
+            stmt = stmt.where(BlogPost.image_digest.is_(None))
+        return db.session.execute(stmt).all()
+
+    def serve(self, filename):
+        response = send_from_directory(
+            self.store,
+            filename,
+            max_age=current_app.config["STATIC_IMMUTABLE_MAX_AGE"],
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def image_sources(image):
+    """(mimetype, srcset) for each resized format of a PostImage, preferred first."""
+    sources = []
+    for fmt, _, mimetype, _ in VARIANT_FORMATS:
+        srcset = ", ".join(
+            f"{url_for('post_image', filename=name)} {width}w"
+            for variant_fmt, width, name in image.variants or []
+            if variant_fmt == fmt
+        )
+        if srcset:
+            sources.append((mimetype, srcset))
+    return sources
+
+
+image_ingester = ImageIngester()
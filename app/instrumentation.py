@@ -0,0 +1,52 @@
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def query_budget(limit):
+    """Declare the maximum number of SQL statements a view may issue."""
+
+    def decorator(func):
+        func.query_budget = limit
+        return func
+
+    return decorator
+
+
+def _reset_query_count():
+    g.query_count = 0
+
+
+def _check_query_budget(response):
+    view = current_app.view_functions.get(request.endpoint or "")
+    limit = getattr(view, "query_budget", None)
+    if limit is None:
+        limit = current_app.config.get("QUERY_BUDGET_DEFAULT")
+    count = g.get("query_count", 0)
+    if limit is None or count <= limit:
+        return response
+
+    message = (
+        f"{request.endpoint} issued {count} queries "
+        f"(budget {limit}) for {request.method} {request.full_path}"
+    )
+    if current_app.config.get("QUERY_BUDGET_RAISE"):
+        raise QueryBudgetExceeded(message)
+    if current_app.config.get("QUERY_BUDGET_LOG"):
+        current_app.logger.warning(f"Query budget exceeded: {message}")
+    return response
+
+
+def init_app(app):
+    app.before_request(_reset_query_count)
+    app.after_request(_check_query_budget)
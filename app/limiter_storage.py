@@ -0,0 +1,163 @@
+"""Rate limit counters shared by every gunicorn worker on a host.
+
+The `memory://` storage keeps counters inside each process, so a limit of
+5 per minute really allows 5 per worker and resets on every restart. This
+storage keeps them in one SQLite file (on tmpfs by default), which every
+worker reads and updates with single-statement upserts.
+
+Use it with RATELIMIT_STORAGE_URI:
+
+    sqlite://                    default file under /dev/shm
+    sqlite:///relative/path.db
+    sqlite:////absolute/path.db
+
+It supports the fixed-window and moving-window (sliding log) strategies.
+For several hosts, point RATELIMIT_STORAGE_URI at a Redis-protocol server
+(redis://...) instead; that needs the `redis` package.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from limits.storage import MovingWindowSupport, Storage
+
+# Expired rows are purged at most this often per process.
+PURGE_INTERVAL = 60.0
+
+
+def default_path():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "flask-blog-limits", "limits.sqlite")
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        path = (uri or "").split("://", 1)[-1]
+        # Same convention as SQLAlchemy: three slashes relative, four absolute.
+        self.path = path[1:] if path.startswith("/") else path
+        self.path = self.path or default_path()
+        self._local = threading.local()
+        self._last_purge = 0.0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connect().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT NOT NULL,
+                atime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_entries_key_atime ON entries (key, atime);
+            """
+        )
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connect(self):
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _purge(self, now):
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        conn = self._connect()
+        conn.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+        # Moving windows are at most a day long in this app; older entries
+        # can no longer count against any limit.
+        conn.execute("DELETE FROM entries WHERE atime <= ?", (now - 86400,))
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        self._purge(now)
+        (count,) = self._connect().execute(
+            "INSERT INTO counters (key, count, expires) VALUES (?1, ?2, ?3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires <= ?4 THEN ?2 ELSE count + ?2 END, "
+            "expires = CASE WHEN expires <= ?4 THEN ?3 ELSE expires END "
+            "RETURNING count",
+            (key, amount, now + expiry, now),
+        ).fetchone()
+        return count
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT count FROM counters WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connect().execute(
+            "SELECT expires FROM counters WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connect().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM counters").rowcount
+        removed += conn.execute("DELETE FROM entries").rowcount
+        return removed
+
+    def clear(self, key):
+        conn = self._connect()
+        conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        self._purge(now)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM entries WHERE key = ? AND atime < ?", (key, now - expiry)
+            )
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            acquired = count + amount <= limit
+            if acquired:
+                conn.executemany(
+                    "INSERT INTO entries (key, atime) VALUES (?, ?)",
+                    [(key, now)] * amount,
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        oldest, count = self._connect().execute(
+            "SELECT MIN(atime), COUNT(*) FROM entries WHERE key = ? AND atime >= ?",
+            (key, now - expiry),
+        ).fetchone()
+        return (oldest or now, count)
@@ -0,0 +1,92 @@
+"""Brute-force throttling for /login, checked before any password hashing.
+
+Failed logins are counted per client IP and per email address in the rate
+limiter's shared storage. Past a few free attempts each further failure
+locks that IP or address out for exponentially longer, and locked-out
+attempts are rejected before the user lookup, so a guessing attacker costs
+a couple of counter reads instead of a PBKDF2 check.
+
+Unknown email addresses are checked against a dummy hash, so they take as
+long as real ones, and are throttled exactly like them. Setting
+RATELIMIT_ENABLED=false turns the throttle off along with the rate limits.
+
+Failures, rejections and the hashing time rejections saved (at the worker's
+average hash time) are counters on /metrics, summed across workers.
+"""
+import time
+
+from flask_limiter.util import get_remote_address
+
+from . import metrics
+from .extensions import limiter
+from .passwords import password_hasher
+
+
+class LoginThrottle:
+    def __init__(self, app=None):
+        self._dummy_hash = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.account_attempts = app.config["LOGIN_THROTTLE_ACCOUNT_ATTEMPTS"]
+        self.ip_attempts = app.config["LOGIN_THROTTLE_IP_ATTEMPTS"]
+        self.base_delay = app.config["LOGIN_THROTTLE_BASE_DELAY"]
+        self.max_delay = app.config["LOGIN_THROTTLE_MAX_DELAY"]
+        self.window = app.config["LOGIN_THROTTLE_WINDOW"]
+        app.extensions["login_throttle"] = self
+
+    def _scopes(self, email):
+        return [
+            ("ip", get_remote_address(), self.ip_attempts),
+            ("account", email.strip().lower(), self.account_attempts),
+        ]
+
+    def retry_after(self, email):
+        """Seconds until this client may try `email` again, or 0 if it may now."""
+        if not limiter.enabled:
+            return 0
+        storage = limiter.storage
+        now = time.time()
+        for scope, value, _ in self._scopes(email):
+            key = f"login-lock/{scope}/{value}"
+            if storage.get(key):
+                metrics.count("blog_login_throttled_total", scope=scope)
+                metrics.count(
+                    "blog_login_hash_seconds_saved_total",
+                    password_hasher.stats()["seconds_avg"],
+                )
+                return max(1, int(storage.get_expiry(key) - now + 0.999))
+        return 0
+
+    def failed(self, email):
+        metrics.count("blog_login_failures_total")
+        if not limiter.enabled:
+            return
+        storage = limiter.storage
+        for scope, value, free in self._scopes(email):
+            failures = storage.incr(f"login-fail/{scope}/{value}", self.window)
+            if failures > free:
+                # A lock can only be set while none is active (locked-out
+                # attempts never get here), so incr starts a fresh expiry.
+                delay = min(self.base_delay * 2 ** (failures - free - 1), self.max_delay)
+                storage.incr(f"login-lock/{scope}/{value}", max(1, int(delay)))
+
+    def succeeded(self, email):
+        # Only the account is forgiven: one valid login from a shared IP
+        # must not reset the count for guesses against other accounts.
+        if not limiter.enabled:
+            return
+        storage = limiter.storage
+        value = email.strip().lower()
+        storage.clear(f"login-fail/account/{value}")
+        storage.clear(f"login-lock/account/{value}")
+
+    def dummy_hash(self):
+        """A hash to check unknown emails against, made with the current method."""
+        if self._dummy_hash is None:
+            self._dummy_hash = password_hasher.hash("not-a-real-password")
+        return self._dummy_hash
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,257 @@
+"""Outbound mail queue.
+
+Requests never talk to the SMTP server. They write an OutboxMessage row in
+the same transaction as the data that triggered it and wake the sender.
+The sender claims due rows in batches, delivers them from a small thread
+pool (one reused SMTP connection per chunk) and reschedules failures with
+exponential backoff. Claims are leases, so rows held by a worker that died
+become due again and are picked up by another. Every worker runs a sender,
+so a lease is taken with a compare-and-set on next_attempt_at and two
+senders never claim the same row.
+
+Each process also wakes its sender on its first request, so mail left
+pending by a restart goes out without waiting for a new message. The
+background thread polls every MAIL_POLL_INTERVAL while anything is still
+pending (e.g. waiting for a retry) and exits once the outbox is empty.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from flask_mail import Message
+from sqlalchemy import or_, select, update
+
+from .extensions import db, mail
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+CLAIM_LEASE = timedelta(minutes=5)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue(subject, recipients, html, sender=None, reply_to=None):
+    """Add a message to the outbox; it is sent once the session commits."""
+    message = OutboxMessage(
+        subject=subject,  # type: ignore
+        sender=sender,  # type: ignore
+        recipients=",".join(recipients),  # type: ignore
+        reply_to=reply_to,  # type: ignore
+        html=html,  # type: ignore
+        next_attempt_at=utcnow(),  # type: ignore
+    )
+    db.session.add(message)
+    return message
+
+
+class OutboxSender:
+    def __init__(self, app=None):
+        self.app = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._pool = None
+        self._pool_pid = None
+        self._started_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["mail_outbox"] = self
+        app.before_request(self._wake_once)
+
+    def _wake_once(self):
+        if self._started_pid != os.getpid():
+            self._started_pid = os.getpid()
+            self.wake()
+
+    def wake(self):
+        """Deliver soon. Starts the background thread in this process if needed."""
+        if not self.app.config["MAIL_OUTBOX_BACKGROUND"]:
+            return
+        with self._lock:
+            self._wake.set()
+            # Threads do not survive fork, so each gunicorn worker starts its own.
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run_background, name="mail-outbox", daemon=True
+                )
+                self._thread.start()
+
+    def _run_background(self):
+        interval = self.app.config["MAIL_POLL_INTERVAL"]
+        while True:
+            self._wake.clear()
+            pending = True
+            try:
+                with self.app.app_context():
+                    while self.deliver_due():
+                        pass
+                    pending = self.has_pending()
+            except Exception as e:
+                logger.error(f"Outbox sender error: {e}")
+            if not pending:
+                with self._lock:
+                    # A wake() since the check means there is new mail.
+                    if not self._wake.is_set():
+                        self._thread = None
+                        return
+                continue
+            self._wake.wait(interval)
+
+    def has_pending(self):
+        """Whether any message is still to be sent, now or on a later retry."""
+        return (
+            db.session.scalar(
+                select(OutboxMessage.id).where(OutboxMessage.status == "pending").limit(1)
+            )
+            is not None
+        )
+
+    def run_forever(self):
+        interval = self.app.config["MAIL_POLL_INTERVAL"]
+        while True:
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self.deliver_due():
+                        pass
+            except Exception as e:
+                logger.error(f"Outbox sender error: {e}")
+            self._wake.wait(interval)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool_pid = os.getpid()
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.app.config["MAIL_SENDER_THREADS"],
+                    thread_name_prefix="mail-send",
+                )
+        return self._pool
+
+    def _lease(self, message_id, seen, until):
+        """Take the lease on one message unless another sender changed it first."""
+        if seen is None:
+            unchanged = OutboxMessage.next_attempt_at.is_(None)
+        else:
+            unchanged = OutboxMessage.next_attempt_at == seen
+        result = db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id, OutboxMessage.status == "pending", unchanged)
+            .values(next_attempt_at=until)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def _claim(self, limit):
+        """Lease up to `limit` due messages and return plain snapshots of them."""
+        now = utcnow()
+        rows = db.session.execute(
+            select(
+                OutboxMessage.id,
+                OutboxMessage.attempts,
+                OutboxMessage.next_attempt_at,
+                OutboxMessage.subject,
+                OutboxMessage.sender,
+                OutboxMessage.recipients,
+                OutboxMessage.reply_to,
+                OutboxMessage.html,
+            )
+            .where(
+                OutboxMessage.status == "pending",
+                or_(
+                    OutboxMessage.next_attempt_at.is_(None),
+                    OutboxMessage.next_attempt_at <= now,
+                ),
+            )
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+        ).all()
+        claimed = []
+        for row in rows:
+            # Compare-and-set instead of SELECT ... FOR UPDATE, which SQLite
+            # ignores: a row another sender claimed or sent since the select
+            # no longer matches and is skipped.
+            if not self._lease(row.id, row.next_attempt_at, now + CLAIM_LEASE):
+                continue
+            message = Message(
+                subject=row.subject,
+                sender=row.sender,
+                recipients=row.recipients.split(","),
+                reply_to=row.reply_to,
+                html=row.html,
+            )
+            claimed.append((row.id, row.attempts, message))
+        db.session.commit()
+        return claimed
+
+    def _send_chunk(self, messages):
+        """Send (id, Message) pairs over one SMTP connection."""
+        results = []
+        with self.app.app_context():
+            try:
+                with mail.connect() as conn:
+                    for message_id, message in messages:
+                        try:
+                            conn.send(message)
+                            results.append((message_id, None))
+                        except Exception as e:
+                            results.append((message_id, str(e)))
+            except Exception as e:
+                done = {message_id for message_id, _ in results}
+                results.extend(
+                    (message_id, str(e))
+                    for message_id, _ in messages
+                    if message_id not in done
+                )
+        return results
+
+    def deliver_due(self):
+        """Send one batch of due messages. Returns how many were attempted."""
+        config = self.app.config
+        claimed = self._claim(config["MAIL_BATCH_SIZE"])
+        if not claimed:
+            return 0
+
+        messages = [(message_id, message) for message_id, _, message in claimed]
+        threads = config["MAIL_SENDER_THREADS"]
+        chunks = [messages[i::threads] for i in range(threads) if messages[i::threads]]
+        results = dict(
+            r for chunk in self._executor().map(self._send_chunk, chunks) for r in chunk
+        )
+
+        now = utcnow()
+        updates = []
+        for message_id, attempts, _ in claimed:
+            error = results.get(message_id)
+            attempts += 1
+            if error is None:
+                updates.append(
+                    dict(id=message_id, attempts=attempts, status="sent", sent_at=now)
+                )
+                continue
+            changes = dict(id=message_id, attempts=attempts, last_error=error[:1000])
+            if attempts >= config["MAIL_MAX_ATTEMPTS"]:
+                changes["status"] = "failed"
+                logger.error(f"Giving up on outbox message {message_id}: {error}")
+            else:
+                delay = timedelta(seconds=config["MAIL_RETRY_BASE"] * 2 ** (attempts - 1))
+                changes["next_attempt_at"] = now + min(delay, MAX_BACKOFF)
+                logger.warning(f"Outbox message {message_id} failed, retrying: {error}")
+            updates.append(changes)
+        db.session.execute(update(OutboxMessage), updates)
+        db.session.commit()
+        return len(claimed)
+
+
+mail_outbox = OutboxSender()
@@ -0,0 +1,331 @@
+"""Per-endpoint request metrics in Prometheus text format.
+
+Each request records where its time went: SQL (time and statement count,
+from engine events), template rendering (Flask's render signals), cache
+hits and misses, HTML sanitizing and password hashing. When it finishes
+those numbers are added to histograms labelled with the endpoint.
+
+Every gunicorn worker keeps its own registry and writes it to
+METRICS_DIR/metrics-<pid>.json at most once per METRICS_FLUSH_INTERVAL.
+/metrics sums the files of all workers, so any worker can answer the
+scrape. Files of exited workers are kept so counters never go backwards;
+empty METRICS_DIR when deploying.
+
+/metrics is off (404) unless METRICS_TOKEN or METRICS_ALLOWED_IPS is set:
+it names every endpoint and shows replica lag and the password hashing
+queue of the worker that answers.
+"""
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import (
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .cache_backends import cache_lookup
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+HISTOGRAMS = {
+    "blog_request_seconds": ("Time spent handling the request.", TIME_BUCKETS),
+    "blog_sql_seconds": ("Time spent executing SQL per request.", TIME_BUCKETS),
+    "blog_sql_queries": ("SQL statements issued per request.", COUNT_BUCKETS),
+    "blog_template_seconds": ("Time spent rendering templates per request.", TIME_BUCKETS),
+    "blog_sanitize_seconds": ("Time spent in bleach per request.", TIME_BUCKETS),
+    "blog_password_hash_seconds": ("Time spent hashing passwords per request.", TIME_BUCKETS),
+}
+COUNTERS = {
+    "blog_requests_total": "Requests handled, by endpoint and status.",
+    "blog_cache_lookups_total": "Cache lookups, by endpoint and result.",
+    "blog_db_reads_total": "Replica-eligible requests, by endpoint and the database used.",
+    "blog_login_failures_total": "Failed logins.",
+    "blog_login_throttled_total": "Logins rejected by the throttle before hashing, by scope.",
+    "blog_login_hash_seconds_saved_total": (
+        "Password hashing time throttled logins did not spend (at the average hash time)."
+    ),
+}
+# Gauges are sampled when /metrics is scraped, from functions registered
+# with `gauge_source` that return (name, labels, value) triples.
+GAUGES = {
+    "blog_replica_lag_seconds": (
+        "Seconds since the newest write a lagging replica has applied (0 when caught up)."
+    ),
+    "blog_replica_behind_transactions": "Write transactions a read replica has not applied.",
+    "blog_password_hash_in_flight": "Password hashes running or queued in this worker.",
+    "blog_password_hash_peak_in_flight": "Most password hashes ever in flight in this worker.",
+    "blog_password_hash_latency_seconds": (
+        "Average and slowest password hash in this worker, including queueing."
+    ),
+}
+_gauge_sources = []
+
+# Request measurements -> histogram they feed.
+MEASUREMENTS = {
+    "sql_seconds": "blog_sql_seconds",
+    "sql_queries": "blog_sql_queries",
+    "template_seconds": "blog_template_seconds",
+    "sanitize_seconds": "blog_sanitize_seconds",
+    "hash_seconds": "blog_password_hash_seconds",
+}
+
+
+def add(name, value):
+    """Add to one of the current request's measurements (no-op outside requests)."""
+    if has_request_context() and "metrics" in g:
+        g.metrics[name] += value
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    add("sql_seconds", time.perf_counter() - context.metrics_started)
+    add("sql_queries", 1)
+
+
+def _template_started(sender, template, context, **extra):
+    if "metrics" in g:
+        g.metrics_templates.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    if "metrics" in g and g.metrics_templates:
+        add("template_seconds", time.perf_counter() - g.metrics_templates.pop())
+
+
+def _cache_lookup(sender, hit, **extra):
+    if has_request_context() and "metrics" in g:
+        g.metrics["cache_hits" if hit else "cache_misses"] += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            entry = self.histograms.setdefault(
+                key, {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def inc(self, name, labels, value=1):
+        if value:
+            with self._lock:
+                self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def dump(self):
+        with self._lock:
+            return {
+                "histograms": [[n, list(l), e] for (n, l), e in self.histograms.items()],
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+            }
+
+    def flush(self, directory, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.dump(), f)
+        # Atomic, so a scrape never reads a half-written file.
+        os.replace(tmp, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+
+registry = Registry()
+
+
+def count(name, value=1, **labels):
+    """Add to one of the COUNTERS outside the per-request measurements."""
+    registry.inc(name, _labels(**labels), value)
+
+
+def gauge_source(func):
+    # init_app may run more than once (tests create many apps).
+    if func not in _gauge_sources:
+        _gauge_sources.append(func)
+    return func
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def _start_request():
+    g.metrics = {name: 0 for name in MEASUREMENTS}
+    g.metrics.update(cache_hits=0, cache_misses=0)
+    g.metrics_templates = []
+    g.metrics_started = time.perf_counter()
+
+
+def _finish_request(response):
+    if "metrics" not in g:
+        return response
+    endpoint = request.endpoint or "unmatched"
+    labels = _labels(endpoint=endpoint)
+    registry.observe(
+        "blog_request_seconds", labels, time.perf_counter() - g.metrics_started
+    )
+    for measurement, histogram in MEASUREMENTS.items():
+        registry.observe(histogram, labels, g.metrics[measurement])
+    registry.inc(
+        "blog_requests_total", _labels(endpoint=endpoint, status=str(response.status_code))
+    )
+    for result in ("hits", "misses"):
+        registry.inc(
+            "blog_cache_lookups_total",
+            _labels(endpoint=endpoint, result=result),
+            g.metrics[f"cache_{result}"],
+        )
+    registry.flush(_directory())
+    return response
+
+
+def _address_allowed(address, allowed):
+    try:
+        address = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network.strip(), strict=False)
+        for network in allowed.split(",")
+        if network.strip()
+    )
+
+
+def scrape_denied():
+    """The status to refuse this /metrics request with, or None to allow it.
+
+    A matching bearer token or a client address in METRICS_ALLOWED_IPS is
+    enough. Nothing is allowed when neither is configured.
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    allowed = current_app.config["METRICS_ALLOWED_IPS"]
+    if not token and not allowed:
+        return 404
+    if token and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return None
+    if allowed and _address_allowed(request.remote_addr, allowed):
+        return None
+    return 401 if token else 403
+
+
+def _directory():
+    return current_app.config["METRICS_DIR"] or os.path.join(
+        tempfile.gettempdir(), "flask-blog-metrics"
+    )
+
+
+def collect(directory):
+    """Sum the registries of every worker that has written to `directory`."""
+    histograms = {}
+    counters = {}
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, entry in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(
+                key, {"buckets": [0] * len(entry["buckets"]), "sum": 0.0, "count": 0}
+            )
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], entry["buckets"])]
+            total["sum"] += entry["sum"]
+            total["count"] += entry["count"]
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All workers' metrics in the Prometheus text exposition format."""
+    directory = _directory()
+    registry.flush(directory, force=True)
+    histograms, counters = collect(directory)
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (metric, labels), entry in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(buckets, entry["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {count}")
+            lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {entry["count"]}')
+            lines.append(f"{name}_sum{_format_labels(labels)} {entry['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    gauges = [sample for source in _gauge_sources for sample in source()]
+    for name, help_text in GAUGES.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for metric, labels, value in gauges:
+            if metric == name:
+                lines.append(f"{name}{_format_labels(_labels(**labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    registry.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    cache_lookup.connect(_cache_lookup)
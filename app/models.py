@@ -1,10 +1,26 @@
 from flask_login import UserMixin
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    DateTime,
+    ForeignKey,
+    JSON,
+    Index,
+    Integer,
+    String,
+    Text,
+    event,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
 from hashlib import md5
 from .extensions import db
+from .sanitize import POLICY_VERSION
+
+
+def gravatar_url(digest, size):
+    return f"https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}"
 
 
 class BlogPost(db.Model):
@@ -13,24 +29,75 @@ class BlogPost(db.Model):
     title: Mapped[str] = mapped_column(String(150), unique=True, nullable=False)
     subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
     img_url: Mapped[str] = mapped_column(String(250), nullable=False)
+    # Local copy of img_url once it has been ingested (see app/images.py).
+    image_digest: Mapped[str] = mapped_column(
+        String(64), ForeignKey("post_images.digest"), nullable=True
+    )
     date: Mapped[str] = mapped_column(String(250), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=func.now(), server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     body: Mapped[str] = mapped_column(Text, nullable=False)
+    # What the author submitted; `body` is this after sanitizing with
+    # policy `sanitize_policy` (see app/sanitize.py). NULL for old rows.
+    body_raw: Mapped[str] = mapped_column(Text, nullable=True)
+    sanitize_policy: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=POLICY_VERSION, server_default="1"
+    )
+    # Bumped on every change that affects the rendered post page.
+    version: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=1, server_default="1"
+    )
+    # Denormalized from comments, updated together with `version`.
+    comment_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    last_comment_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     author_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("users.id"), nullable=False
+        Integer, ForeignKey("users.id"), nullable=False, index=True
     )
     author: Mapped["User"] = relationship("User", back_populates="posts")
+    image: Mapped["PostImage"] = relationship("PostImage")
     comments: Mapped[list["Comment"]] = relationship(
-        "Comment", back_populates="parent_post", cascade="all, delete-orphan"
+        "Comment",
+        back_populates="parent_post",
+        cascade="all, delete-orphan",
+        order_by="Comment.created_at",
     )
 
 
+class PostImage(db.Model):
+    """A post image in the local store, keyed by the SHA-256 of its content."""
+
+    __tablename__ = "post_images"
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)
+    # Store paths, relative to IMAGE_STORE_DIR
+    original: Mapped[str] = mapped_column(String(100), nullable=False)
+    content_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Unknown when Pillow was not available to read the image
+    width: Mapped[int] = mapped_column(Integer, nullable=True)
+    height: Mapped[int] = mapped_column(Integer, nullable=True)
+    # [[format, width, path], ...], narrowest first
+    variants: Mapped[list] = mapped_column(JSON, nullable=False, default=list)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+
 class Comment(db.Model):
     __tablename__ = "comments"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     text: Mapped[str] = mapped_column(Text, nullable=False)
+    text_raw: Mapped[str] = mapped_column(Text, nullable=True)
+    sanitize_policy: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=POLICY_VERSION, server_default="1"
+    )
     date: Mapped[str] = mapped_column(String(250), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=func.now(), server_default=func.now()
+    )
     author_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("users.id"), nullable=False
+        Integer, ForeignKey("users.id"), nullable=False, index=True
     )
     post_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("blog_posts.id"), nullable=False
@@ -41,6 +108,10 @@ class Comment(db.Model):
     )
 
 
+Index("ix_blog_posts_created_at_id", BlogPost.created_at.desc(), BlogPost.id)
+Index("ix_comments_post_id_created_at", Comment.post_id, Comment.created_at)
+
+
 class ContactSubmission(db.Model):
     __tablename__ = "contact_submissions"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -52,6 +123,57 @@ class ContactSubmission(db.Model):
     user_agent: Mapped[str] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_contact_submissions_created_at_id", "created_at", "id"),
+    )
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = "mail_outbox"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    subject: Mapped[str] = mapped_column(String(255), nullable=False)
+    sender: Mapped[str] = mapped_column(String(254), nullable=True)
+    recipients: Mapped[str] = mapped_column(Text, nullable=False)
+    reply_to: Mapped[str] = mapped_column(String(254), nullable=True)
+    html: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(
+        String(20), nullable=False, default="pending", server_default="pending"
+    )
+    attempts: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_mail_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class ReplicationHeartbeat(db.Model):
+    """A single row the primary updates in every write transaction.
+
+    Its position tells how far a read replica has caught up; see
+    app/replicas.py.
+    """
+
+    __tablename__ = "replication_heartbeat"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    position: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    beat_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+event.listen(
+    ReplicationHeartbeat.__table__,
+    "after_create",
+    DDL(
+        "INSERT INTO replication_heartbeat (id, position, beat_at) "
+        "VALUES (1, 0, CURRENT_TIMESTAMP)"
+    ),
+)
+
 
 class User(db.Model, UserMixin):
     __tablename__ = "users"
@@ -64,6 +186,9 @@ class User(db.Model, UserMixin):
     posts: Mapped[list["BlogPost"]] = relationship("BlogPost", back_populates="author")
     comments: Mapped[list["Comment"]] = relationship("Comment", back_populates="author")
 
+    @property
+    def avatar_digest(self):
+        return md5(self.email.lower().encode("utf-8")).hexdigest()
+
     def avatar(self, size):
-        digest = md5(self.email.lower().encode("utf-8")).hexdigest()
-        return f"https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}"
+        return gravatar_url(self.avatar_digest, size)
@@ -0,0 +1,163 @@
+"""Whole-page and HTTP caching for anonymous visitors.
+
+Pages rendered for anonymous GET requests leave out everything that
+differs between visitors (the CSRF meta tag, flashed messages), so one
+rendered copy can be served to all of them. The browser fetches those
+pieces separately when it needs them (see static/js/scripts.js).
+Logged-in users always get a freshly rendered page.
+
+`conditional_get` answers revalidation requests (If-None-Match /
+If-Modified-Since) from the content version alone, before any rendering,
+but only for responses without per-visitor content.
+"""
+from datetime import timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+
+from .extensions import cache
+
+FLASH_COOKIE = "has_flashes"
+
+
+def deferring_user_content():
+    return g.get("deferred_user_content", False)
+
+
+def _cacheable():
+    return (
+        current_app.config.get("ANONYMOUS_PAGE_CACHE")
+        and request.method == "GET"
+        and not current_user.is_authenticated
+    )
+
+
+def _shared_page_path(params):
+    """The path and normalized query of this request's shared page, or None
+    when the request gets a page of its own (or is not cacheable)."""
+    if not _cacheable() or any(name not in params for name in request.args):
+        return None
+    query = urlencode([(name, request.args[name]) for name in params if name in request.args])
+    return f"{request.path}?{query}" if query else request.path
+
+
+def anonymous_page_cache(version=None, timeout=None, mimetype=None, params=()):
+    """Cache the view's HTML for anonymous visitors.
+
+    `version` receives the view arguments and returns a token that changes
+    whenever the page content does; it becomes part of the cache key.
+    `params` names the query parameters the view reads. They are part of the
+    key too; requests with any other parameter are rendered without the
+    cache, so junk query strings cannot fill it. Views that do not return
+    HTML pass their `mimetype` for cache hits.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            path = _shared_page_path(params)
+            if path is None:
+                return view(*args, **kwargs)
+            token = version(**kwargs) if version else ""
+            if token is None:
+                return view(*args, **kwargs)
+
+            g.deferred_user_content = True
+            key = f"page:{token}:{path}"
+            body = cache.get(key)
+            if body is not None:
+                response = make_response(body)
+                if mimetype:
+                    response.mimetype = mimetype
+                response.headers["X-Page-Cache"] = "hit"
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                cache.set(
+                    key,
+                    response.get_data(),
+                    timeout=timeout or current_app.config["PAGE_CACHE_TIMEOUT"],
+                )
+                response.headers["X-Page-Cache"] = "miss"
+            _public_cache_headers(response)
+            return response
+
+        decorated_function.page_cache_params = params
+        return decorated_function
+
+    return decorator
+
+
+def _public_cache_headers(response):
+    if current_app.config["SESSION_COOKIE_NAME"] not in request.cookies:
+        max_age = current_app.config["PAGE_CACHE_MAX_AGE"]
+        response.headers["Cache-Control"] = f"public, max-age={max_age}"
+
+
+def conditional_get(validators, session_free=False):
+    """Answer conditional GETs for anonymous visitors with 304 Not Modified.
+
+    `validators` receives the view arguments and returns (etag, last_modified)
+    or None when the resource does not exist. It should be cheap: it runs
+    before the view, and on a match the view never runs.
+
+    The validators only track content, so a page is revalidated only when it
+    is the shared anonymous page from `anonymous_page_cache` (or the view is
+    `session_free`, like the feeds). Other pages embed a per-session CSRF
+    token that a 304 would leave stale in the browser.
+    """
+
+    def decorator(view):
+        params = getattr(view, "page_cache_params", None)
+
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET" or current_user.is_authenticated:
+                return view(*args, **kwargs)
+            if not session_free and (params is None or _shared_page_path(params) is None):
+                return view(*args, **kwargs)
+            found = validators(**kwargs)
+            if found is None:
+                return view(*args, **kwargs)
+            etag, last_modified = found
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(last_modified and since and last_modified <= since)
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            _public_cache_headers(response)
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def sync_flash_cookie(response):
+    """Tell the browser's script whether there are messages to fetch."""
+    pending = "_flashes" in session
+    if pending and request.cookies.get(FLASH_COOKIE) != "1":
+        response.set_cookie(FLASH_COOKIE, "1", samesite="Lax")
+    elif not pending and FLASH_COOKIE in request.cookies:
+        response.delete_cookie(FLASH_COOKIE)
+    return response
+
+
+def init_app(app):
+    app.after_request(sync_flash_cookie)
@@ -0,0 +1,97 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, select, tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, key):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(key):
+            raise ValueError("cursor does not match the sort key")
+        return [
+            datetime.fromisoformat(v) if isinstance(c.type, DateTime) else v
+            for c, v in zip(key, values)
+        ]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+class KeysetPage:
+    """One page of results plus the cursors needed to move either way."""
+
+    def __init__(self, items, key, has_prev, has_next):
+        self.items = items
+        self.key = key
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+    def _cursor(self, item):
+        return encode_cursor(getattr(item, col.key) for col in self.key)
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor(self.items[0])
+        return None
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor(self.items[-1])
+        return None
+
+
+def keyset_paginate(
+    session, stmt, key, after=None, before=None, per_page=10, descending=True
+):
+    """Paginate `stmt` on the `key` columns without COUNT/OFFSET.
+
+    Pages run newest-first (largest key first) unless `descending` is False.
+    `after` continues past the last item of a page, `before` walks back
+    towards the first page. Both are tokens from `encode_cursor`.
+    """
+    cols = tuple_(*key)
+
+    def beyond(values, forward):
+        # Rows that come after `values` when walking in the given direction.
+        return cols < tuple_(*values) if forward == descending else cols > tuple_(*values)
+
+    def ordered(forward):
+        return [c.desc() if forward == descending else c.asc() for c in key]
+
+    if before:
+        values = decode_cursor(before, key)
+        back = stmt.where(beyond(values, False)).order_by(*ordered(False))
+        rows = session.scalars(back.limit(per_page + 1)).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        # The cursor row itself may be gone; anything from there on counts.
+        rest = stmt.where(~beyond(values, False)).limit(1)
+        has_next = session.scalar(select(rest.exists())) or False
+        return KeysetPage(items, key, has_prev=has_prev, has_next=has_next)
+
+    if after:
+        values = decode_cursor(after, key)
+        stmt = stmt.where(beyond(values, True))
+    stmt = stmt.order_by(*ordered(True))
+    rows = session.scalars(stmt.limit(per_page + 1)).all()
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], key, has_prev=bool(after), has_next=has_next)
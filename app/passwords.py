@@ -0,0 +1,157 @@
+"""Password hashing off the request thread.
+
+PBKDF2 at 600k iterations is hundreds of milliseconds of pure CPU. Hashes
+and checks run in a small process pool with a hard cap on how many may be
+waiting; past that cap callers get HashPoolBusy immediately and should ask
+the user to retry, instead of every worker piling onto the CPU at once.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+from . import metrics
+
+
+class HashPoolBusy(RuntimeError):
+    pass
+
+
+def _full_method(method):
+    """`method` with werkzeug's defaults filled in, as it appears in hashes."""
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    if name == "scrypt" and not args:
+        return f"scrypt:{2**15}:8:1"
+    return method
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.method = "pbkdf2:sha256:600000"
+        self.workers = 0
+        self.max_queue = 0
+        self.timeout = None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.rejected = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.max_queue = app.config["PASSWORD_HASH_MAX_QUEUE"]
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        app.extensions["password_hasher"] = self
+        metrics.gauge_source(self.gauge_samples)
+
+    def _executor(self):
+        # Pools do not survive fork, so each gunicorn worker creates its own.
+        if self._pool is None or self._pid != os.getpid():
+            # Children only run hashlib code, so plain fork is safe and, unlike
+            # spawn/forkserver, does not re-import the server's main module.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            self._pid = os.getpid()
+        return self._pool
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _broken(self, error):
+        with self._lock:
+            self._pool = None
+        raise HashPoolBusy("password hashing pool restarted") from error
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self.workers and self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashPoolBusy("password hashing queue is full")
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            pool = self._executor() if self.workers else None
+
+        started = time.perf_counter()
+        try:
+            if pool is None:
+                try:
+                    return func(*args)
+                finally:
+                    self._release()
+            try:
+                future = pool.submit(func, *args)
+            except BrokenProcessPool as e:
+                self._release()
+                self._broken(e)
+            # The slot is freed when the job ends, not when the caller stops
+            # waiting: a timed-out hash still occupies a pool process.
+            future.add_done_callback(self._release)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError as e:
+                future.cancel()
+                raise HashPoolBusy("password hashing timed out") from e
+            except BrokenProcessPool as e:
+                self._broken(e)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.add("hash_seconds", elapsed)
+            with self._lock:
+                self.calls += 1
+                self.seconds_total += elapsed
+                self.seconds_max = max(self.seconds_max, elapsed)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when the stored hash was made with a different method or cost."""
+        return pwhash.split("$", 1)[0] != _full_method(self.method)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "seconds_total": self.seconds_total,
+                "seconds_max": self.seconds_max,
+                "seconds_avg": self.seconds_total / self.calls if self.calls else 0.0,
+            }
+
+    def gauge_samples(self):
+        stats = self.stats()
+        return [
+            ("blog_password_hash_in_flight", {}, stats["in_flight"]),
+            ("blog_password_hash_peak_in_flight", {}, stats["peak_in_flight"]),
+            ("blog_password_hash_latency_seconds", {"stat": "avg"}, stats["seconds_avg"]),
+            ("blog_password_hash_latency_seconds", {"stat": "max"}, stats["seconds_max"]),
+        ]
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,206 @@
+"""Read replicas for GET views, with read-your-writes consistency.
+
+GET requests to views marked with `read_replica` read from one of the
+`replica*` binds in SQLALCHEMY_BINDS (set from DATABASE_REPLICA_URLS) when
+that is safe. Writes, and every other view, use the primary.
+
+Safety is tracked with a position rather than a time window. Every write
+transaction bumps the single `replication_heartbeat` row on the primary.
+The new position (the "fence") is stored in the writer's session cookie and
+in the shared cache. A replica serves a request only once its copy of the
+heartbeat has reached both. So users never read around their own writes,
+and nothing rendered from a lagging replica reaches the page or fragment
+caches. A replica that is behind or down is skipped until it catches up.
+"""
+import logging
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import DateTime, column, event, func, select, table, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import TextClause, UpdateBase
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+FENCE_KEY = "db-fence"
+FENCE_TIMEOUT = 24 * 3600
+SESSION_KEY = "db_fence"
+
+HEARTBEAT = table(
+    "replication_heartbeat",
+    column("id"),
+    column("position"),
+    column("beat_at", DateTime),
+)
+
+
+def read_replica(func):
+    """Let GET requests to this view read from a replica."""
+    func.read_replica = True
+    return func
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replica_router.names:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info["wrote"] = True
+            # text() may be a write, so it always goes to the primary.
+            elif not isinstance(clause, TextClause) and not self.info.get("wrote"):
+                engine = replica_router.read_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _bump_heartbeat(db_session):
+    if not replica_router.names:
+        return
+    pending = db_session.new or db_session.dirty or db_session.deleted
+    if db_session.info.get("wrote") or pending:
+        db_session.info["fence"] = db_session.execute(
+            update(HEARTBEAT)
+            .where(HEARTBEAT.c.id == 1)
+            .values(position=HEARTBEAT.c.position + 1, beat_at=func.now())
+            .returning(HEARTBEAT.c.position)
+        ).scalar_one()
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _publish_fence(db_session):
+    db_session.info.pop("wrote", None)
+    fence = db_session.info.pop("fence", None)
+    if fence is not None:
+        replica_router.publish_fence(fence)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_writes(db_session):
+    db_session.info.pop("wrote", None)
+    db_session.info.pop("fence", None)
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.names = []
+        # replica name -> (heartbeat position or None if unreachable, when read)
+        self._positions = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from .extensions import cache, db
+
+        self.cache = cache
+        self.db = db
+        self.names = sorted(
+            name for name in app.config.get("SQLALCHEMY_BINDS") or {}
+            if name.startswith("replica")
+        )
+        self.check_interval = app.config["REPLICA_CHECK_INTERVAL"]
+        app.extensions["replica_router"] = self
+        if self.names:
+            app.before_request(self._reset)
+            app.after_request(self._count_read)
+            metrics.gauge_source(self.lag_samples)
+
+    def _heartbeat(self, engine):
+        with engine.connect() as conn:
+            return conn.execute(
+                select(HEARTBEAT.c.position, HEARTBEAT.c.beat_at, func.now().label("now"))
+                .where(HEARTBEAT.c.id == 1)
+            ).one()
+
+    def publish_fence(self, fence):
+        # Not atomic: two writers committing at the same instant can leave
+        # the lower fence behind until the next write raises it again.
+        current = self.cache.get(FENCE_KEY)
+        if current is None or current < fence:
+            self.cache.set(FENCE_KEY, fence, timeout=FENCE_TIMEOUT)
+        if has_request_context():
+            session[SESSION_KEY] = max(fence, session.get(SESSION_KEY, 0))
+            # Reads later in this request must see the write too.
+            g.pop("db_read_target", None)
+
+    def _fence(self):
+        fence = self.cache.get(FENCE_KEY)
+        if fence is None:
+            # Evicted: ask the primary for the latest position.
+            fence = self._heartbeat(self.db.engine).position
+            self.cache.add(FENCE_KEY, fence, timeout=FENCE_TIMEOUT)
+        if current_app.config["SESSION_COOKIE_NAME"] in request.cookies:
+            fence = max(fence, session.get(SESSION_KEY, 0))
+        return fence
+
+    def _position(self, name, fence):
+        """The replica's heartbeat position, re-read when stale or behind."""
+        position, checked_at = self._positions.get(name, (None, None))
+        now = time.monotonic()
+        stale = checked_at is None or now - checked_at >= self.check_interval
+        if stale or (position is not None and position < fence):
+            try:
+                position = self._heartbeat(self.db.engines[name]).position
+            except SQLAlchemyError as e:
+                logger.warning(f"Read replica {name} is unavailable: {e}")
+                position = None
+            self._positions[name] = (position, now)
+        return -1 if position is None else position
+
+    def _choose(self):
+        view = current_app.view_functions.get(request.endpoint or "")
+        if request.method not in ("GET", "HEAD") or not getattr(view, "read_replica", False):
+            return None
+        fence = self._fence()
+        for name in random.sample(self.names, len(self.names)):
+            if self._position(name, fence) >= fence:
+                return name
+        return "primary"
+
+    def read_engine(self):
+        """The replica engine this request reads from, or None for the primary.
+
+        Decided on the first read, so a request sees one consistent database.
+        """
+        if not has_request_context():
+            return None
+        if "db_read_target" not in g:
+            g.db_read_target = self._choose()
+        target = g.db_read_target
+        if target is None or target == "primary":
+            return None
+        return self.db.engines[target]
+
+    def _reset(self):
+        g.pop("db_read_target", None)
+
+    def _count_read(self, response):
+        target = g.get("db_read_target")
+        if target is not None:
+            metrics.count("blog_db_reads_total", endpoint=request.endpoint, database=target)
+        return response
+
+    def lag_samples(self):
+        primary = self._heartbeat(self.db.engine)
+        now = primary.now.replace(tzinfo=None)
+        samples = []
+        for name in self.names:
+            try:
+                replica = self._heartbeat(self.db.engines[name])
+            except SQLAlchemyError as e:
+                logger.warning(f"Read replica {name} is unavailable: {e}")
+                continue
+            behind = max(0, primary.position - replica.position)
+            lag = (now - replica.beat_at).total_seconds() if behind else 0.0
+            samples += [
+                ("blog_replica_lag_seconds", {"replica": name}, max(0.0, lag)),
+                ("blog_replica_behind_transactions", {"replica": name}, behind),
+            ]
+        return samples
+
+
+replica_router = ReplicaRouter()
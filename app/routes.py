@@ -7,47 +7,62 @@ from flask import (
     request,
     abort,
     current_app,
+    make_response,
+    stream_with_context,
 )
+from flask_wtf.csrf import generate_csrf
 from flask_login import login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import select
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from datetime import date
 from functools import wraps
 from urllib.parse import urlparse, urljoin
-import bleach
+from markupsafe import Markup
 
-from .extensions import db, cache, limiter
-from .models import User, BlogPost, Comment
+from .extensions import db, limiter
+from .models import User, BlogPost, Comment, ContactSubmission
 from .forms import RegistrationForm, LoginForm, CommentForm, CreatePostForm, ContactForm
-from .utils import save_contact_to_database, send_contact_email
+from .utils import save_contact_to_database
+from .contacts import CONTACT_KEY, EXPORT_FORMATS, export_chunks
+from .feeds import last_updated, latest_posts, sitemap_chunks, sitemap_files, sitemap_index
+from .mail_queue import mail_outbox
+from .images import image_ingester
+from .passwords import HashPoolBusy, password_hasher
+from .login_throttle import login_throttle
+from .pagination import InvalidCursor, KeysetPage, keyset_paginate
+from . import metrics
+from .instrumentation import query_budget
+from .replicas import read_replica
+from .page_cache import anonymous_page_cache, conditional_get
+from .sanitize import POLICY_VERSION, sanitize
+from .search import index_post, search_posts, unindex_post
+from .fragments import (
+    bump_feed_version,
+    bump_listing_version,
+    bump_post_version,
+    feed_meta,
+    feed_version,
+    get_fragments,
+    listing_meta,
+    listing_version,
+    post_meta,
+    post_version,
+    publish_post_version,
+    retire_post,
+    set_fragments,
+)
 
 main_bp = Blueprint("main", __name__)
 
-ALLOWED_TAGS = [
-    "p",
-    "b",
-    "i",
-    "u",
-    "em",
-    "strong",
-    "a",
-    "h1",
-    "h2",
-    "h3",
-    "ul",
-    "ol",
-    "li",
-    "blockquote",
-    "code",
-    "pre",
-    "img",
-]
-ALLOWED_ATTRS = {
-    "*": ["class", "style"],
-    "a": ["href", "rel", "target"],
-    "img": ["src", "alt", "style", "width", "height"],
-}
+POSTS_PER_PAGE = 5
+SEARCH_RESULTS_PER_PAGE = 10
+# Sort key for the post listing; cursors encode these values.
+POST_LISTING_KEY = (BlogPost.created_at, BlogPost.id)
+# Comments are shown oldest first, COMMENTS_PER_PAGE at a time.
+COMMENTS_PER_PAGE = 20
+COMMENT_KEY = (Comment.created_at, Comment.id)
+CONTACTS_PER_PAGE = 25
 
 
 def is_safe_url(target):
@@ -69,6 +84,68 @@ def admin_only(func):
     return decorated_function
 
 
+def listing_validators():
+    token, changed_at = listing_meta()
+    return f"l{token}", changed_at
+
+
+def feed_validators(**kwargs):
+    token, changed_at = feed_meta()
+    return f"f{token}", changed_at
+
+
+def post_validators(post_id):
+    meta = post_meta(post_id)
+    if meta is None:
+        return None
+    version, updated_at = meta
+    return f"p{post_id}-{version}", updated_at
+
+
+def comment_page(post_id, after=None):
+    return keyset_paginate(
+        db.session,
+        select(Comment)
+        .where(Comment.post_id == post_id)
+        .options(joinedload(Comment.author)),
+        COMMENT_KEY,
+        after=after,
+        per_page=COMMENTS_PER_PAGE,
+        descending=False,
+    )
+
+
+def add_comment(post_id, text):
+    """Save a comment and invalidate the post's cached fragments and pages."""
+    comment = Comment(
+        text=sanitize(text), # type: ignore
+        text_raw=text, # type: ignore
+        sanitize_policy=POLICY_VERSION, # type: ignore
+        author_id=current_user.id, # type: ignore
+        post_id=post_id, # type: ignore
+        date=date.today().strftime("%B %d, %Y"), # type: ignore
+    )
+    db.session.add(comment)
+    meta = bump_post_version(
+        post_id,
+        comment_count=BlogPost.comment_count + 1,
+        last_comment_at=func.now(),
+    )
+    # The UPDATE flushed the comment with its id and created_at. Detached, it
+    # keeps them past the commit, so it can be rendered without reloading.
+    db.session.expunge(comment)
+    db.session.commit()
+    publish_post_version(post_id, meta)
+    # The listing shows comment counts.
+    bump_listing_version()
+    return comment
+
+
+def busy_response(template, form):
+    flash("The server is busy right now, please try again in a moment.", "error")
+    return render_template(template, form=form), 503, {"Retry-After": "2"}
+
+
 # Error Handlers
 @main_bp.app_errorhandler(404)
 def not_found(error):
@@ -83,13 +160,36 @@ def internal_error(error):
 
 # Routes
 @main_bp.route("/")
+@conditional_get(listing_validators)
+@anonymous_page_cache(version=listing_version, params=("page", "after", "before"))
+@query_budget(3)
+@read_replica
 def home():
     try:
-        page = request.args.get("page", 1, type=int)
-        posts = db.paginate(
-            select(BlogPost).order_by(BlogPost.date.desc()), page=page, per_page=5
-        )
+        page = request.args.get("page", type=int)
+        if page is not None:
+            # Legacy ?page=N links still work, at the cost of COUNT + OFFSET.
+            stmt = (
+                select(BlogPost)
+                .options(joinedload(BlogPost.author))
+                .order_by(*(c.desc() for c in POST_LISTING_KEY))
+            )
+            legacy = db.paginate(stmt, page=page, per_page=POSTS_PER_PAGE)
+            posts = KeysetPage(
+                legacy.items, POST_LISTING_KEY, legacy.has_prev, legacy.has_next
+            )
+        else:
+            posts = keyset_paginate(
+                db.session,
+                select(BlogPost).options(joinedload(BlogPost.author)),
+                POST_LISTING_KEY,
+                after=request.args.get("after"),
+                before=request.args.get("before"),
+                per_page=POSTS_PER_PAGE,
+            )
         return render_template("index.html", posts=posts)
+    except InvalidCursor:
+        abort(400)
     except Exception as e:
         current_app.logger.error(f"Home error: {e}")
         return render_template("error/500.html"), 500
@@ -105,9 +205,7 @@ def register():
             user = User()
             user.name = form.data["name"].strip().title()
             user.email = form.data["email"]
-            user.password = generate_password_hash(
-                form.data["password"], "pbkdf2:sha256:600000"
-            )
+            user.password = password_hasher.hash(form.data["password"])
             db.session.add(user)
             db.session.commit()
             login_user(user)
@@ -116,6 +214,8 @@ def register():
         except IntegrityError:
             db.session.rollback()
             flash("Email already exists.", "error")
+        except HashPoolBusy:
+            return busy_response("register.html", form)
     return render_template("register.html", form=form)
 
 
@@ -125,13 +225,43 @@ def login():
         return redirect(url_for("main.home"))
     form = LoginForm()
     if form.validate_on_submit():
-        user = db.session.scalar(select(User).where(User.email == form.data["email"]))
-        if user and check_password_hash(user.password, form.data["password"]):
+        email = form.data["email"]
+        password = form.data["password"]
+        retry_after = login_throttle.retry_after(email)
+        if retry_after:
+            flash(
+                f"Too many failed attempts. Please try again in {retry_after} seconds.",
+                "error",
+            )
+            return (
+                render_template("login.html", form=form),
+                429,
+                {"Retry-After": str(retry_after)},
+            )
+        user = db.session.scalar(select(User).where(User.email == email))
+        try:
+            # Unknown emails are checked against a dummy hash so they take as
+            # long as real ones.
+            pwhash = user.password if user is not None else login_throttle.dummy_hash()
+            valid = password_hasher.verify(pwhash, password) and user is not None
+        except HashPoolBusy:
+            return busy_response("login.html", form)
+        if valid:
+            login_throttle.succeeded(email)
+            if password_hasher.needs_rehash(user.password):
+                # The configured cost changed: upgrade the stored hash now that
+                # we have the plaintext. If the pool is busy, try next login.
+                try:
+                    user.password = password_hasher.hash(password)
+                    db.session.commit()
+                except HashPoolBusy:
+                    pass
             login_user(user, remember=form.data["remember"])
             next_page = request.args.get("next")
             if next_page and not is_safe_url(next_page):
                 return abort(400)
             return redirect(next_page or url_for("main.home"))
+        login_throttle.failed(email)
         flash("Invalid email or password", "error")
     return render_template("login.html", form=form)
 
@@ -145,10 +275,12 @@ def logout():
 
 
 @main_bp.route("/post/<int:post_id>", methods=["GET", "POST"])
+@conditional_get(post_validators)
+@anonymous_page_cache(version=post_version)
+@query_budget(5)
+@read_replica
 def show_post(post_id):
     form = CommentForm()
-    post = db.get_or_404(BlogPost, post_id)
-    comments = post.comments
 
     if form.validate_on_submit():
         if not current_user.is_authenticated:
@@ -156,22 +288,103 @@ def show_post(post_id):
             return redirect(
                 url_for("main.login", next=url_for("main.show_post", post_id=post_id))
             )
-
-        clean_text = bleach.clean(
-            form.data["text"], tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS
-        )
-        comment = Comment(
-            text=clean_text, # type: ignore
-            author_id=current_user.id, # type: ignore
-            post_id=post_id, # type: ignore
-            date=date.today().strftime("%B %d, %Y"), # type: ignore
-        )
-        db.session.add(comment)
-        db.session.commit()
+        db.get_or_404(BlogPost, post_id)
+        add_comment(post_id, form.data["text"])
         flash("Comment added!", "success")
         return redirect(url_for("main.show_post", post_id=post_id))
 
-    return render_template("post.html", post=post, comments=comments, form=form)
+    version = post_version(post_id)
+    if version is None:
+        abort(404)
+    fragments = get_fragments(post_id, version, ("header", "body", "comments"))
+    if fragments is None:
+        # Only the first page of comments is rendered inline; the rest are
+        # fetched from post_comments, so this stays two queries however
+        # many comments the post has.
+        post = db.get_or_404(
+            BlogPost,
+            post_id,
+            options=[joinedload(BlogPost.author), joinedload(BlogPost.image)],
+        )
+        comments = comment_page(post_id)
+        fragments = {
+            "header": render_template("fragments/post_header.html", post=post),
+            "body": post.body,
+            "comments": render_template(
+                "fragments/comment_list.html", comments=comments, post_id=post_id
+            ),
+        }
+        set_fragments(post_id, version, fragments)
+    fragments = {name: Markup(html) for name, html in fragments.items()}
+    return render_template("post.html", post_id=post_id, fragments=fragments, form=form)
+
+
+@main_bp.route("/post/<int:post_id>/comments", methods=["POST"])
+@query_budget(4)
+def create_comment(post_id):
+    """Add a comment from script and return just its rendered HTML.
+
+    CSRF is checked by CSRFProtect (form field or X-CSRFToken header).
+    """
+    if not current_user.is_authenticated:
+        return {"error": "Please login to comment"}, 401
+    if post_version(post_id) is None:
+        abort(404)
+    form = CommentForm()
+    if not form.validate():
+        return {"errors": form.errors}, 400
+    comment = add_comment(post_id, form.data["text"])
+    html = render_template("fragments/comment.html", comment=comment, author=current_user)
+    if request.args.get("format") == "json":
+        return {"id": comment.id, "html": html}, 201
+    return html, 201
+
+
+@main_bp.route("/post/<int:post_id>/comments")
+@query_budget(2)
+def post_comments(post_id):
+    """Next page of a post's comments, as an HTML fragment or JSON."""
+    version = post_version(post_id)
+    if version is None:
+        abort(404)
+    after = request.args.get("after")
+    try:
+        if request.args.get("format") == "json":
+            comments = comment_page(post_id, after=after)
+            next_url = None
+            if comments.next_cursor:
+                next_url = url_for(
+                    "main.post_comments",
+                    post_id=post_id,
+                    after=comments.next_cursor,
+                    format="json",
+                )
+            return {
+                "comments": [
+                    {
+                        "id": comment.id,
+                        "html": comment.text,
+                        "author": comment.author.name,
+                        "avatar": comment.author.avatar(30),
+                        "created_at": comment.created_at.isoformat(),
+                    }
+                    for comment in comments.items
+                ],
+                "next": next_url,
+            }
+
+        name = f"comments:{after or ''}"
+        cached = get_fragments(post_id, version, (name,))
+        if cached is not None:
+            return cached[name]
+        comments = comment_page(post_id, after=after)
+    except InvalidCursor:
+        abort(400)
+    html = render_template(
+        "fragments/comment_page.html", comments=comments, post_id=post_id
+    )
+    set_fragments(post_id, version, {name: html})
+    return html
 
 
 @main_bp.route("/new-post", methods=["GET", "POST"])
@@ -180,19 +393,23 @@ def show_post(post_id):
 def add_new_post():
     form = CreatePostForm()
     if form.validate_on_submit():
-        clean_body = bleach.clean(
-            form.data["body"], tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS
-        )
         post = BlogPost(
             title=form.data["title"], # type: ignore
             subtitle=form.data["subtitle"], # type: ignore
-            body=clean_body, # type: ignore
+            body=sanitize(form.data["body"]), # type: ignore
+            body_raw=form.data["body"], # type: ignore
+            sanitize_policy=POLICY_VERSION, # type: ignore
             img_url=form.data["img_url"], # type: ignore
             author_id=current_user.id, # type: ignore
             date=date.today().strftime("%B %d, %Y"), # type: ignore
         )
         db.session.add(post)
+        db.session.flush()
+        index_post(post)
         db.session.commit()
+        bump_listing_version()
+        bump_feed_version()
+        image_ingester.submit(post.id, post.img_url)
         return redirect(url_for("main.home"))
     return render_template("make-post.html", form=form)
 
@@ -203,14 +420,26 @@ def add_new_post():
 def edit_post(post_id):
     post = db.get_or_404(BlogPost, post_id)
     form = CreatePostForm(obj=post)
+    if request.method == "GET" and post.body_raw is not None:
+        # Edit what the author wrote, not the sanitized copy.
+        form.body.data = post.body_raw
     if form.validate_on_submit():
         post.title = form.data["title"]
         post.subtitle = form.data["subtitle"]
-        post.img_url = form.data["img_url"]
-        post.body = bleach.clean(
-            form.data["body"], tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS
-        )
+        image_changed = post.img_url != form.data["img_url"]
+        if image_changed:
+            post.img_url = form.data["img_url"]
+            post.image_digest = None
+        post.body = sanitize(form.data["body"])
+        post.body_raw = form.data["body"]
+        post.sanitize_policy = POLICY_VERSION
+        meta = bump_post_version(post.id)
+        index_post(post)
         db.session.commit()
+        publish_post_version(post.id, meta)
+        bump_listing_version()
+        if image_changed:
+            image_ingester.submit(post.id, post.img_url)
         return redirect(url_for("main.show_post", post_id=post.id))
     return render_template("make-post.html", form=form, is_edit=True)
 
@@ -220,14 +449,57 @@ def edit_post(post_id):
 @admin_only
 def delete_post(post_id):
     post = db.get_or_404(BlogPost, post_id)
+    # One statement for the comments instead of loading each one for the
+    # ORM cascade.
+    db.session.execute(delete(Comment).where(Comment.post_id == post_id))
     db.session.delete(post)
+    unindex_post(post_id)
     db.session.commit()
+    retire_post(post_id)
+    bump_listing_version()
+    bump_feed_version()
     flash("Post deleted", "success")
     return redirect(url_for("main.home"))
 
 
+@main_bp.route("/search")
+@query_budget(3)
+def search():
+    q = request.args.get("q", "").strip()[:200]
+    page = request.args.get("page", 1, type=int)
+    results = search_posts(q, page=page, per_page=SEARCH_RESULTS_PER_PAGE)
+    return render_template("search.html", results=results)
+
+
+@main_bp.route("/search.json")
+@query_budget(3)
+def search_json():
+    q = request.args.get("q", "").strip()[:200]
+    page = request.args.get("page", 1, type=int)
+    results = search_posts(q, page=page, per_page=SEARCH_RESULTS_PER_PAGE)
+    return {
+        "query": q,
+        "page": results.page,
+        "has_next": results.has_next,
+        "results": [
+            {
+                "id": hit.post.id,
+                "url": url_for("main.show_post", post_id=hit.post.id, _external=True),
+                "title": str(hit.title),
+                "subtitle": hit.post.subtitle,
+                "snippet": str(hit.snippet),
+                "author": hit.post.author.name,
+                "created_at": hit.post.created_at.isoformat(),
+                "rank": hit.rank,
+            }
+            for hit in results.items
+        ],
+    }
+
+
 @main_bp.route("/about")
-@cache.cached(timeout=300)
+@anonymous_page_cache()
+@read_replica
 def about():
     return render_template("about.html")
 
@@ -239,18 +511,136 @@ def contact():
     if form.validate_on_submit():
         if form.data.get("honeypot"):
             return redirect(url_for("main.home"))
-        save_contact_to_database(form)
-        send_contact_email(form, current_app)
-        flash("Message sent!", "success")
-        return redirect(url_for("main.home"))
+        if save_contact_to_database(form, current_app):
+            mail_outbox.wake()
+            flash("Message sent!", "success")
+            return redirect(url_for("main.home"))
+        flash("Sorry, your message could not be sent. Please try again later.", "error")
+        return render_template("contact.html", form=form), 500
     return render_template("contact.html", form=form)
 
 
+@main_bp.route("/admin/contacts")
+@login_required
+@admin_only
+def admin_contacts():
+    try:
+        submissions = keyset_paginate(
+            db.session,
+            select(ContactSubmission),
+            CONTACT_KEY,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            per_page=CONTACTS_PER_PAGE,
+        )
+    except InvalidCursor:
+        abort(400)
+    return render_template("admin-contacts.html", submissions=submissions)
+
+
+@main_bp.route("/admin/contacts.<fmt>")
+@login_required
+@admin_only
+def export_contacts(fmt):
+    """Stream every submission as CSV or JSON Lines."""
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    filename = f"contacts-{date.today():%Y%m%d}.{fmt}"
+    return current_app.response_class(
+        stream_with_context(export_chunks(fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+@main_bp.route("/flashes")
+def flashes():
+    response = make_response(render_template("fragments/flash_messages.html"))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@main_bp.route("/csrf-token")
+def csrf_token():
+    return {"csrf_token": generate_csrf()}, 200, {"Cache-Control": "no-store"}
+
+
+@main_bp.route("/metrics")
+def metrics_endpoint():
+    status = metrics.scrape_denied()
+    if status:
+        abort(status)
+    return (
+        metrics.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4", "Cache-Control": "no-store"},
+    )
+
+
 @main_bp.route("/health")
 def health_check():
     return {"status": "healthy"}, 200
 
 
+def render_feed(template, mimetype):
+    posts = latest_posts()
+    body = render_template(template, posts=posts, updated=last_updated(posts, feed_meta()[1]))
+    response = make_response(body)
+    response.mimetype = mimetype
+    return response
+
+
+@main_bp.route("/feed.xml")
+@conditional_get(feed_validators, session_free=True)
+@anonymous_page_cache(version=feed_version, mimetype="application/rss+xml")
+@query_budget(1)
+@read_replica
+def rss_feed():
+    return render_feed("feeds/rss.xml", "application/rss+xml")
+
+
+@main_bp.route("/atom.xml")
+@conditional_get(feed_validators, session_free=True)
+@anonymous_page_cache(version=feed_version, mimetype="application/atom+xml")
+@query_budget(1)
+@read_replica
+def atom_feed():
+    return render_feed("feeds/atom.xml", "application/atom+xml")
+
+
+def sitemap_response(number):
+    # Too big for the page cache; clients and proxies revalidate with the ETag.
+    return current_app.response_class(
+        stream_with_context(sitemap_chunks(number)), mimetype="application/xml"
+    )
+
+
+@main_bp.route("/sitemap.xml")
+@conditional_get(feed_validators, session_free=True)
+@query_budget(2)
+@read_replica
+def sitemap():
+    files = sitemap_files()
+    if files == 1:
+        return sitemap_response(1)
+    response = make_response(sitemap_index(files))
+    response.mimetype = "application/xml"
+    return response
+
+
+@main_bp.route("/sitemap-<int:number>.xml")
+@conditional_get(feed_validators, session_free=True)
+@query_budget(2)
+@read_replica
+def sitemap_file(number):
+    if not 1 <= number <= sitemap_files():
+        abort(404)
+    return sitemap_response(number)
+
+
 @main_bp.route("/robots.txt")
 def robots_txt():
     return current_app.send_static_file("robots.txt")
@@ -0,0 +1,54 @@
+"""HTML sanitizing policy for posts and comments.
+
+The raw HTML a user submitted is stored next to the sanitized copy that
+is rendered, together with the POLICY_VERSION it was cleaned with. After
+changing the allow-lists, bump POLICY_VERSION and run `flask sanitize` to
+re-clean existing content in the background instead of on page views.
+"""
+import bleach
+
+from .metrics import timed
+
+# Bump whenever ALLOWED_TAGS or ALLOWED_ATTRS change.
+POLICY_VERSION = 1
+
+ALLOWED_TAGS = [
+    "p",
+    "b",
+    "i",
+    "u",
+    "em",
+    "strong",
+    "a",
+    "h1",
+    "h2",
+    "h3",
+    "ul",
+    "ol",
+    "li",
+    "blockquote",
+    "code",
+    "pre",
+    "img",
+]
+ALLOWED_ATTRS = {
+    "*": ["class", "style"],
+    "a": ["href", "rel", "target"],
+    "img": ["src", "alt", "style", "width", "height"],
+}
+
+
+def sanitize(html):
+    with timed("sanitize_seconds"):
+        return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS)
+
+
+def sanitize_rows(rows):
+    """Clean (id, raw_html) pairs; runs in `flask sanitize` worker processes."""
+    return [(row_id, sanitize(raw)) for row_id, raw in rows]
+
+
+def chunks(rows, n):
+    """Split `rows` into at most `n` similar-sized lists, one per worker."""
+    size = max(1, -(-len(rows) // n))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
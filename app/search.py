@@ -0,0 +1,213 @@
+"""Full-text search over posts.
+
+Posts are indexed in a `post_search` table that is kept up to date in the
+same transaction as every post write (see `index_post` / `unindex_post`):
+
+* SQLite: an FTS5 virtual table whose rowid is the post id, ranked by bm25.
+* PostgreSQL: a table with a weighted tsvector column under a GIN index,
+  ranked by ts_rank_cd.
+
+Neither is declared on the SQLAlchemy metadata: the DDL below runs after
+`db.create_all()` and the migration creates the same structures.
+`flask search rebuild` re-indexes every post in batches.
+"""
+import re
+from html import unescape
+
+import bleach
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, select, text
+from sqlalchemy.orm import joinedload
+
+from .extensions import db
+from .metrics import timed
+from .models import BlogPost
+
+TABLE = "post_search"
+
+# Snippet highlight markers. They are private-use characters, stripped from
+# indexed text, so the snippet can be escaped as a whole and the markers
+# swapped for <mark> afterwards.
+START, STOP = "\ue000", "\ue001"
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+    "title, subtitle, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+)
+POSTGRESQL_DDL = [
+    "CREATE TABLE IF NOT EXISTS post_search ("
+    "post_id INTEGER PRIMARY KEY REFERENCES blog_posts (id) ON DELETE CASCADE, "
+    "title TEXT NOT NULL, subtitle TEXT NOT NULL, body TEXT NOT NULL, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_post_search_document "
+    "ON post_search USING GIN (document)",
+]
+
+event.listen(db.metadata, "after_create", DDL(SQLITE_DDL).execute_if(dialect="sqlite"))
+for _statement in POSTGRESQL_DDL:
+    event.listen(
+        db.metadata, "after_create", DDL(_statement).execute_if(dialect="postgresql")
+    )
+event.listen(db.metadata, "before_drop", DDL(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+def _postgresql():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def _clean(value):
+    return re.sub(r"\s+", " ", value.replace(START, "").replace(STOP, "")).strip()
+
+
+def plain_text(html):
+    """Text content of a post body, as indexed and shown in snippets."""
+    with timed("sanitize_seconds"):
+        return _clean(unescape(bleach.clean(html or "", tags=[], strip=True)))
+
+
+def _document(post):
+    return {
+        "id": post.id,
+        "title": _clean(post.title),
+        "subtitle": _clean(post.subtitle),
+        "body": plain_text(post.body),
+    }
+
+
+def index_posts(posts):
+    """(Re)index posts inside the current transaction."""
+    documents = [_document(post) for post in posts]
+    if not documents:
+        return
+    unindex_posts([d["id"] for d in documents])
+    if _postgresql():
+        db.session.execute(
+            text(
+                "INSERT INTO post_search (post_id, title, subtitle, body, document) "
+                "VALUES (:id, :title, :subtitle, :body, "
+                "setweight(to_tsvector('english', :title), 'A') || "
+                "setweight(to_tsvector('english', :subtitle), 'B') || "
+                "setweight(to_tsvector('english', :body), 'D'))"
+            ),
+            documents,
+        )
+    else:
+        db.session.execute(
+            text(
+                "INSERT INTO post_search (rowid, title, subtitle, body) "
+                "VALUES (:id, :title, :subtitle, :body)"
+            ),
+            documents,
+        )
+
+
+def index_post(post):
+    index_posts([post])
+
+
+def unindex_posts(post_ids):
+    column = "post_id" if _postgresql() else "rowid"
+    for post_id in post_ids:
+        db.session.execute(
+            text(f"DELETE FROM post_search WHERE {column} = :id"), {"id": post_id}
+        )
+
+
+def unindex_post(post_id):
+    unindex_posts([post_id])
+
+
+def prune_index():
+    """Drop entries whose post no longer exists; returns how many."""
+    column = "post_id" if _postgresql() else "rowid"
+    return db.session.execute(
+        text(
+            f"DELETE FROM post_search WHERE {column} NOT IN (SELECT id FROM blog_posts)"
+        )
+    ).rowcount
+
+
+def _fts5_query(q):
+    """Turn free text into an FTS5 query: all words, the last one as a prefix.
+
+    Every word is quoted, so operators and column filters in user input are
+    matched literally instead of being interpreted.
+    """
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def highlight(marked):
+    return escape(marked).replace(START, Markup("<mark>")).replace(STOP, Markup("</mark>"))
+
+
+class SearchHit:
+    def __init__(self, post, title, snippet, rank):
+        self.post = post
+        self.title = title
+        self.snippet = snippet
+        self.rank = rank
+
+
+class SearchPage:
+    def __init__(self, query, items, page, has_next):
+        self.query = query
+        self.items = items
+        self.page = page
+        self.has_prev = page > 1
+        self.has_next = has_next
+
+
+def search_posts(q, page=1, per_page=10):
+    """Return one page of posts matching `q`, best match first."""
+    page = max(page, 1)
+    params = {"limit": per_page + 1, "offset": (page - 1) * per_page}
+    if _postgresql():
+        if not q.strip():
+            return SearchPage(q, [], page, False)
+        options = f"StartSel={START}, StopSel={STOP}"
+        stmt = text(
+            "SELECT s.post_id, "
+            f"ts_headline('english', s.title, q, 'HighlightAll=true, {options}') AS title, "
+            f"ts_headline('english', s.body, q, 'MaxWords=35, MinWords=15, {options}') "
+            "AS snippet, ts_rank_cd(s.document, q) AS rank "
+            "FROM post_search s, websearch_to_tsquery('english', :q) q "
+            "WHERE s.document @@ q ORDER BY rank DESC, s.post_id DESC "
+            "LIMIT :limit OFFSET :offset"
+        )
+        params["q"] = q
+    else:
+        match = _fts5_query(q)
+        if match is None:
+            return SearchPage(q, [], page, False)
+        stmt = text(
+            "SELECT rowid AS post_id, "
+            f"highlight(post_search, 0, '{START}', '{STOP}') AS title, "
+            f"snippet(post_search, 2, '{START}', '{STOP}', '…', 24) AS snippet, "
+            "bm25(post_search, 10.0, 4.0, 1.0) AS rank "
+            "FROM post_search WHERE post_search MATCH :q "
+            "ORDER BY rank, rowid DESC LIMIT :limit OFFSET :offset"
+        )
+        params["q"] = match
+
+    rows = db.session.execute(stmt, params).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    posts = {
+        post.id: post
+        for post in db.session.scalars(
+            select(BlogPost)
+            .options(joinedload(BlogPost.author))
+            .where(BlogPost.id.in_([row.post_id for row in rows]))
+        )
+    }
+    items = [
+        SearchHit(posts[row.post_id], highlight(row.title), highlight(row.snippet), row.rank)
+        for row in rows
+        if row.post_id in posts
+    ]
+    return SearchPage(q, items, page, has_next)
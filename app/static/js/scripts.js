@@ -28,3 +28,108 @@ window.addEventListener('DOMContentLoaded', () => {
     scrollPos = currentTop;
   });
 });
+
+// Pages cached for anonymous visitors leave out per-visitor content.
+// These helpers fetch it only when it is actually needed.
+function getCsrfToken() {
+  const meta = document.querySelector('meta[name="csrf-token"]');
+  if (meta) {
+    return Promise.resolve(meta.content);
+  }
+  const url = document.querySelector('meta[name="csrf-token-url"]').content;
+  return fetch(url, { credentials: 'same-origin' })
+    .then((response) => response.json())
+    .then((data) => data.csrf_token);
+}
+window.getCsrfToken = getCsrfToken;
+
+window.addEventListener('DOMContentLoaded', () => {
+  const flashBox = document.getElementById('flash-messages');
+  const pending = document.cookie.split('; ').includes('has_flashes=1');
+  if (flashBox && flashBox.dataset.src && pending) {
+    fetch(flashBox.dataset.src, { credentials: 'same-origin' })
+      .then((response) => response.text())
+      .then((html) => {
+        flashBox.innerHTML = html;
+      });
+  }
+});
+
+// Later pages of comments are fetched on demand; each page ends with the
+// button for the next one.
+document.addEventListener('click', (event) => {
+  const button = event.target.closest('.load-more-comments');
+  if (!button) {
+    return;
+  }
+  button.disabled = true;
+  fetch(button.dataset.src, { credentials: 'same-origin' })
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    })
+    .then((html) => {
+      // Skip comments this visitor just posted; they are already shown.
+      const page = document.createElement('template');
+      page.innerHTML = html;
+      page.content.querySelectorAll('.comment-item').forEach((item) => {
+        if (document.getElementById(item.id)) {
+          item.remove();
+        }
+      });
+      button.replaceWith(page.content);
+    })
+    .catch(() => {
+      button.disabled = false;
+    });
+});
+
+// Comments are posted in the background and only the new comment's HTML
+// comes back, instead of redirecting to a fully re-rendered page.
+document.addEventListener('submit', (event) => {
+  const form = event.target;
+  if (form.id !== 'comment-form' || !form.dataset.ajaxAction || !window.fetch) {
+    return;
+  }
+  event.preventDefault();
+  if (window.CKEDITOR) {
+    Object.values(CKEDITOR.instances).forEach((editor) => editor.updateElement());
+  }
+  const submit = form.querySelector('[type="submit"]');
+  submit.disabled = true;
+  getCsrfToken()
+    .then((token) =>
+      fetch(form.dataset.ajaxAction, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: { 'X-CSRFToken': token },
+        body: new FormData(form),
+      })
+    )
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    })
+    .then((html) => {
+      const empty = document.querySelector('.commentList > p');
+      if (empty) {
+        empty.remove();
+      }
+      document.getElementById('new-comments').insertAdjacentHTML('beforeend', html);
+      if (window.CKEDITOR && CKEDITOR.instances.text) {
+        CKEDITOR.instances.text.setData('');
+      }
+      form.reset();
+    })
+    .catch(() => {
+      // Fall back to a normal form post.
+      form.submit();
+    })
+    .finally(() => {
+      submit.disabled = false;
+    });
+});
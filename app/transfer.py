@@ -0,0 +1,367 @@
+"""Bulk export and import of users, posts and comments (`flask blog ...`).
+
+The format is JSON Lines: a header, then every user, every post and every
+comment, one object per line with a "type" field. References only point
+backwards, so a reader never meets an id it has not seen yet. Both
+directions work in batches, so memory does not grow with the number of
+comments.
+
+Export writes the HTML as the author submitted it, and password hashes.
+Import sanitizes the HTML with the current policy in a process pool while
+the previous batch is inserted (with COPY for comments on PostgreSQL). Old
+ids are mapped to the new ones, and comment counts and the search index are
+filled in. Users are matched by email. Posts whose title already exists are
+skipped together with their comments, so importing a file twice adds
+nothing. The same goes for a repeated email or title within the file: the
+first record wins. The whole import is one transaction.
+"""
+import io
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import func, insert, select, update
+
+from .extensions import db
+from .fragments import bump_feed_version, bump_listing_version
+from .models import BlogPost, Comment, User
+from .sanitize import POLICY_VERSION, chunks, sanitize_rows
+from .search import index_posts
+
+FORMAT = 1
+
+EXPORTS = (
+    ("user", User, (User.id, User.name, User.email, User.password)),
+    (
+        "post",
+        BlogPost,
+        (
+            BlogPost.id,
+            BlogPost.author_id,
+            BlogPost.title,
+            BlogPost.subtitle,
+            BlogPost.img_url,
+            BlogPost.date,
+            BlogPost.created_at,
+            BlogPost.updated_at,
+            func.coalesce(BlogPost.body_raw, BlogPost.body).label("body"),
+        ),
+    ),
+    (
+        "comment",
+        Comment,
+        (
+            Comment.id,
+            Comment.post_id,
+            Comment.author_id,
+            Comment.date,
+            Comment.created_at,
+            func.coalesce(Comment.text_raw, Comment.text).label("text"),
+        ),
+    ),
+)
+# Field holding the HTML to sanitize, per record type
+HTML_FIELDS = {"post": "body", "comment": "text"}
+
+
+class TransferError(ValueError):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _rate(rows, started):
+    return f"{rows / max(time.perf_counter() - started, 1e-6):,.0f} rows/s"
+
+
+def export_jsonl(out, batch_size=1000, echo=print):
+    """Write every user, post and comment to the text stream `out`.
+
+    Returns {type: rows written}.
+    """
+    started = time.perf_counter()
+    # Later batches see rows committed after the export started. Stopping
+    # at the ids that existed at the start keeps every comment's post and
+    # author in the file even when new posts and comments arrive meanwhile.
+    last_ids = {
+        kind: db.session.scalar(select(func.max(model.id))) or 0
+        for kind, model, _ in EXPORTS
+    }
+    header = {"type": "header", "format": FORMAT, "exported_at": datetime.now(timezone.utc)}
+    out.write(json.dumps(header, default=_json_default) + "\n")
+    counts = {}
+    for kind, model, columns in EXPORTS:
+        counts[kind] = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(*columns)
+                .where(model.id > last_id, model.id <= last_ids[kind])
+                .order_by(model.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            out.writelines(
+                json.dumps({"type": kind, **row._asdict()}, default=_json_default) + "\n"
+                for row in rows
+            )
+            counts[kind] += len(rows)
+            last_id = rows[-1].id
+        echo(f"Exported {counts[kind]} {kind}s ({_rate(sum(counts.values()), started)}).")
+    return counts
+
+
+@contextmanager
+def _line(number):
+    try:
+        yield
+    except KeyError as e:
+        raise TransferError(f"Line {number}: missing field {e}") from e
+    except (TypeError, ValueError) as e:
+        raise TransferError(f"Line {number}: {e}") from e
+
+
+def _values(batch, field):
+    values = []
+    for number, record in batch:
+        with _line(number):
+            values.append(record[field])
+    return values
+
+
+def _copy(table, rows):
+    """COPY `rows` (dicts with the same keys) into `table` on PostgreSQL."""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        values = []
+        for column in columns:
+            value = row[column]
+            if value is None:
+                values.append("\\N")
+            else:
+                values.append(
+                    str(value)
+                    .replace("\\", "\\\\")
+                    .replace("\t", "\\t")
+                    .replace("\n", "\\n")
+                    .replace("\r", "\\r")
+                )
+        buffer.write("\t".join(values) + "\n")
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+class Importer:
+    def __init__(self, pool, workers, batch_size=2000, echo=print):
+        self.pool = pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.echo = echo
+        self.postgresql = db.session.get_bind().dialect.name == "postgresql"
+        self.now = datetime.now(timezone.utc).replace(tzinfo=None)
+        # ids in the file -> ids in this database (None: post skipped)
+        self.users = {}
+        self.posts = {}
+        # new post id -> [comment count, last comment time]
+        self.comment_stats = {}
+        self.counts = {"user": 0, "post": 0, "comment": 0}
+        self.skipped = {"user": 0, "post": 0, "comment": 0}
+        self.started = None
+        self._pending = None
+
+    def run(self, lines):
+        """Import from an iterable of JSON lines; returns (imported, skipped) per type."""
+        self.started = time.perf_counter()
+        kind, batch = None, []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            with _line(number):
+                record = json.loads(line)
+                record_type = record["type"]
+            if record_type == "header":
+                if record.get("format") != FORMAT:
+                    raise TransferError(
+                        f"Line {number}: unsupported format {record.get('format')!r}"
+                    )
+                continue
+            if record_type not in self.counts:
+                raise TransferError(f"Line {number}: unknown type {record_type!r}")
+            if record_type != kind or len(batch) >= self.batch_size:
+                self._flush(kind, batch)
+                kind, batch = record_type, []
+            batch.append((number, record))
+        self._flush(kind, batch)
+        self._flush(None, [])
+        self._finish()
+        return self.counts, self.skipped
+
+    def _flush(self, kind, batch):
+        """Start sanitizing `batch`, then insert the batch sanitized before it."""
+        futures = None
+        if batch and kind in HTML_FIELDS:
+            sources = list(enumerate(_values(batch, HTML_FIELDS[kind])))
+            futures = [
+                self.pool.submit(sanitize_rows, chunk)
+                for chunk in chunks(sources, self.workers)
+            ]
+        if self._pending:
+            self._write(*self._pending)
+            self._pending = None
+        if batch:
+            if futures is None:
+                self._write(kind, batch, [])
+            else:
+                self._pending = (kind, batch, futures)
+
+    def _write(self, kind, batch, futures):
+        cleaned = dict(pair for future in futures for pair in future.result())
+        getattr(self, f"_write_{kind}s")(batch, cleaned)
+        total = sum(self.counts.values()) + sum(self.skipped.values())
+        self.echo(
+            f"{kind}s: {self.counts[kind]} imported, {self.skipped[kind]} skipped "
+            f"({_rate(total, self.started)})"
+        )
+
+    def _ref(self, mapping, old_id, kind):
+        if old_id not in mapping:
+            raise TransferError(f"{kind} {old_id!r} is not earlier in the file")
+        return mapping[old_id]
+
+    def _write_users(self, batch, cleaned):
+        emails = _values(batch, "email")
+        existing = dict(
+            db.session.execute(
+                select(User.email, User.id).where(User.email.in_(emails))
+            ).all()
+        )
+        rows, old_ids = [], []
+        # Earlier batches are already in the database; repeats within this
+        # batch point at the first record's row once it is inserted.
+        first = {}
+        repeats = []
+        for number, record in batch:
+            with _line(number):
+                if record["email"] in existing:
+                    self.users[record["id"]] = existing[record["email"]]
+                    self.skipped["user"] += 1
+                    continue
+                if record["email"] in first:
+                    repeats.append((record["id"], first[record["email"]]))
+                    self.skipped["user"] += 1
+                    continue
+                first[record["email"]] = len(rows)
+                rows.append(
+                    {
+                        "name": record["name"],
+                        "email": record["email"],
+                        "password": record["password"],
+                    }
+                )
+                old_ids.append(record["id"])
+        if rows:
+            new_ids = db.session.scalars(
+                insert(User).returning(User.id, sort_by_parameter_order=True), rows
+            ).all()
+            self.users.update(zip(old_ids, new_ids))
+            self.users.update((old_id, new_ids[i]) for old_id, i in repeats)
+            self.counts["user"] += len(rows)
+
+    def _write_posts(self, batch, cleaned):
+        titles = _values(batch, "title")
+        existing = set(
+            db.session.scalars(select(BlogPost.title).where(BlogPost.title.in_(titles)))
+        )
+        rows, old_ids = [], []
+        for i, (number, record) in enumerate(batch):
+            with _line(number):
+                if record["title"] in existing:
+                    self.posts[record["id"]] = None
+                    self.skipped["post"] += 1
+                    continue
+                existing.add(record["title"])
+                created = _datetime(record.get("created_at")) or self.now
+                rows.append(
+                    {
+                        "title": record["title"],
+                        "subtitle": record["subtitle"],
+                        "img_url": record["img_url"],
+                        "date": record.get("date") or created.strftime("%B %d, %Y"),
+                        "created_at": created,
+                        "updated_at": _datetime(record.get("updated_at")),
+                        "body": cleaned[i],
+                        "body_raw": record["body"],
+                        "sanitize_policy": POLICY_VERSION,
+                        "author_id": self._ref(self.users, record["author_id"], "user"),
+                    }
+                )
+                old_ids.append(record["id"])
+        if not rows:
+            return
+        new_ids = db.session.scalars(
+            insert(BlogPost).returning(BlogPost.id, sort_by_parameter_order=True), rows
+        ).all()
+        self.posts.update(zip(old_ids, new_ids))
+        self.counts["post"] += len(rows)
+        index_posts(db.session.scalars(select(BlogPost).where(BlogPost.id.in_(new_ids))))
+        db.session.expunge_all()
+
+    def _write_comments(self, batch, cleaned):
+        rows = []
+        for i, (number, record) in enumerate(batch):
+            with _line(number):
+                post_id = self._ref(self.posts, record["post_id"], "post")
+                if post_id is None:
+                    self.skipped["comment"] += 1
+                    continue
+                created = _datetime(record.get("created_at")) or self.now
+                rows.append(
+                    {
+                        "text": cleaned[i],
+                        "text_raw": record["text"],
+                        "sanitize_policy": POLICY_VERSION,
+                        "date": record.get("date") or created.strftime("%B %d, %Y"),
+                        "created_at": created,
+                        "author_id": self._ref(self.users, record["author_id"], "user"),
+                        "post_id": post_id,
+                    }
+                )
+            stats = self.comment_stats.setdefault(post_id, [0, None])
+            stats[0] += 1
+            if stats[1] is None or created > stats[1]:
+                stats[1] = created
+        if not rows:
+            return
+        if self.postgresql:
+            _copy(Comment.__table__, rows)
+        else:
+            db.session.execute(insert(Comment), rows)
+        self.counts["comment"] += len(rows)
+
+    def _finish(self):
+        stats = list(self.comment_stats.items())
+        for i in range(0, len(stats), self.batch_size):
+            db.session.execute(
+                update(BlogPost),
+                [
+                    {"id": post_id, "comment_count": count, "last_comment_at": last}
+                    for post_id, (count, last) in stats[i:i + self.batch_size]
+                ],
+            )
+        db.session.commit()
+        if self.counts["post"] or self.counts["comment"]:
+            bump_listing_version()
+        if self.counts["post"]:
+            bump_feed_version()
@@ -1,43 +1,43 @@
 from flask import render_template, request
-from flask_mail import Message
 from datetime import datetime
-from .extensions import mail, db
+from .extensions import db
 from .models import ContactSubmission
+from .mail_queue import enqueue
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def send_contact_email(form, app):
-    try:
-        name = form.data.get("name")
-        email = form.data.get("email")
-        message = form.data.get("message")
-        number = form.data.get("number") or "Not provided"
+def queue_contact_email(form, app):
+    """Add the owner's notification to the outbox; None if there is nobody to send it to."""
+    recipient = app.config.get("MAIL_USERNAME")
+    if not recipient:
+        logger.warning("MAIL_USERNAME is not set; contact notification not queued")
+        return None
+    name = form.data.get("name")
+    email = form.data.get("email")
+    message = form.data.get("message")
+    number = form.data.get("number") or "Not provided"
 
-        subject = f"New Contact: {name}"
-        msg = Message(
-            subject=subject,
-            sender=app.config.get("MAIL_DEFAULT_SENDER"),
-            recipients=[app.config.get("MAIL_USERNAME")],
-            reply_to=email,
-        )
-        msg.html = render_template(
-            "email/contact_notification.html",
-            name=name,
-            email=email,
-            message=message,
-            number=number,
-            submission_date=datetime.now(),
-        )
-        mail.send(msg)
-        return True
-    except Exception as e:
-        logger.error(f"Email error: {e}")
-        return False
+    html = render_template(
+        "email/contact_notification.html",
+        name=name,
+        email=email,
+        message=message,
+        number=number,
+        submission_date=datetime.now(),
+    )
+    return enqueue(
+        subject=f"New Contact: {name}",
+        recipients=[recipient],
+        html=html,
+        sender=app.config.get("MAIL_DEFAULT_SENDER"),
+        reply_to=email,
+    )
 
 
-def save_contact_to_database(form):
+def save_contact_to_database(form, app):
+    """Store the submission and its notification email in one transaction."""
     try:
         submission = ContactSubmission(
             name=form.data.get("name"),  # type: ignore
@@ -48,6 +48,7 @@ def save_contact_to_database(form):
             user_agent=request.headers.get("User-Agent"),  # type: ignore
         )
         db.session.add(submission)
+        queue_contact_email(form, app)
         db.session.commit()
         return True
     except Exception as e:
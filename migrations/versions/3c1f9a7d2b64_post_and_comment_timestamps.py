@@ -0,0 +1,138 @@
+"""Post and comment timestamps
+
+Revision ID: 3c1f9a7d2b64
+Revises: 55408888446e
+Create Date: 2026-10-17 09:12:44.281930
+
+Adds real created_at columns next to the display-only `date` strings,
+backfills them in small committed batches and adds the indexes the
+listing, the comment list and the foreign keys need.
+
+The column gets a server default before the backfill, so rows inserted
+meanwhile by app instances still running the old code get a timestamp and
+the NOT NULL at the end cannot fail on them. The backfill only touches rows
+where created_at is still NULL, so an interrupted upgrade can simply be
+re-run. On PostgreSQL the indexes are built CONCURRENTLY so writers are not
+blocked.
+"""
+from datetime import datetime
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from dateutil import parser as date_parser
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a7d2b64'
+down_revision = '55408888446e'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+BATCH_SIZE = 1000
+# Unparseable dates sort to the very end of the listing instead of the top.
+FALLBACK_DATE = datetime(1970, 1, 1)
+
+INDEXES = [
+    ('ix_blog_posts_created_at_id', 'blog_posts', [sa.text('created_at DESC'), 'id']),
+    ('ix_blog_posts_author_id', 'blog_posts', ['author_id']),
+    ('ix_comments_post_id_created_at', 'comments', ['post_id', 'created_at']),
+    ('ix_comments_author_id', 'comments', ['author_id']),
+]
+
+
+def _has_column(table, column):
+    inspector = sa.inspect(op.get_bind())
+    return column in {c['name'] for c in inspector.get_columns(table)}
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%B %d, %Y')
+    except (TypeError, ValueError):
+        pass
+    try:
+        return date_parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _backfill(table_name):
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column('date', sa.String),
+        sa.column('created_at', sa.DateTime),
+    )
+    bind = op.get_bind()
+    last_id = 0
+    done = 0
+    while True:
+        rows = bind.execute(
+            sa.select(table.c.id, table.c.date)
+            .where(table.c.created_at.is_(None), table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = {}
+        for row_id, raw in rows:
+            parsed = _parse_date(raw)
+            if parsed is None:
+                logger.warning('%s.id=%s: unparseable date %r', table_name, row_id, raw)
+                parsed = FALLBACK_DATE
+            values[row_id] = parsed
+        # One statement per batch: it commits on its own in the autocommit
+        # block, so locks are held for a single batch at a time.
+        bind.execute(
+            table.update()
+            .where(table.c.id.in_(list(values)))
+            .values(created_at=sa.case(values, value=table.c.id))
+        )
+        last_id = rows[-1][0]
+        done += len(rows)
+        logger.info('Backfilled %d %s rows (up to id %d)', done, table_name, last_id)
+
+
+def upgrade():
+    for table in ('blog_posts', 'comments'):
+        if not _has_column(table, 'created_at'):
+            op.add_column(table, sa.Column('created_at', sa.DateTime(), nullable=True))
+        # Only new rows get the default; existing ones stay NULL for the backfill.
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                'created_at', existing_type=sa.DateTime(), server_default=sa.func.now()
+            )
+
+    with op.get_context().autocommit_block():
+        _backfill('blog_posts')
+        _backfill('comments')
+
+    for table in ('blog_posts', 'comments'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                'created_at',
+                existing_type=sa.DateTime(),
+                existing_server_default=sa.func.now(),
+                nullable=False,
+            )
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name, table, columns, if_not_exists=True, postgresql_concurrently=True
+            )
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,28 @@
+"""Post version counter
+
+Revision ID: 8e42b1c0d7a5
+Revises: 3c1f9a7d2b64
+Create Date: 2026-10-17 11:40:02.518233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e42b1c0d7a5'
+down_revision = '3c1f9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant server default keeps this a metadata-only change on
+    # PostgreSQL 11+, with no table rewrite.
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,39 @@
+"""Raw HTML and sanitize policy
+
+Revision ID: a4e7d2c9f153
+Revises: f3a8c6e1b92d
+Create Date: 2026-10-17 17:31:48.905127
+
+Existing rows keep only their sanitized HTML (the raw input was never
+stored), so body_raw / text_raw start out NULL and `flask sanitize`
+re-cleans the sanitized copy for them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e7d2c9f153'
+down_revision = 'f3a8c6e1b92d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_raw', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('sanitize_policy', sa.Integer(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('text_raw', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('sanitize_policy', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_column('sanitize_policy')
+        batch_op.drop_column('text_raw')
+
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('sanitize_policy')
+        batch_op.drop_column('body_raw')
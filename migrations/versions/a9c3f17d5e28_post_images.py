@@ -0,0 +1,43 @@
+"""Post images
+
+Revision ID: a9c3f17d5e28
+Revises: e6d2a9c41f87
+Create Date: 2026-10-17 21:05:47.219803
+
+Local, content-addressed copies of post header images. Existing posts keep
+their remote img_url until `flask images ingest` has processed them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c3f17d5e28'
+down_revision = 'e6d2a9c41f87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_images',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('original', sa.String(length=100), nullable=False),
+    sa.Column('content_type', sa.String(length=50), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('variants', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_digest', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_blog_posts_image_digest_post_images', 'post_images', ['image_digest'], ['digest'])
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_blog_posts_image_digest_post_images', type_='foreignkey')
+        batch_op.drop_column('image_digest')
+
+    op.drop_table('post_images')
@@ -0,0 +1,27 @@
+"""Post updated_at
+
+Revision ID: b7d03e91f2c8
+Revises: 8e42b1c0d7a5
+Create Date: 2026-10-17 13:05:51.772014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d03e91f2c8'
+down_revision = '8e42b1c0d7a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left NULL for existing rows; readers fall back to created_at.
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
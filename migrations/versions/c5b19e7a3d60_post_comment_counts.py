@@ -0,0 +1,75 @@
+"""Post comment counts
+
+Revision ID: c5b19e7a3d60
+Revises: a4e7d2c9f153
+Create Date: 2026-10-17 18:12:26.554310
+
+Adds comment_count / last_comment_at to blog_posts and fills them in
+committed batches of posts; `flask comments recount` repairs them later.
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5b19e7a3d60'
+down_revision = 'a4e7d2c9f153'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+BATCH_SIZE = 1000
+
+
+def _backfill():
+    posts = sa.table(
+        'blog_posts',
+        sa.column('id', sa.Integer),
+        sa.column('comment_count', sa.Integer),
+        sa.column('last_comment_at', sa.DateTime),
+    )
+    comments = sa.table(
+        'comments',
+        sa.column('post_id', sa.Integer),
+        sa.column('created_at', sa.DateTime),
+    )
+    of_post = comments.c.post_id == posts.c.id
+    count = sa.select(sa.func.count()).select_from(comments).where(of_post).scalar_subquery()
+    latest = sa.select(sa.func.max(comments.c.created_at)).where(of_post).scalar_subquery()
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        ids = bind.execute(
+            sa.select(posts.c.id)
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            break
+        bind.execute(
+            posts.update()
+            .where(posts.c.id.in_(ids))
+            .values(comment_count=count, last_comment_at=latest)
+        )
+        last_id = ids[-1]
+        logger.info('Counted comments for posts up to id %d', last_id)
+
+
+def upgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_comment_at', sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        _backfill()
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts', schema=None) as batch_op:
+        batch_op.drop_column('last_comment_at')
+        batch_op.drop_column('comment_count')
@@ -0,0 +1,34 @@
+"""Contact submissions created_at index
+
+Revision ID: d4b8e2f61a93
+Revises: a9c3f17d5e28
+Create Date: 2026-10-17 22:14:03.418652
+
+Serves the admin listing's keyset pages and the range scans of
+`flask contacts prune`. The table can be large, so on PostgreSQL the index
+is built concurrently instead of locking out contact form inserts.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8e2f61a93'
+down_revision = 'a9c3f17d5e28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_contact_submissions_created_at_id',
+            'contact_submissions',
+            ['created_at', 'id'],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_contact_submissions_created_at_id', table_name='contact_submissions')
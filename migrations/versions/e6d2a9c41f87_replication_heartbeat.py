@@ -0,0 +1,35 @@
+"""Replication heartbeat
+
+Revision ID: e6d2a9c41f87
+Revises: c5b19e7a3d60
+Create Date: 2026-10-17 19:40:12.806531
+
+A single row that every write transaction bumps when read replicas are
+configured; a replica's copy of it tells how far it has caught up.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6d2a9c41f87'
+down_revision = 'c5b19e7a3d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('replication_heartbeat',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('beat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO replication_heartbeat (id, position, beat_at) "
+        "VALUES (1, 0, CURRENT_TIMESTAMP)"
+    )
+
+
+def downgrade():
+    op.drop_table('replication_heartbeat')
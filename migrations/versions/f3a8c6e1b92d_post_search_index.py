@@ -0,0 +1,109 @@
+"""Post search index
+
+Revision ID: f3a8c6e1b92d
+Revises: d19f6a2c4e07
+Create Date: 2026-10-17 16:05:31.402116
+
+Creates the full-text index used by /search (an FTS5 table on SQLite, a
+tsvector column under a GIN index on PostgreSQL) and fills it from the
+existing posts in batches. `flask search rebuild` does the same later.
+"""
+import logging
+import re
+from html import unescape
+
+from alembic import op
+import bleach
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c6e1b92d'
+down_revision = 'd19f6a2c4e07'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+BATCH_SIZE = 500
+
+
+def _clean(value):
+    return re.sub(r'\s+', ' ', value.replace('\ue000', '').replace('\ue001', '')).strip()
+
+
+def _plain_text(html):
+    return _clean(unescape(bleach.clean(html or '', tags=[], strip=True)))
+
+
+def _backfill(postgresql):
+    posts = sa.table(
+        'blog_posts',
+        sa.column('id', sa.Integer),
+        sa.column('title', sa.String),
+        sa.column('subtitle', sa.String),
+        sa.column('body', sa.Text),
+    )
+    if postgresql:
+        insert = sa.text(
+            "INSERT INTO post_search (post_id, title, subtitle, body, document) "
+            "VALUES (:id, :title, :subtitle, :body, "
+            "setweight(to_tsvector('english', :title), 'A') || "
+            "setweight(to_tsvector('english', :subtitle), 'B') || "
+            "setweight(to_tsvector('english', :body), 'D')) "
+            "ON CONFLICT (post_id) DO NOTHING"
+        )
+    else:
+        insert = sa.text(
+            "INSERT OR IGNORE INTO post_search (rowid, title, subtitle, body) "
+            "VALUES (:id, :title, :subtitle, :body)"
+        )
+    bind = op.get_bind()
+    last_id = 0
+    done = 0
+    while True:
+        rows = bind.execute(
+            sa.select(posts.c.id, posts.c.title, posts.c.subtitle, posts.c.body)
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(insert, [
+            {
+                'id': row.id,
+                'title': _clean(row.title),
+                'subtitle': _clean(row.subtitle),
+                'body': _plain_text(row.body),
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+        done += len(rows)
+        logger.info('Indexed %d posts (up to id %d)', done, last_id)
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    if postgresql:
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS post_search ("
+            "post_id INTEGER PRIMARY KEY REFERENCES blog_posts (id) ON DELETE CASCADE, "
+            "title TEXT NOT NULL, subtitle TEXT NOT NULL, body TEXT NOT NULL, "
+            "document TSVECTOR NOT NULL)"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_post_search_document "
+            "ON post_search USING GIN (document)"
+        )
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+            "title, subtitle, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+    _backfill(postgresql)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS post_search")
@@ -0,0 +1,108 @@
+"""Shared fixtures: a fresh app with its own SQLite database, cache and
+rate limit files per test, and query budgets that raise."""
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from app.config import Config
+from app.extensions import db
+from app.models import BlogPost, Comment, User
+
+PASSWORD = "Passw0rd!"
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Config overrides; tests may change them before `app` is created."""
+    return {
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "QUERY_BUDGET_RAISE": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/blog.db",
+        "SQLALCHEMY_BINDS": {},
+        "CACHE_TYPE": "app.cache_backends.SQLiteLRUCache",
+        "CACHE_DIR": str(tmp_path / "cache"),
+        "RATELIMIT_STORAGE_URI": f"sqlite:///{tmp_path}/limits.db",
+        "RATELIMIT_ENABLED": False,
+        "METRICS_DIR": str(tmp_path / "metrics"),
+        "IMAGE_STORE_DIR": str(tmp_path / "images"),
+        "IMAGE_INGEST_BACKGROUND": False,
+        "MAIL_OUTBOX_BACKGROUND": False,
+        "MAIL_USERNAME": "owner@example.com",
+        "MAIL_DEFAULT_SENDER": "owner@example.com",
+        "PASSWORD_HASH_WORKERS": 0,
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+    }
+
+
+@pytest.fixture
+def app(settings, monkeypatch):
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value, raising=False)
+    app = create_app()
+    with app.app_context():
+        # Only the primary: `db` keeps metadata for binds of earlier apps, and
+        # replicas are filled by copying the primary (see test_replicas).
+        db.create_all(bind_key=None)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def users(app):
+    """The admin (id 1) and a second user, both with PASSWORD."""
+    pwhash = generate_password_hash(PASSWORD, "pbkdf2:sha256:1000")
+    with app.app_context():
+        db.session.add_all(
+            [
+                User(name="Admin", email="admin@example.com", password=pwhash),  # type: ignore
+                User(name="Bob", email="bob@example.com", password=pwhash),  # type: ignore
+            ]
+        )
+        db.session.commit()
+    return "admin@example.com", "bob@example.com"
+
+
+@pytest.fixture
+def posts(app, users):
+    """Twelve posts, a day apart; the newest (id 12) has 60 comments."""
+    with app.app_context():
+        for i in range(12):
+            db.session.add(
+                BlogPost(
+                    title=f"Post {i}",  # type: ignore
+                    subtitle="Subtitle",  # type: ignore
+                    body=f"<p>Body {i}</p>",  # type: ignore
+                    img_url="https://example.com/header.jpg",  # type: ignore
+                    date="January 01, 2025",  # type: ignore
+                    created_at=datetime(2025, 1, 1) + timedelta(days=i),  # type: ignore
+                    author_id=1,  # type: ignore
+                )
+            )
+        db.session.flush()
+        for i in range(60):
+            db.session.add(
+                Comment(
+                    text=f"<p>Comment {i}</p>",  # type: ignore
+                    date="February 01, 2025",  # type: ignore
+                    created_at=datetime(2025, 2, 1) + timedelta(minutes=i),  # type: ignore
+                    author_id=2,  # type: ignore
+                    post_id=12,  # type: ignore
+                )
+            )
+        db.session.commit()
+    return list(range(1, 13))
+
+
+def login(client, email, password=PASSWORD):
+    return client.post("/login", data={"email": email, "password": password})
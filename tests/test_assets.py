@@ -0,0 +1,174 @@
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+from flask import render_template_string, url_for
+
+from app import assets
+
+STATIC = os.path.join(os.path.dirname(assets.__file__), "static")
+
+
+@pytest.fixture
+def static(tmp_path):
+    """A copy of the app's scripts and styles to build."""
+    folder = tmp_path / "static"
+    for name in ("css", "js"):
+        shutil.copytree(os.path.join(STATIC, name), folder / name)
+    return folder
+
+
+def read_manifest(static):
+    with open(static / "build" / "manifest.json") as f:
+        return json.load(f)
+
+
+def make_image(path, width, height):
+    Image = pytest.importorskip("PIL.Image")
+    os.makedirs(path.parent, exist_ok=True)
+    Image.new("RGB", (width, height), (200, 40, 90)).save(path, "JPEG")
+
+
+def image_formats():
+    formats = [fmt for fmt, _, _ in assets._image_formats()]
+    if not formats:
+        pytest.skip("Pillow cannot write WebP or AVIF here")
+    return formats
+
+
+def build(static, **kwargs):
+    messages = []
+    manifest, removed = assets.build(str(static), (640, 1280), echo=messages.append, **kwargs)
+    return manifest, removed, messages
+
+
+def test_build_without_optional_packages(static, monkeypatch):
+    monkeypatch.setattr(assets, "brotli", None)
+    monkeypatch.setattr(assets, "Image", None)
+    (static / "assets" / "img").mkdir(parents=True)
+    (static / "assets" / "img" / "bg.jpg").write_bytes(b"not really a jpeg")
+
+    manifest, removed, messages = build(static)
+    assert "brotli is not installed: writing .gz copies only." in messages
+    assert "Pillow is not installed: skipping WebP/AVIF image variants." in messages
+    assert removed == 0
+
+    css = manifest.files["css/styles.css"]
+    assert css.startswith("build/css/styles.") and css.endswith(".css")
+    assert manifest.encodings[css] == ["gzip"]
+    original = (static / "css" / "styles.css").read_bytes()
+    assert (static / css).read_bytes() == original
+    assert gzip.decompress((static / f"{css}.gz").read_bytes()) == original
+    assert not (static / f"{css}.br").exists()
+    assert manifest.files["assets/img/bg.jpg"] not in manifest.encodings
+    assert manifest.images == {}
+    assert read_manifest(static) == manifest.to_json()
+
+
+def test_build_writes_brotli_copies(static):
+    brotli = pytest.importorskip("brotli")
+    manifest, _, messages = build(static)
+    assert not any("brotli" in message for message in messages)
+    js = manifest.files["js/scripts.js"]
+    assert manifest.encodings[js] == ["br", "gzip"]
+    original = (static / js).read_bytes()
+    assert brotli.decompress((static / f"{js}.br").read_bytes()) == original
+    assert gzip.decompress((static / f"{js}.gz").read_bytes()) == original
+
+
+def test_build_writes_image_variants(static):
+    make_image(static / "assets" / "img" / "bg.jpg", 1600, 800)
+    make_image(static / "assets" / "img" / "small.jpg", 300, 200)
+    # Only images under assets/img are resized.
+    make_image(static / "other.jpg", 1600, 800)
+    formats = image_formats()
+    manifest, _, _ = build(static)
+
+    from PIL import Image
+
+    variants = manifest.images["assets/img/bg.jpg"]
+    assert sorted(variants) == sorted(formats)
+    for fmt, sizes in variants.items():
+        assert [width for width, _ in sizes] == [640, 1280]
+        for width, name in sizes:
+            assert name.endswith(f".{fmt}")
+            with Image.open(static / name) as image:
+                assert image.size == (width, width // 2)
+    assert [w for w, _ in manifest.images["assets/img/small.jpg"][formats[0]]] == [300]
+    assert "other.jpg" not in manifest.images
+
+
+@pytest.fixture
+def built(app, static):
+    """The app serving a built copy of the static files."""
+    build(static)
+    app.static_folder = str(static)
+    app.extensions["assets"] = assets.Manifest.load(str(static))
+    return app.extensions["assets"]
+
+
+def test_built_files_are_immutable_and_precompressed(app, client, built):
+    with app.test_request_context():
+        url = url_for("static", filename="css/styles.css")
+    name = built.files["css/styles.css"]
+    assert url == f"/static/{name}"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/css"
+    assert "Accept-Encoding" in response.vary
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.cache_control.max_age == app.config["STATIC_IMMUTABLE_MAX_AGE"]
+    with open(os.path.join(app.static_folder, "css", "styles.css"), "rb") as f:
+        original = f.read()
+    assert gzip.decompress(response.data) == original
+
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.data == original
+    # Files that are not part of the build are served as before.
+    unbuilt = client.get("/static/css/styles.css")
+    assert unbuilt.status_code == 200
+    assert not unbuilt.cache_control.immutable
+
+
+def test_masthead_background_uses_image_variants(app, static):
+    make_image(static / "assets" / "img" / "bg.jpg", 1600, 800)
+    if "webp" not in image_formats():
+        pytest.skip("Pillow cannot write WebP here")
+    build(static)
+    app.static_folder = str(static)
+    manifest = app.extensions["assets"] = assets.Manifest.load(str(static))
+    with app.test_request_context():
+        css = render_template_string("{{ masthead_background('assets/img/bg.jpg') }}")
+    fallback = manifest.files["assets/img/bg.jpg"]
+    assert f"background-image: url('/static/{fallback}')" in css
+    webp = dict(manifest.images["assets/img/bg.jpg"]["webp"])
+    assert f"url('/static/{webp[1280]}') type('image/webp')" in css
+    assert "@media (max-width: 640px)" in css
+    assert f"url('/static/{webp[640]}') type('image/webp')" in css
+    assert f"url('/static/{fallback}') type('image/jpeg')" in css
+
+
+def test_assets_build_command_cleans_old_builds(app, static):
+    app.static_folder = str(static)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["assets", "build"])
+    assert result.exit_code == 0, result.output
+    old = read_manifest(static)["files"]["css/styles.css"]
+
+    with open(static / "css" / "styles.css", "a") as f:
+        f.write("\nbody { color: red; }\n")
+    runner.invoke(args=["assets", "build"])
+    # Without --clean, pages cached before the deploy still find the old file.
+    assert (static / old).exists()
+    result = runner.invoke(args=["assets", "build", "--clean"])
+    assert result.exit_code == 0, result.output
+    new = read_manifest(static)["files"]["css/styles.css"]
+    assert new != old
+    assert (static / new).exists()
+    assert not (static / old).exists() and not (static / f"{old}.gz").exists()
+    assert "removed 0 old files" not in result.output
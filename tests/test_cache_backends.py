@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.cache_backends import SQLiteLRUCache, StatsRedisCache, key_prefix
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite")
+
+
+def test_key_prefix():
+    assert key_prefix("post:1:header") == "post"
+    assert key_prefix("view//about") == "view"
+
+
+def test_get_set_add_delete(path):
+    cache = SQLiteLRUCache(path)
+    assert cache.get("a") is None
+    assert cache.set("a", {"x": 1})
+    assert cache.get("a") == {"x": 1}
+    assert not cache.add("a", 2)
+    assert cache.add("b", 2)
+    assert cache.inc("b", 3) == 5
+    assert cache.delete("a")
+    assert not cache.has("a")
+
+
+def test_expired_entries_miss(path, monkeypatch):
+    cache = SQLiteLRUCache(path)
+    cache.set("a", 1, timeout=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+    # add() replaces an expired entry
+    assert cache.add("a", 2)
+
+
+def test_least_recently_read_is_evicted(path):
+    cache = SQLiteLRUCache(path, threshold=2)
+    cache.touch_interval = 0
+    cache.set("old", 1)
+    cache.set("new", 2)
+    time.sleep(0.01)
+    cache.get("old")
+    cache.set("third", 3)
+    assert cache.get("old") == 1
+    assert cache.get("new") is None
+    assert cache.get_stats()["new"]["evictions"] == 1
+
+
+def test_max_bytes_bounds_payload(path):
+    cache = SQLiteLRUCache(path, threshold=0, max_bytes=3000)
+    for i in range(10):
+        cache.set(f"k{i}", b"x" * 1000)
+    present = [i for i in range(10) if cache.has(f"k{i}")]
+    assert present == [8, 9]
+
+
+def totals(path):
+    with sqlite3.connect(path) as conn:
+        kept = conn.execute("SELECT count, size FROM totals").fetchone()
+        actual = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+    assert kept == actual
+    return kept
+
+
+def test_totals_track_every_write(path, monkeypatch):
+    cache = SQLiteLRUCache(path, threshold=3)
+    cache.set("a", b"x" * 100)
+    cache.set("a", b"x" * 10)
+    cache.set("b", 1, timeout=5)
+    cache.add("c", 2)
+    cache.inc("c")
+    cache.delete("c")
+    assert totals(path)[0] == 2
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+    # Over the threshold: the expired entry goes before any live one.
+    for key in ("d", "e", "f"):
+        cache.set(key, 1)
+    assert totals(path)[0] == 3
+    assert not cache.has("b")
+    assert cache.get_stats()["a"]["evictions"] == 1
+    cache.clear()
+    assert totals(path) == (0, 0)
+
+
+def test_totals_are_backfilled_for_an_existing_file(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO cache VALUES (?, x'00', 7, 1e18, 0)", [("a",), ("b",)]
+        )
+    SQLiteLRUCache(path)
+    assert totals(path) == (2, 14)
+
+
+def test_key_prefix_separates_caches(path):
+    blog, other = SQLiteLRUCache(path, key_prefix="blog:"), SQLiteLRUCache(path, key_prefix="x:")
+    blog.set("post:1", "blog")
+    other.set("post:1", "other")
+    assert blog.get("post:1") == "blog"
+    with sqlite3.connect(path) as conn:
+        assert sorted(k for (k,) in conn.execute("SELECT key FROM cache")) == [
+            "blog:post:1",
+            "x:post:1",
+        ]
+    blog.clear()
+    assert not blog.has("post:1")
+    assert other.get("post:1") == "other"
+    # Stats are counted by the key the app used.
+    assert "post" in blog.get_stats()
+
+
+def test_app_cache_uses_the_configured_prefix(app):
+    from app.extensions import cache
+
+    assert cache.cache.key_prefix == app.config["CACHE_KEY_PREFIX"]
+
+
+def test_processes_share_entries_and_stats(path):
+    writer, reader = SQLiteLRUCache(path), SQLiteLRUCache(path)
+    writer.set("post:1", "html")
+    assert reader.get("post:1") == "html"
+    reader.get("post:2")
+    reader.flush_stats()
+    assert writer.get_stats()["post"] == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_stats_are_flushed_at_exit(path):
+    # A short-lived process never reaches the periodic flush.
+    script = (
+        "from app.cache_backends import SQLiteLRUCache\n"
+        f"cache = SQLiteLRUCache({path!r})\n"
+        "cache.set('view:a', 1)\n"
+        "cache.get('view:a'); cache.get('view:b')\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+    assert SQLiteLRUCache(path).get_stats()["view"] == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_stats_command_reports_zero_counts(app):
+    result = app.test_cli_runner().invoke(args=["cache", "stats"])
+    assert "does not record" not in result.output
+    assert "total" in result.output
+
+
+def test_stats_command_without_stats_backend(settings, request):
+    settings["CACHE_TYPE"] = "SimpleCache"
+    app = request.getfixturevalue("app")
+    result = app.test_cli_runner().invoke(args=["cache", "stats"])
+    assert "does not record statistics" in result.output
+
+
+@pytest.fixture
+def redis_cache():
+    """A StatsRedisCache on CACHE_TEST_REDIS_URL (e.g. a local redis-server)."""
+    url = os.getenv("CACHE_TEST_REDIS_URL")
+    if not url:
+        pytest.skip("set CACHE_TEST_REDIS_URL to run the Redis cache tests")
+    redis = pytest.importorskip("redis")
+    from flask import Flask
+
+    app = Flask(__name__)
+    config = {"CACHE_REDIS_URL": url, "CACHE_KEY_PREFIX": f"test-{os.getpid()}:"}
+    cache = StatsRedisCache.factory(app, config, [], {"default_timeout": 60})
+    yield cache
+    client = redis.Redis.from_url(url)
+    for key in client.scan_iter(f"test-{os.getpid()}:*"):
+        client.delete(key)
+
+
+def test_redis_cache_counts_per_prefix(redis_cache):
+    redis_cache.set("post:1", "html")
+    assert redis_cache.get("post:1") == "html"
+    assert redis_cache.get("post:2") is None
+    stats = redis_cache.get_stats()
+    assert stats["post"] == {"hits": 1, "misses": 1, "evictions": 0}
+    assert "*" in stats
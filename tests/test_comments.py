@@ -0,0 +1,144 @@
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, select, update
+
+from app.extensions import db
+from app.models import BlogPost, Comment
+
+from .conftest import PASSWORD, login
+
+
+def comment_numbers(html):
+    return [int(n) for n in re.findall(r"<p>Comment (\d+)</p>", html)]
+
+
+def load_more(html):
+    found = re.search(r'data-src="([^"]+)"', html)
+    return found and found.group(1)
+
+
+def test_comment_pages_follow_the_cursor(client, posts):
+    html = client.get("/post/12").get_data(as_text=True)
+    assert comment_numbers(html) == list(range(20))
+
+    seen = []
+    url = load_more(html)
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        seen.extend(comment_numbers(html))
+        url = load_more(html)
+    assert seen == list(range(20, 60))
+
+
+def test_comment_pages_as_json(client, users, posts):
+    seen = []
+    url = "/post/12/comments?format=json"
+    while url:
+        page = client.get(url).json
+        assert all(c["author"] == "Bob" for c in page["comments"])
+        seen.extend(comment_numbers("".join(c["html"] for c in page["comments"])))
+        url = page["next"]
+    assert seen == list(range(60))
+
+    assert client.get("/post/3/comments?format=json").json == {"comments": [], "next": None}
+
+
+def test_cached_comment_page_sees_new_comments(client, users, posts):
+    first = client.get("/post/12/comments").get_data(as_text=True)
+    last_url = load_more(client.get(load_more(first)).get_data(as_text=True))
+    html = client.get(last_url).get_data(as_text=True)
+    assert comment_numbers(html) == list(range(40, 60))
+    assert load_more(html) is None
+
+    login(client, users[1])
+    client.post("/post/12", data={"text": "<p>Comment 60</p>"})
+    html = client.get(last_url).get_data(as_text=True)
+    assert comment_numbers(html) == list(range(40, 60))
+    assert comment_numbers(client.get(load_more(html)).get_data(as_text=True)) == [60]
+
+
+def test_comment_page_errors(client, posts):
+    assert client.get("/post/12/comments?after=nonsense").status_code == 400
+    assert client.get("/post/12/comments?after=nonsense&format=json").status_code == 400
+    assert client.get("/post/99/comments").status_code == 404
+
+
+def test_create_comment_returns_the_fragment(app, client, users, posts):
+    login(client, users[1])
+    response = client.post("/post/3/comments", data={"text": "<p>Posted <b>in place</b></p>"})
+    assert response.status_code == 201
+    html = response.get_data(as_text=True)
+    assert html.startswith('<div class="comment-item')
+    assert "<p>Posted <b>in place</b></p>" in html and "Bob on" in html
+    assert "<html" not in html
+
+    response = client.post("/post/3/comments?format=json", data={"text": "<p>Again</p>"})
+    assert response.status_code == 201
+    assert f'id="comment-{response.json["id"]}"' in response.json["html"]
+
+    page = client.get("/post/3").get_data(as_text=True)
+    assert "in place" in page and "Again" in page
+    with app.app_context():
+        assert db.session.get(BlogPost, 3).comment_count == 2
+
+
+def test_create_comment_errors(client, users, posts):
+    assert client.post("/post/3/comments", data={"text": "<p>Hi</p>"}).status_code == 401
+    login(client, users[1])
+    response = client.post("/post/3/comments", data={"text": ""})
+    assert response.status_code == 400
+    assert "text" in response.json["errors"]
+    assert client.post("/post/99/comments", data={"text": "<p>Hi</p>"}).status_code == 404
+
+
+@pytest.fixture
+def csrf(settings):
+    settings["WTF_CSRF_ENABLED"] = True
+
+
+def test_create_comment_checks_the_csrf_header(csrf, client, users, posts):
+    token = client.get("/csrf-token").json["csrf_token"]
+    assert login(client, users[1]).status_code == 400
+    client.post("/login", data={"email": users[1], "password": PASSWORD, "csrf_token": token})
+    assert client.post("/post/3/comments", data={"text": "<p>Hi</p>"}).status_code == 400
+    response = client.post(
+        "/post/3/comments", data={"text": "<p>Hi</p>"}, headers={"X-CSRFToken": token}
+    )
+    assert response.status_code == 201
+
+
+def recount(app, *args):
+    result = app.test_cli_runner().invoke(args=["comments", "recount", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def counts(app):
+    with app.app_context():
+        return {
+            post.id: (post.comment_count, post.last_comment_at)
+            for post in db.session.scalars(select(BlogPost))
+        }
+
+
+def test_recount_fixes_only_wrong_rows(app, client, posts):
+    # The fixture inserts comments without maintaining the counters.
+    assert b"60 comments" not in client.get("/").data
+    assert recount(app, "--batch-size", "5") == "Fixed counts on 1 post(s).\n"
+    fixed = counts(app)
+    assert fixed[12] == (60, datetime(2025, 2, 1, 0, 59))
+    assert all(fixed[i] == (0, None) for i in range(1, 12))
+    assert b"60 comments" in client.get("/").data
+
+    assert recount(app) == "Fixed counts on 0 post(s).\n"
+
+    with app.app_context():
+        db.session.execute(delete(Comment).where(Comment.text == "<p>Comment 59</p>"))
+        db.session.execute(update(BlogPost).where(BlogPost.id == 3).values(comment_count=5))
+        db.session.commit()
+    assert recount(app, "--batch-size", "2") == "Fixed counts on 2 post(s).\n"
+    fixed = counts(app)
+    assert fixed[12] == (59, datetime(2025, 2, 1, 0, 58))
+    assert fixed[3] == (0, None)
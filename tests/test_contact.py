@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import contacts, utils
+from app.contacts import export_chunks
+from app.extensions import db
+from app.models import ContactSubmission, OutboxMessage
+
+from .conftest import login
+
+FORM = {
+    "name": "Ada",
+    "number": "555-0100",
+    "email": "ada@example.com",
+    "message": "Hello there, nice blog!",
+}
+
+
+def counts(app):
+    with app.app_context():
+        return (
+            db.session.scalar(select(func.count(ContactSubmission.id))),
+            db.session.scalar(select(func.count(OutboxMessage.id))),
+        )
+
+
+def test_submission_is_saved_with_notification(app, client):
+    response = client.post("/contact", data=FORM)
+    assert response.status_code == 302
+    assert counts(app) == (1, 1)
+    with app.app_context():
+        message = db.session.scalar(select(OutboxMessage))
+        assert message.recipients == "owner@example.com"
+        assert message.reply_to == "ada@example.com"
+
+
+def test_submission_is_saved_without_mail_username(settings, app, client, caplog):
+    app.config["MAIL_USERNAME"] = None
+    response = client.post("/contact", data=FORM)
+    assert response.status_code == 302
+    assert counts(app) == (1, 0)
+    assert "MAIL_USERNAME is not set" in caplog.text
+
+
+def test_failed_save_is_not_reported_as_sent(app, client, monkeypatch):
+    def broken(form, app):
+        raise RuntimeError("outbox unavailable")
+
+    monkeypatch.setattr(utils, "queue_contact_email", broken)
+    response = client.post("/contact", data=FORM)
+    assert response.status_code == 500
+    assert counts(app) == (0, 0)
+    with client.session_transaction() as session:
+        messages = [message for _, message in session.get("_flashes", [])]
+    assert messages == ["Sorry, your message could not be sent. Please try again later."]
+
+
+def add_submissions(app, count, start=datetime(2025, 1, 1), **values):
+    with app.app_context():
+        for i in range(count):
+            db.session.add(
+                ContactSubmission(
+                    **{**FORM, "name": f"Sender {i}", **values},
+                    created_at=start + timedelta(hours=i),  # type: ignore
+                )
+            )
+        db.session.commit()
+
+
+def sender_numbers(html):
+    return [int(n) for n in re.findall(r"Sender (\d+) &lt;", html)]
+
+
+def test_admin_listing_pages_newest_first(app, client, users):
+    add_submissions(app, 60)
+    login(client, users[0])
+    seen = []
+    url = "/admin/contacts"
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        assert len(sender_numbers(html)) <= 25
+        seen.extend(sender_numbers(html))
+        found = re.search(r'href="(/admin/contacts\?after=[\w-]+)"', html)
+        url = found and found.group(1)
+    assert seen == list(range(59, -1, -1))
+
+    back = re.search(r'href="(/admin/contacts\?before=[\w-]+)"', html).group(1)
+    assert sender_numbers(client.get(back).get_data(as_text=True)) == list(range(34, 9, -1))
+    assert client.get("/admin/contacts?after=nonsense").status_code == 400
+
+
+def test_admin_pages_need_the_admin(app, client, users):
+    assert client.get("/admin/contacts").location.startswith("/login")
+    login(client, users[1])
+    assert client.get("/admin/contacts").location == "/"
+    assert client.get("/admin/contacts.csv").location == "/"
+
+
+def test_csv_export_escapes_formulas(app, client, users):
+    names = ["=HYPERLINK(\"http://evil\")", "+1", "-2", "@SUM(A1)", "\tTab", "Plain = fine"]
+    with app.app_context():
+        for name in names:
+            db.session.add(ContactSubmission(**{**FORM, "name": name}))  # type: ignore
+        db.session.commit()
+    login(client, users[0])
+
+    response = client.get("/admin/contacts.csv")
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "text/csv"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert response.headers["Content-Disposition"].startswith('attachment; filename="contacts-')
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row["name"] for row in rows] == ["'" + name for name in names[:5]] + [names[5]]
+    assert rows[0]["number"] == "555-0100"
+    assert rows[0]["ip_address"] == ""
+
+    # JSON Lines keeps the values as they were sent.
+    lines = client.get("/admin/contacts.jsonl").get_data(as_text=True).splitlines()
+    assert [json.loads(line)["name"] for line in lines] == names
+    assert client.get("/admin/contacts.xlsx").status_code == 404
+
+
+def test_export_streams_in_chunks(app):
+    add_submissions(app, 7)
+    with app.app_context():
+        chunks = list(export_chunks("csv", yield_per=3))
+        lines = list(export_chunks("jsonl", yield_per=3))
+    # The header, then one chunk per batch of rows.
+    assert len(chunks) == 4
+    assert chunks[0].startswith("id,created_at,name,")
+    assert chunks[1].count("\n") == 3 and chunks[3].count("\n") == 1
+    assert [json.loads(line)["name"] for line in "".join(lines).splitlines()] == [
+        f"Sender {i}" for i in range(7)
+    ]
+
+
+def test_prune_deletes_old_submissions_in_batches(app):
+    now = contacts.utcnow()
+    add_submissions(app, 7, start=now - timedelta(days=60))
+    add_submissions(app, 3, start=now - timedelta(days=1), name="Recent")
+    result = app.test_cli_runner().invoke(
+        args=["contacts", "prune", "--days", "30", "--batch-size", "3", "--pause", "0"]
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[:3] == [
+        "Deleted 3 submissions",
+        "Deleted 6 submissions",
+        "Deleted 7 submissions",
+    ]
+    assert "Deleted 7 submissions older than" in result.output
+    assert counts(app) == (3, 0)
+    with app.app_context():
+        assert set(db.session.scalars(select(ContactSubmission.name))) == {"Recent"}
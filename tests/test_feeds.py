@@ -0,0 +1,76 @@
+import re
+
+from .conftest import login
+
+
+def lastmod(client, post_id):
+    body = client.get("/sitemap.xml").get_data(as_text=True)
+    return re.search(rf"/post/{post_id}</loc><lastmod>([^<]+)</lastmod>", body).group(1)
+
+
+def test_feeds_render_newest_posts(client, posts):
+    rss = client.get("/feed.xml")
+    assert rss.status_code == 200
+    assert rss.mimetype == "application/rss+xml"
+    assert rss.get_data(as_text=True).count("<item>") == 12
+    atom = client.get("/atom.xml")
+    assert atom.mimetype == "application/atom+xml"
+    assert "<title>Post 11</title>" in atom.get_data(as_text=True)
+    # Page cache hits keep the content type.
+    cached = client.get("/feed.xml")
+    assert cached.headers["X-Page-Cache"] == "hit"
+    assert cached.mimetype == "application/rss+xml"
+
+
+def test_conditional_get(client, posts):
+    for path in ("/feed.xml", "/atom.xml", "/sitemap.xml"):
+        etag = client.get(path).headers["ETag"]
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_comment_changes_etag_and_lastmod(client, users, posts):
+    etag = client.get("/sitemap.xml").headers["ETag"]
+    before = lastmod(client, 3)
+    assert login(client, users[1]).status_code == 302
+    client.post("/post/3", data={"text": "<p>A new comment</p>"})
+    client.get("/logout")
+    response = client.get("/sitemap.xml", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert lastmod(client, 3) != before
+
+
+def test_edit_and_delete_change_etag(client, users, posts):
+    etag = client.get("/feed.xml").headers["ETag"]
+    assert login(client, users[0]).status_code == 302
+    client.post(
+        "/edit-post/5",
+        data={
+            "title": "Edited title",
+            "subtitle": "Subtitle",
+            "img_url": "https://example.com/header.jpg",
+            "body": "<p>Body</p>",
+        },
+    )
+    client.get("/logout")
+    response = client.get("/feed.xml", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Edited title" in response.get_data(as_text=True)
+
+    etag = response.headers["ETag"]
+    assert login(client, users[0]).status_code == 302
+    client.post("/delete/5")
+    client.get("/logout")
+    response = client.get("/feed.xml", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Edited title" not in response.get_data(as_text=True)
+
+
+def test_sitemap_index_and_shards(app, client, posts):
+    app.config["SITEMAP_URLS_PER_FILE"] = 8
+    index = client.get("/sitemap.xml").get_data(as_text=True)
+    assert "<sitemapindex" in index
+    assert index.count("<sitemap>") == 3
+    # The first file also lists the home, about and contact pages.
+    counts = [client.get(f"/sitemap-{n}.xml").get_data(as_text=True).count("<url>") for n in (1, 2, 3)]
+    assert counts == [8, 5, 2]
+    assert client.get("/sitemap-4.xml").status_code == 404
@@ -0,0 +1,64 @@
+from app.extensions import db
+from app.fragments import get_fragments, post_version
+from app.models import BlogPost
+
+from .conftest import login
+
+NAMES = ("header", "body", "comments")
+
+
+def edit(client, post_id, title):
+    return client.post(
+        f"/edit-post/{post_id}",
+        data={
+            "title": title,
+            "subtitle": "Subtitle",
+            "img_url": "https://example.com/header.jpg",
+            "body": "<p>Edited body</p>",
+        },
+    )
+
+
+def test_version_bump_invalidates_fragments(app, client, users, posts):
+    assert login(client, users[0]).status_code == 302
+    assert b"Post 2" in client.get("/post/3").data
+    with app.app_context():
+        old = post_version(3)
+        assert get_fragments(3, old, NAMES) is not None
+
+    assert edit(client, 3, "Renamed").status_code == 302
+    with app.app_context():
+        new = post_version(3)
+        assert new == old + 1
+        assert db.session.get(BlogPost, 3).version == new
+        assert get_fragments(3, new, NAMES) is None
+
+    page = client.get("/post/3").data
+    assert b"Renamed" in page and b"Edited body" in page
+    with app.app_context():
+        assert "Renamed" in get_fragments(3, new, NAMES)["header"]
+        # Other posts keep their fragments.
+        assert post_version(4) == old
+
+
+def test_new_comment_bumps_the_version(app, client, users, posts):
+    assert login(client, users[1]).status_code == 302
+    client.get("/post/3")
+    with app.app_context():
+        old = post_version(3)
+    client.post("/post/3", data={"text": "<p>Fresh comment</p>"})
+    with app.app_context():
+        assert post_version(3) == old + 1
+    assert b"Fresh comment" in client.get("/post/3").data
+
+
+def test_deleted_post_is_not_served_from_cached_fragments(app, client, users, posts):
+    assert login(client, users[0]).status_code == 302
+    client.get("/post/3")
+    with app.app_context():
+        version = post_version(3)
+    assert client.post("/delete/3").status_code == 302
+    with app.app_context():
+        assert post_version(3) is None
+        assert get_fragments(3, version, NAMES) is not None
+    assert client.get("/post/3").status_code == 404
@@ -0,0 +1,98 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import images
+from app.extensions import db
+from app.images import ImageFetchError, fetch, image_ingester
+from app.models import BlogPost
+
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000b4944415478da636000020000050001e9fadcd80000000049454e44ae426082"
+)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/redirect?to="):
+            self.send_response(302)
+            self.send_header("Location", self.path.split("=", 1)[1])
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def port():
+    server = ThreadingHTTPServer(("", 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "file:///etc/passwd",
+        "ftp://example.com/image.png",
+        "http://127.0.0.1/image.png",
+        "http://localhost/image.png",
+        "http://10.0.0.1/image.png",
+        "http://169.254.169.254/latest/meta-data",
+        "http://[::1]/image.png",
+        "http://[::ffff:127.0.0.1]/image.png",
+    ],
+)
+def test_fetch_refuses_non_public_urls(url):
+    with pytest.raises(ImageFetchError):
+        fetch(url, 1024, 1)
+
+
+def test_fetch_refuses_local_server(port):
+    with pytest.raises(ImageFetchError):
+        fetch(f"http://127.0.0.1:{port}/image.png", 1024, 5)
+
+
+def test_fetch_allows_local_server_when_configured(port):
+    assert fetch(f"http://127.0.0.1:{port}/image.png", 1024, 5, allow_private=True) == (
+        "image/png",
+        PNG,
+    )
+
+
+def test_redirects_are_checked(port, monkeypatch):
+    # Treat 127.0.0.1 as the public host and 127.0.0.2 as an internal one.
+    monkeypatch.setattr(images, "_is_public", lambda address: address == "127.0.0.1")
+    url = f"http://127.0.0.1:{port}/image.png"
+    assert fetch(url, 1024, 5)[1] == PNG
+    with pytest.raises(ImageFetchError):
+        fetch(f"http://127.0.0.1:{port}/redirect?to=http://127.0.0.2:{port}/image.png", 1024, 5)
+
+
+def test_redirect_to_file_fails(port):
+    with pytest.raises(ImageFetchError):
+        fetch(f"http://127.0.0.1:{port}/redirect?to=file:///etc/passwd", 1024, 5, allow_private=True)
+
+
+def test_ingest_stores_image_once(app, posts, port):
+    app.config["IMAGE_FETCH_ALLOW_PRIVATE"] = True
+    url = f"http://127.0.0.1:{port}/image.png"
+    with app.app_context():
+        for post_id in (1, 2):
+            db.session.get(BlogPost, post_id).img_url = url
+        db.session.commit()
+        assert image_ingester.ingest(1, url) is True
+        assert image_ingester.ingest(2, url) is False
+        digests = {db.session.get(BlogPost, post_id).image_digest for post_id in (1, 2)}
+    assert len(digests) == 1 and None not in digests
@@ -0,0 +1,84 @@
+import pytest
+
+from app.passwords import password_hasher
+
+from .conftest import login
+
+TOKEN = {"Authorization": "Bearer s3cret"}
+
+
+@pytest.fixture
+def throttled(settings):
+    settings.update(
+        RATELIMIT_ENABLED=True,
+        LOGIN_THROTTLE_ACCOUNT_ATTEMPTS=3,
+        LOGIN_THROTTLE_IP_ATTEMPTS=10,
+        # Long enough that the lock cannot expire during the test.
+        LOGIN_THROTTLE_BASE_DELAY=60,
+        METRICS_TOKEN="s3cret",
+    )
+
+
+@pytest.fixture
+def verify_calls(monkeypatch):
+    calls = []
+    verify = password_hasher.verify
+
+    def counting(pwhash, password):
+        calls.append(password)
+        return verify(pwhash, password)
+
+    monkeypatch.setattr(password_hasher, "verify", counting)
+    return calls
+
+
+def counters(client):
+    body = client.get("/metrics", headers=TOKEN).data.decode()
+    samples = {}
+    for line in body.splitlines():
+        if line.startswith("blog_login_"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_locked_out_login_is_rejected_before_hashing(throttled, client, users, verify_calls):
+    before = counters(client)
+    statuses = [login(client, users[1], "wrong").status_code for _ in range(4)]
+    # Three free failures; the fourth is checked and then locks the account.
+    assert statuses == [200, 200, 200, 200]
+    assert len(verify_calls) == 4
+
+    response = login(client, users[1])
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 1
+    assert len(verify_calls) == 4
+
+    after = counters(client)
+    assert after["blog_login_failures_total"] - before.get("blog_login_failures_total", 0) == 4
+    rejected = 'blog_login_throttled_total{scope="account"}'
+    assert after[rejected] - before.get(rejected, 0) == 1
+    saved = "blog_login_hash_seconds_saved_total"
+    assert after[saved] > before.get(saved, 0)
+
+
+def test_other_accounts_are_not_locked(throttled, client, users, verify_calls):
+    for _ in range(4):
+        login(client, users[1], "wrong")
+    assert login(client, users[0]).status_code == 302
+
+
+def test_success_forgives_the_account(throttled, client, users):
+    for _ in range(2):
+        login(client, users[1], "wrong")
+    assert login(client, users[1]).status_code == 302
+    client.get("/logout")
+    for _ in range(3):
+        assert login(client, users[1], "wrong").status_code == 200
+    assert login(client, users[1]).status_code == 302
+
+
+def test_disabled_limiter_turns_the_throttle_off(client, users):
+    for _ in range(10):
+        assert login(client, users[1], "wrong").status_code == 200
+    assert login(client, users[1]).status_code == 302
@@ -0,0 +1,192 @@
+import socketserver
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.extensions import db
+from app.mail_queue import OutboxSender, enqueue, mail_outbox, utcnow
+from app.models import OutboxMessage
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: records each message's recipients and data."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        recipients = []
+        self.reply("220 localhost stand-in")
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip("<> "))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(line)
+                self.server.messages.append((recipients, b"".join(data)))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def smtp(settings):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.update(
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=server.server_address[1],
+        MAIL_USE_TLS=False,
+        MAIL_PASSWORD=None,
+        # Flask-Mail does not send at all under TESTING otherwise.
+        MAIL_SUPPRESS_SEND=False,
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def queue(app, count=1):
+    with app.app_context():
+        for i in range(count):
+            enqueue(f"Subject {i}", ["owner@example.com"], f"<p>Body {i}</p>")
+        db.session.commit()
+
+
+def outbox(app):
+    with app.app_context():
+        return db.session.scalars(select(OutboxMessage).order_by(OutboxMessage.id)).all()
+
+
+def test_due_messages_are_delivered(smtp, app):
+    queue(app, 3)
+    with app.app_context():
+        assert mail_outbox.deliver_due() == 3
+        assert mail_outbox.deliver_due() == 0
+    assert [m.status for m in outbox(app)] == ["sent"] * 3
+    assert len(smtp.messages) == 3
+    assert smtp.messages[0][0] == ["owner@example.com"]
+
+
+def test_racing_senders_claim_each_message_once(smtp, app, monkeypatch):
+    queue(app, 4)
+    other = OutboxSender()
+    other.app = app
+    lease = OutboxSender._lease
+    raced = []
+
+    def lease_after_other_sender(self, *args):
+        # Another worker delivers everything between this sender's select
+        # and its first lease.
+        if self is mail_outbox and not raced:
+            raced.append(True)
+            with app.app_context():
+                assert other.deliver_due() == 4
+        return lease(self, *args)
+
+    monkeypatch.setattr(OutboxSender, "_lease", lease_after_other_sender)
+    with app.app_context():
+        assert mail_outbox.deliver_due() == 0
+    assert len(smtp.messages) == 4
+    assert [m.status for m in outbox(app)] == ["sent"] * 4
+
+
+def test_concurrent_senders_send_each_message_once(smtp, app):
+    queue(app, 40)
+    senders = [OutboxSender() for _ in range(4)]
+    start = threading.Barrier(len(senders))
+
+    def drain(sender):
+        sender.app = app
+        start.wait()
+        with app.app_context():
+            while sender.deliver_due():
+                pass
+
+    threads = [threading.Thread(target=drain, args=(sender,)) for sender in senders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(smtp.messages) == 40
+    assert [m.status for m in outbox(app)] == ["sent"] * 40
+
+
+@pytest.fixture
+def smtp_down(settings):
+    settings.update(
+        MAIL_SERVER="127.0.0.1", MAIL_PORT=1, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False
+    )
+
+
+def test_failures_back_off_then_give_up(smtp_down, app):
+    queue(app)
+    with app.app_context():
+        assert mail_outbox.deliver_due() == 1
+        # Rescheduled into the future, so nothing is due now.
+        assert mail_outbox.deliver_due() == 0
+    message = outbox(app)[0]
+    assert (message.status, message.attempts) == ("pending", 1)
+    assert message.next_attempt_at > utcnow()
+
+    with app.app_context():
+        for _ in range(app.config["MAIL_MAX_ATTEMPTS"] - 1):
+            db.session.get(OutboxMessage, message.id).next_attempt_at = utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            mail_outbox.deliver_due()
+    message = outbox(app)[0]
+    assert (message.status, message.attempts) == ("failed", app.config["MAIL_MAX_ATTEMPTS"])
+
+
+def test_pending_mail_is_sent_after_restart(smtp, settings, app, client, monkeypatch):
+    # Mail left by a previous process; nothing in this one has called wake().
+    queue(app, 2)
+    app.config["MAIL_OUTBOX_BACKGROUND"] = True
+    monkeypatch.setattr(mail_outbox, "_started_pid", None)
+    monkeypatch.setattr(mail_outbox, "_thread", None)
+    client.get("/health")
+    deadline = time.monotonic() + 10
+    while mail_outbox._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert [m.status for m in outbox(app)] == ["sent", "sent"]
+    # The thread exits once the outbox is empty.
+    assert mail_outbox._thread is None
+
+
+def test_contact_form_mail_reaches_smtp(smtp, settings, app, client):
+    client.post(
+        "/contact",
+        data={
+            "name": "Ada",
+            "number": "555-0100",
+            "email": "ada@example.com",
+            "message": "Hello there, nice blog!",
+        },
+    )
+    with app.app_context():
+        mail_outbox.deliver_due()
+    [(recipients, data)] = smtp.messages
+    assert recipients == ["owner@example.com"]
+    assert b"New Contact: Ada" in data
@@ -0,0 +1,57 @@
+import pytest
+
+from .conftest import login
+
+
+def test_disabled_by_default(client):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_token_required(app, client):
+    app.config["METRICS_TOKEN"] = "s3cret"
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+
+
+@pytest.mark.parametrize(
+    "allowed, address, status",
+    [
+        ("127.0.0.1", "127.0.0.1", 200),
+        ("10.0.0.0/8, 192.168.1.5", "10.1.2.3", 200),
+        ("10.0.0.0/8", "127.0.0.1", 403),
+        ("::1", "127.0.0.1", 403),
+    ],
+)
+def test_ip_allowlist(app, client, allowed, address, status):
+    app.config["METRICS_ALLOWED_IPS"] = allowed
+    response = client.get("/metrics", environ_overrides={"REMOTE_ADDR": address})
+    assert response.status_code == status
+
+
+def test_token_or_allowlist(app, client):
+    app.config.update(METRICS_TOKEN="s3cret", METRICS_ALLOWED_IPS="10.0.0.0/8")
+    outside = {"REMOTE_ADDR": "203.0.113.7"}
+    assert client.get("/metrics", environ_overrides=outside).status_code == 401
+    assert (
+        client.get(
+            "/metrics", environ_overrides=outside, headers={"Authorization": "Bearer s3cret"}
+        ).status_code
+        == 200
+    )
+    assert client.get("/metrics", environ_overrides={"REMOTE_ADDR": "10.0.0.9"}).status_code == 200
+
+
+def test_password_hash_gauges(app, client, users):
+    app.config["METRICS_TOKEN"] = "s3cret"
+    assert login(client, users[0]).status_code == 302
+    body = client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).data.decode()
+    samples = dict(
+        line.rsplit(" ", 1) for line in body.splitlines() if line.startswith("blog_password_hash_")
+    )
+    assert samples["blog_password_hash_in_flight"] == "0"
+    assert int(samples["blog_password_hash_peak_in_flight"]) >= 1
+    assert float(samples['blog_password_hash_latency_seconds{stat="max"}']) > 0
+    assert float(samples['blog_password_hash_latency_seconds{stat="avg"}']) > 0
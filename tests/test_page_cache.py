@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.extensions import cache
+
+from .conftest import login
+
+
+@pytest.fixture
+def page_keys(monkeypatch):
+    """Keys of every page stored in the cache."""
+    keys = []
+    set_ = cache.set
+
+    def recording(key, *args, **kwargs):
+        if key.startswith("page:"):
+            keys.append(key)
+        return set_(key, *args, **kwargs)
+
+    monkeypatch.setattr(cache, "set", recording)
+    return keys
+
+
+def test_anonymous_pages_are_shared(client, posts, page_keys):
+    assert client.get("/").headers["X-Page-Cache"] == "miss"
+    assert client.get("/").headers["X-Page-Cache"] == "hit"
+    assert client.get("/about").headers["X-Page-Cache"] == "miss"
+    assert len(page_keys) == 2
+
+
+def test_unknown_query_parameters_bypass_the_cache(client, posts, page_keys):
+    for i in range(5):
+        response = client.get(f"/?x={i}")
+        assert response.status_code == 200
+        assert "X-Page-Cache" not in response.headers
+    assert "X-Page-Cache" not in client.get("/about?utm_source=feed").headers
+    assert "X-Page-Cache" not in client.get("/post/3?x=1").headers
+    assert page_keys == []
+
+
+def test_key_uses_only_the_parameters_the_view_reads(client, posts, page_keys):
+    first = client.get("/?page=2")
+    assert first.headers["X-Page-Cache"] == "miss"
+    assert client.get("/?page=2").headers["X-Page-Cache"] == "hit"
+    # The same parameters in another order share one entry.
+    assert client.get("/?page=2&after=x").headers["X-Page-Cache"] == "miss"
+    assert client.get("/?after=x&page=2").headers["X-Page-Cache"] == "hit"
+    assert len(page_keys) == 2
+
+
+def test_listing_and_posts_revalidate(client, posts):
+    response = client.get("/")
+    # Dated by the newest post, not by when the cache token was minted.
+    assert response.last_modified == datetime(2025, 1, 12, tzinfo=timezone.utc)
+    etag = response.headers["ETag"]
+    revalidated = client.get("/", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    since = {"If-Modified-Since": response.headers["Last-Modified"]}
+    assert client.get("/", headers=since).status_code == 304
+
+    post_etag = client.get("/post/3").headers["ETag"]
+    assert client.get("/post/3", headers={"If-None-Match": post_etag}).status_code == 304
+
+
+def test_new_comment_changes_validators(client, users, posts):
+    etag = client.get("/").headers["ETag"]
+    post_etag = client.get("/post/3").headers["ETag"]
+    assert login(client, users[1]).status_code == 302
+    client.post("/post/3", data={"text": "<p>A new comment</p>"})
+    client.get("/logout")
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 200
+    response = client.get("/post/3", headers={"If-None-Match": post_etag})
+    assert response.status_code == 200
+    assert b"A new comment" in response.data
+
+
+@pytest.fixture
+def no_page_cache(settings):
+    settings["ANONYMOUS_PAGE_CACHE"] = False
+
+
+def test_pages_with_a_csrf_token_are_not_revalidated(no_page_cache, client, posts):
+    response = client.get("/")
+    assert b'name="csrf-token"' in response.data
+    assert "ETag" not in response.headers
+    assert client.get("/", headers={"If-None-Match": "*"}).status_code == 200
+    assert client.get("/post/3", headers={"If-None-Match": "*"}).status_code == 200
+    # Feeds have no per-visitor content.
+    etag = client.get("/feed.xml").headers["ETag"]
+    assert client.get("/feed.xml", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_uncached_query_strings_are_not_revalidated(client, posts):
+    response = client.get("/?x=1")
+    assert "ETag" not in response.headers
+    assert client.get("/?x=1", headers={"If-None-Match": "*"}).status_code == 200
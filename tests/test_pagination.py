@@ -0,0 +1,79 @@
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import BlogPost
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_paginate
+from app.routes import POST_LISTING_KEY
+
+
+def page(app, **kwargs):
+    with app.app_context():
+        result = keyset_paginate(
+            db.session, select(BlogPost), POST_LISTING_KEY, per_page=5, **kwargs
+        )
+        ids = [post.id for post in result.items]
+        return ids, result.has_prev, result.has_next, result.prev_cursor, result.next_cursor
+
+
+def test_cursor_round_trip():
+    values = [datetime(2025, 1, 12, 8, 30), 12]
+    token = encode_cursor(values)
+    assert "=" not in token
+    assert decode_cursor(token, POST_LISTING_KEY) == values
+
+
+@pytest.mark.parametrize(
+    "token",
+    ["!!!", "bm90IGpzb24", encode_cursor([1]), encode_cursor(["yesterday", 3])],
+)
+def test_invalid_cursor(client, posts, token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token, POST_LISTING_KEY)
+    assert client.get(f"/?after={token}").status_code == 400
+    assert client.get(f"/?before={token}").status_code == 400
+
+
+def test_walk_forward_and_back(app, posts):
+    ids, has_prev, has_next, _, cursor = page(app)
+    assert ids == [12, 11, 10, 9, 8]
+    assert (has_prev, has_next) == (False, True)
+
+    ids, has_prev, has_next, back, cursor = page(app, after=cursor)
+    assert ids == [7, 6, 5, 4, 3]
+    assert (has_prev, has_next) == (True, True)
+
+    ids, has_prev, has_next, _, last = page(app, after=cursor)
+    assert ids == [2, 1]
+    assert (has_prev, has_next) == (True, False)
+    assert last is None
+
+    ids, has_prev, has_next, _, _ = page(app, before=back)
+    assert ids == [12, 11, 10, 9, 8]
+    assert (has_prev, has_next) == (False, True)
+
+
+def test_edges(app, posts):
+    newest = encode_cursor([datetime(2025, 1, 12), 12])
+    oldest = encode_cursor([datetime(2025, 1, 1), 1])
+    assert page(app, before=newest)[:3] == ([], False, True)
+    assert page(app, after=oldest)[:3] == ([], True, False)
+    assert page(app, before=oldest)[:3] == ([6, 5, 4, 3, 2], True, True)
+
+    # Nothing is left from the cursor on, e.g. after those posts were deleted.
+    past_the_end = encode_cursor([datetime(2024, 1, 1), 0])
+    assert page(app, before=past_the_end)[:3] == ([5, 4, 3, 2, 1], True, False)
+
+
+def test_listing_links(client, posts):
+    html = client.get("/").get_data(as_text=True)
+    assert "before=" not in html
+    after = re.search(r'href="/\?after=([\w-]+)"', html).group(1)
+    html = client.get(f"/?after={after}").get_data(as_text=True)
+    assert "Post 6" in html and "Post 7" not in html
+    before = re.search(r'href="/\?before=([\w-]+)"', html).group(1)
+    html = client.get(f"/?before={before}").get_data(as_text=True)
+    assert "Post 11" in html and "before=" not in html
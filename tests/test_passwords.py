@@ -0,0 +1,57 @@
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app.passwords import HashPoolBusy, PasswordHasher
+
+
+def make_hasher(workers=0, max_queue=0, timeout=None):
+    hasher = PasswordHasher()
+    hasher.method = "pbkdf2:sha256:1000"
+    hasher.workers = workers
+    hasher.max_queue = max_queue
+    hasher.timeout = timeout
+    return hasher
+
+
+def test_hash_and_verify():
+    hasher = make_hasher()
+    pwhash = hasher.hash("secret")
+    assert hasher.verify(pwhash, "secret")
+    assert not hasher.verify(pwhash, "wrong")
+    assert not hasher.needs_rehash(pwhash)
+    assert hasher.needs_rehash(pwhash.replace(":1000", ":2000", 1))
+
+
+@pytest.mark.parametrize("method", ["scrypt", "pbkdf2", "pbkdf2:sha256"])
+def test_method_without_parameters_does_not_rehash(method):
+    hasher = make_hasher()
+    hasher.method = method
+    assert not hasher.needs_rehash(hasher.hash("secret"))
+    assert hasher.needs_rehash(generate_password_hash("secret", "pbkdf2:sha256:1000"))
+
+
+def test_pool_hash_and_verify():
+    hasher = make_hasher(workers=1, timeout=30)
+    assert hasher.verify(hasher.hash("secret"), "secret")
+    assert hasher.stats()["in_flight"] == 0
+
+
+def test_timed_out_job_keeps_its_slot():
+    hasher = make_hasher(workers=1, max_queue=0, timeout=0.05)
+    hasher.hash("warm up the pool")
+    with pytest.raises(HashPoolBusy, match="timed out"):
+        hasher._run(time.sleep, 1.0)
+    # The sleep is still running in the only pool process, so no more work
+    # may be admitted until it finishes.
+    assert hasher.stats()["in_flight"] == 1
+    with pytest.raises(HashPoolBusy, match="queue is full"):
+        hasher.hash("secret")
+    deadline = time.monotonic() + 10
+    while hasher.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert hasher.stats()["in_flight"] == 0
+    hasher.timeout = 30
+    assert hasher.verify(hasher.hash("secret"), "secret")
+    assert hasher.stats()["rejected"] == 1
@@ -0,0 +1,39 @@
+import re
+
+import pytest
+
+from app.instrumentation import QueryBudgetExceeded
+
+from .conftest import login
+
+
+def test_home_within_budget(client, posts):
+    response = client.get("/")
+    assert response.status_code == 200
+    assert b"Post 11" in response.data
+
+
+def test_home_cursor_page_within_budget(client, posts):
+    first = client.get("/").get_data(as_text=True)
+    cursor = re.search(r'href="(/\?after=[^"]+)"', first).group(1)
+    response = client.get(cursor.replace("&amp;", "&"))
+    assert response.status_code == 200
+    assert b"Post 6" in response.data
+
+
+def test_post_with_many_comments_within_budget(client, posts):
+    response = client.get("/post/12")
+    assert response.status_code == 200
+    assert b"Comment 0" in response.data
+
+
+def test_post_within_budget_when_logged_in(client, users, posts):
+    assert login(client, users[1]).status_code == 302
+    response = client.get("/post/12")
+    assert response.status_code == 200
+
+
+def test_overrun_raises(app, client, posts, monkeypatch):
+    monkeypatch.setattr(app.view_functions["main.home"], "query_budget", 0)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get("/")
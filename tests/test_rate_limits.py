@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+
+from app.limiter_storage import SQLiteStorage
+
+from .test_contact import FORM
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STRATEGIES = [FixedWindowRateLimiter, MovingWindowRateLimiter]
+
+
+@pytest.fixture
+def uri(tmp_path):
+    return f"sqlite:///{tmp_path}/limits.db"
+
+
+def test_uri_selects_sqlite_storage(uri, tmp_path):
+    storage = storage_from_string(uri)
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.path == f"{tmp_path}/limits.db"
+    assert storage.check()
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_limit_is_enforced(uri, strategy):
+    limiter = strategy(storage_from_string(uri))
+    limit = parse("5/minute")
+    assert all(limiter.hit(limit, "contact", "1.2.3.4") for _ in range(5))
+    assert not limiter.hit(limit, "contact", "1.2.3.4")
+    # Other clients have their own counters.
+    assert limiter.hit(limit, "contact", "5.6.7.8")
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_workers_share_counters(uri, strategy):
+    # Three hits from another process count against this one's limit.
+    script = (
+        "import app.limiter_storage\n"
+        "from limits import parse\n"
+        "from limits.storage import storage_from_string\n"
+        f"from limits.strategies import {strategy.__name__}\n"
+        f"limiter = {strategy.__name__}(storage_from_string({uri!r}))\n"
+        "assert all(limiter.hit(parse('5/minute'), 'contact', 'ip') for _ in range(3))\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+    limiter = strategy(storage_from_string(uri))
+    limit = parse("5/minute")
+    assert limiter.hit(limit, "contact", "ip")
+    assert limiter.hit(limit, "contact", "ip")
+    assert not limiter.hit(limit, "contact", "ip")
+
+
+def test_fixed_window_counter_expires(uri, monkeypatch):
+    storage = storage_from_string(uri)
+    assert storage.incr("k", 60) == 1
+    assert storage.incr("k", 60) == 2
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert storage.get("k") == 0
+    assert storage.incr("k", 60) == 1
+
+
+def test_reset_clears_everything(uri):
+    limiter = MovingWindowRateLimiter(storage_from_string(uri))
+    limiter.hit(parse("1/minute"), "a")
+    FixedWindowRateLimiter(limiter.storage).hit(parse("1/minute"), "b")
+    limiter.storage.reset()
+    assert limiter.hit(parse("1/minute"), "a")
+
+
+def test_contact_form_is_rate_limited(settings, uri, request):
+    settings.update(RATELIMIT_ENABLED=True, RATELIMIT_STORAGE_URI=uri)
+    client = request.getfixturevalue("client")
+    statuses = [client.post("/contact", data=FORM).status_code for _ in range(6)]
+    assert statuses == [302] * 5 + [429]
@@ -0,0 +1,105 @@
+"""Read replicas against two SQLite files: the replica is a .backup copy
+of the primary, refreshed by `replicate()`."""
+import sqlite3
+
+import pytest
+from flask import g
+
+from app.extensions import db
+
+from .conftest import login
+
+# Configure the replica before any test creates the app.
+pytestmark = pytest.mark.usefixtures("replica")
+
+
+@pytest.fixture
+def replica(settings, tmp_path):
+    settings.update(
+        SQLALCHEMY_BINDS={"replica1": f"sqlite:///{tmp_path}/replica.db"},
+        REPLICA_CHECK_INTERVAL=0,
+        ANONYMOUS_PAGE_CACHE=False,
+    )
+    return tmp_path / "replica.db"
+
+
+@pytest.fixture
+def replicated(replica, app, posts):
+    """Seeded primary and an up-to-date replica; returns the replicate function
+    and the list of databases each request read from."""
+    primary = app.config["SQLALCHEMY_DATABASE_URI"].split("///", 1)[1]
+
+    def replicate():
+        with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+            source.backup(target)
+
+    reads = []
+
+    @app.after_request
+    def record_read(response):
+        reads.append(g.get("db_read_target"))
+        return response
+
+    replicate()
+    return replicate, reads
+
+
+def write_behind_replicas(app, title):
+    """Change the primary without a heartbeat, as if replication had not run."""
+    primary = app.config["SQLALCHEMY_DATABASE_URI"].split("///", 1)[1]
+    with sqlite3.connect(primary) as conn:
+        conn.execute("UPDATE blog_posts SET title = ? WHERE id = 12", (title,))
+
+
+def test_reads_go_to_a_caught_up_replica(app, client, replicated):
+    _, reads = replicated
+    write_behind_replicas(app, "Only on the primary")
+    response = client.get("/")
+    assert reads == ["replica1"]
+    assert b"Only on the primary" not in response.data
+    assert b"Post 11" in response.data
+
+
+def test_writes_and_other_views_use_the_primary(app, client, users, replicated):
+    _, reads = replicated
+    assert login(client, users[0]).status_code == 302
+    client.get("/search?q=post")
+    assert reads[-1] in (None, "primary")
+
+
+def test_writer_reads_own_write_until_replica_catches_up(app, client, users, replicated):
+    replicate, reads = replicated
+    assert login(client, users[0]).status_code == 302
+    client.post(
+        "/edit-post/12",
+        data={
+            "title": "Edited",
+            "subtitle": "Subtitle",
+            "img_url": "https://example.com/header.jpg",
+            "body": "<p>Body</p>",
+        },
+    )
+    response = client.get("/post/12")
+    assert reads[-1] == "primary"
+    assert b"Edited" in response.data
+
+    # Other visitors wait for the replica too, through the shared fence.
+    anonymous = app.test_client()
+    assert b"Edited" in anonymous.get("/").data
+    assert reads[-1] == "primary"
+
+    replicate()
+    assert b"Edited" in anonymous.get("/").data
+    assert reads[-1] == "replica1"
+
+
+def test_unavailable_replica_falls_back_to_primary(app, client, replicated, replica):
+    _, reads = replicated
+    with app.app_context():
+        db.engines["replica1"].dispose()
+    replica.unlink()
+    # An empty file has no heartbeat table, so the replica cannot be read.
+    replica.touch()
+    response = client.get("/")
+    assert response.status_code == 200
+    assert reads == ["primary"]
@@ -0,0 +1,101 @@
+from concurrent.futures import Future
+
+import pytest
+from sqlalchemy import select, update
+
+from app import commands, sanitize
+from app.extensions import db
+from app.models import BlogPost, Comment
+
+
+@pytest.fixture
+def new_policy(monkeypatch):
+    """Policy 2 no longer allows <b>."""
+    monkeypatch.setattr(commands, "POLICY_VERSION", 2)
+    monkeypatch.setattr(
+        sanitize, "ALLOWED_TAGS", [tag for tag in sanitize.ALLOWED_TAGS if tag != "b"]
+    )
+
+
+def add_bold(app):
+    with app.app_context():
+        post = db.session.get(BlogPost, 1)
+        post.body = post.body_raw = "<p><b>Bold</b> text</p>"
+        comment = db.session.scalar(select(Comment).order_by(Comment.id))
+        comment.text = comment.text_raw = "<p><b>Hi</b></p>"
+        db.session.commit()
+        return comment.id
+
+
+def test_policy_bump_recleans_old_rows(app, posts, new_policy):
+    comment_id = add_bold(app)
+    with app.app_context():
+        versions = dict(db.session.execute(select(BlogPost.id, BlogPost.version)).all())
+
+    result = app.test_cli_runner().invoke(
+        args=["sanitize", "--workers", "2", "--batch-size", "5"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "blog_posts: 12 rows at policy 2, 1 changed." in result.output
+    assert "comments: 60 rows at policy 2, 1 changed." in result.output
+
+    with app.app_context():
+        post = db.session.get(BlogPost, 1)
+        assert "<b>" not in post.body
+        assert post.body_raw == "<p><b>Bold</b> text</p>"
+        assert "<b>" not in db.session.get(Comment, comment_id).text
+        assert set(db.session.scalars(select(BlogPost.sanitize_policy))) == {2}
+        assert set(db.session.scalars(select(Comment.sanitize_policy))) == {2}
+        # Post 1's body and post 12's comment changed; nothing else did.
+        bumped = {
+            post_id
+            for post_id, version in db.session.execute(select(BlogPost.id, BlogPost.version))
+            if version != versions[post_id]
+        }
+        assert bumped == {1, 12}
+        assert db.session.get(BlogPost, 2).body == "<p>Body 1</p>"
+
+
+class EditingPool:
+    """Cleans inline, but lets `edit` commit before the first results are written."""
+
+    def __init__(self, edit):
+        self.edit = edit
+
+    def submit(self, func, *args):
+        if self.edit:
+            self.edit()
+            self.edit = None
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+def test_edit_during_resanitize_is_kept(app, posts, new_policy):
+    add_bold(app)
+
+    def admin_edit():
+        # Committed on its own connection by an instance still on policy 1.
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(BlogPost)
+                .where(BlogPost.id == 1)
+                .values(body="<p>Edited</p>", body_raw="<p>Edited</p>")
+            )
+
+    with app.app_context():
+        done, changed = commands._resanitize(
+            EditingPool(admin_edit), 1, BlogPost, BlogPost.body_raw, BlogPost.body,
+            BlogPost.id, 500,
+        )
+        assert (done, changed) == (12, 0)
+        post = db.session.get(BlogPost, 1)
+        assert (post.body, post.sanitize_policy) == ("<p>Edited</p>", 1)
+
+        # The next run re-cleans the edited text.
+        commands._resanitize(
+            EditingPool(None), 1, BlogPost, BlogPost.body_raw, BlogPost.body,
+            BlogPost.id, 500,
+        )
+        post = db.session.get(BlogPost, 1)
+        assert (post.body, post.sanitize_policy) == ("<p>Edited</p>", 2)
@@ -0,0 +1,99 @@
+from sqlalchemy import text
+
+from app.extensions import db
+
+from .conftest import login
+
+
+def results(client, q, **params):
+    response = client.get("/search.json", query_string={"q": q, **params})
+    assert response.status_code == 200
+    return response.json
+
+
+def titles(client, q):
+    return [hit["title"] for hit in results(client, q)["results"]]
+
+
+def new_post(client, title, body, subtitle="Subtitle"):
+    return client.post(
+        "/new-post",
+        data={
+            "title": title,
+            "subtitle": subtitle,
+            "img_url": "https://example.com/header.jpg",
+            "body": body,
+        },
+    )
+
+
+def test_rebuild_indexes_every_post(app, client, posts):
+    # The fixture inserts posts directly, so nothing is indexed yet.
+    assert titles(client, "body") == []
+    with app.app_context():
+        db.session.execute(
+            text("INSERT INTO post_search (rowid, title, subtitle, body) VALUES (99, 'Gone', '', '')")
+        )
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["search", "rebuild", "--batch-size", "5"])
+    assert result.exit_code == 0, result.output
+    assert "Indexed 5 posts (up to id 5)." in result.output
+    assert "Indexed 12 posts (up to id 12)." in result.output
+    assert "Done: 12 posts indexed, 1 stale entries removed." in result.output
+
+    first = results(client, "body")
+    assert len(first["results"]) == 10 and first["has_next"]
+    second = results(client, "body", page=2)
+    assert len(second["results"]) == 2 and not second["has_next"]
+    assert titles(client, "gone") == []
+
+    # Running it again leaves one entry per post.
+    result = app.test_cli_runner().invoke(args=["search", "rebuild"])
+    assert "Done: 12 posts indexed, 0 stale entries removed." in result.output
+    assert len(results(client, "body", page=2)["results"]) == 2
+
+
+def test_post_writes_keep_the_index_current(client, users, posts):
+    assert login(client, users[0]).status_code == 302
+    assert new_post(client, "Zeppelins", "<p>Airships over the <b>harbour</b></p>").status_code == 302
+
+    [hit] = results(client, "zeppel")["results"]
+    assert hit["title"] == "<mark>Zeppelins</mark>"
+    assert "<mark>harbour</mark>" in results(client, "harbour")["results"][0]["snippet"]
+    post_id = hit["id"]
+
+    client.post(
+        f"/edit-post/{post_id}",
+        data={
+            "title": "Balloons",
+            "subtitle": "Subtitle",
+            "img_url": "https://example.com/header.jpg",
+            "body": "<p>Hot air</p>",
+        },
+    )
+    assert titles(client, "zeppelins") == []
+    assert titles(client, "balloons") == ["<mark>Balloons</mark>"]
+
+    client.post(f"/delete/{post_id}")
+    assert titles(client, "balloons") == []
+
+
+def test_title_matches_rank_first(client, users, posts):
+    login(client, users[0])
+    new_post(client, "Notes", "<p>Thoughts about gardening</p>")
+    new_post(client, "Gardening", "<p>Notes</p>")
+    assert titles(client, "gardening") == ["<mark>Gardening</mark>", "Notes"]
+
+
+def test_query_syntax_is_matched_literally(client, users, posts):
+    login(client, users[0])
+    new_post(client, "A <script> & quotes", "<p>Operators AND title: NEAR</p>")
+    for q in ('title:operators', '"unbalanced', "near(", "AND OR NOT"):
+        assert results(client, q)["query"] == q
+    assert titles(client, "***") == []
+    assert titles(client, "") == []
+    # Titles are escaped before the markers become <mark>.
+    assert titles(client, "script") == ["A &lt;<mark>script</mark>&gt; &amp; quotes"]
+    page = client.get("/search?q=script").data
+    assert b"&lt;<mark>script</mark>&gt;" in page
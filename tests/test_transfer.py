@@ -0,0 +1,78 @@
+import json
+
+from sqlalchemy import func, select
+
+from app.extensions import cache, db
+from app.models import BlogPost, Comment, User
+
+
+def count_rows(app):
+    with app.app_context():
+        return tuple(
+            db.session.scalar(select(func.count()).select_from(model))
+            for model in (User, BlogPost, Comment)
+        )
+
+
+def blog(app, *args):
+    result = app.test_cli_runner().invoke(args=["blog", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_export_import_round_trip(app, posts, tmp_path):
+    path = str(tmp_path / "blog.jsonl")
+    blog(app, "export", path, "--batch-size", "7")
+    with app.app_context():
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+    cache.clear()
+    assert count_rows(app) == (0, 0, 0)
+
+    output = blog(app, "import", path, "--batch-size", "5", "--workers", "1")
+    assert "Imported 2 users, 12 posts and 60 comments" in output
+    assert count_rows(app) == (2, 12, 60)
+    with app.app_context():
+        post = db.session.scalar(select(BlogPost).where(BlogPost.title == "Post 11"))
+        assert post.comment_count == 60
+        assert post.author.email == "admin@example.com"
+        assert {c.author.email for c in post.comments} == {"bob@example.com"}
+    hits = app.test_client().get("/search.json?q=body").json["results"]
+    assert len(hits) == 10
+
+    output = blog(app, "import", path, "--workers", "1")
+    assert "Imported 0 users, 0 posts and 0 comments" in output
+    assert "skipped 2 existing users, 12 existing posts and their 60 comments" in output
+    assert count_rows(app) == (2, 12, 60)
+
+
+def test_repeated_email_and_title_in_one_file(app, tmp_path):
+    user = {"type": "user", "name": "Ada", "password": "x", "email": "ada@example.com"}
+    post = {
+        "type": "post",
+        "author_id": 2,
+        "title": "Same title",
+        "subtitle": "Subtitle",
+        "img_url": "https://example.com/a.jpg",
+        "body": "<p>Body</p>",
+    }
+    comment = {"type": "comment", "author_id": 2, "text": "<p>Hi</p>"}
+    records = [
+        {"type": "header", "format": 1},
+        {**user, "id": 1},
+        {**user, "id": 2, "name": "Ada again"},
+        {**post, "id": 1},
+        {**post, "id": 2},
+        {**comment, "id": 1, "post_id": 1},
+        {**comment, "id": 2, "post_id": 2},
+    ]
+    path = tmp_path / "blog.jsonl"
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+    output = blog(app, "import", str(path), "--workers", "1")
+    assert "Imported 1 users, 1 posts and 1 comments" in output
+    with app.app_context():
+        [post] = db.session.scalars(select(BlogPost)).all()
+        # The repeated user's records point at the first one.
+        assert post.author.name == "Ada"
+        assert post.comment_count == 1